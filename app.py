@@ -1,12 +1,14 @@
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'app')))
-import os
-wkhtmltopdf_path = r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
-os.environ['WKHTMLTOPDF_PATH'] = wkhtmltopdf_path
 from flask import Flask
 from config import config
 from models import db
+from pdf_cache import pdf_cache
+from invoice_pdfs import invoice_pdfs
+from archive import invoice_archive
+from html_to_pdf import init_renderer
+from metrics import init_metrics
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from logging.config import dictConfig
@@ -14,22 +16,37 @@ from logging.config import dictConfig
 migrate = Migrate()
 login_manager = LoginManager()
 
-def create_app(config_name):
+def create_app(config_name, overrides=None):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    if overrides:
+        app.config.update(overrides)
 
     db.init_app(app)
-    migrate.init_app(app, db)
+    migrate.init_app(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
     login_manager.init_app(app)
+    pdf_cache.init_app(app)
+    invoice_pdfs.init_app(app)
+    invoice_archive.init_app(app)
+    init_renderer(app)
+    init_metrics(app)
 
-    from models import User
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(user_id)
+    from user_cache import load_user
+    login_manager.user_loader(load_user)
 
     from routes import blueprint
     app.register_blueprint(blueprint)
 
+    from commands import billing_cli, export_cli, pdfs_cli, revenue_cli, partitions_cli, archive_cli, worker_command, import_command
+    app.cli.add_command(billing_cli)
+    app.cli.add_command(export_cli)
+    app.cli.add_command(pdfs_cli)
+    app.cli.add_command(revenue_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(import_command)
+
     configure_logging(app)
 
     return app
@@ -45,6 +62,10 @@ def configure_logging(app):
             'stream': 'ext://flask.logging.wsgi_errors_stream',
             'formatter': 'default'
         }},
+        'loggers': {
+            # Created at import time, so it has to be listed or dictConfig disables it.
+            'invoices.slow_query': {'level': 'WARNING'}
+        },
         'root': {
             'level': 'INFO' if app.config['ENV'] == 'production' else 'DEBUG',
             'handlers': ['wsgi']
@@ -0,0 +1,357 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import and_, true
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from models import (db, Invoice, InvoiceLineItem, FeeHistory, EditedInvoice, BillingRunClient, Biller, Client, Issuer, FeeMaster,
+                    ArchivedYear, ArchivedInvoice, ArchivedFeeCharge)
+from ids import financial_year
+from revenue import revenue_totals, MONTHLY_KEYS, MONTHLY_SUMS, FEE_KEYS, FEE_SUMS
+from functions import month_range
+
+# Closed financial years (April to March) of invoices, their line items and fee_history move
+# out of the database into gzip-compressed JSON Lines files under ARCHIVE_DIR/<year>/: one
+# file per invoice month (each invoice with its line items), one for fee_history, and the
+# edited_invoices and billing_run_clients rows that pointed at the archived invoices, and the
+# year's revenue totals for `flask revenue rebuild`. A manifest lists every file with its
+# SHA-256 and row count; the manifest's own checksum is in archived_years. Files are checked
+# against their checksums whenever they are read.
+#
+# What stays behind: an archived_invoices stub per invoice (what invoice_history lists, and
+# which file has the rest), and archived_fee_charges, fee_history folded per client, fee and
+# calendar year, which the One-time and Yearly eligibility checks read. view_invoice and
+# download_invoice read archived invoices back from their month file (kept in a small LRU).
+# Stored PDFs stay where they are. An edit chain with invoices in another year stays in the
+# database whole, so each archived year's edits are self-contained.
+
+BATCH_SIZE = 1000
+
+def year_bounds(year):
+    # '2023-24' -> (2023-04-01, 2024-04-01)
+    try:
+        start = date(int(year[:4]), 4, 1)
+    except ValueError:
+        raise ValueError(f'financial year {year!r} is not YYYY-YY')
+    if financial_year(start) != year:
+        raise ValueError(f'financial year {year!r} is not YYYY-YY')
+    return start, start.replace(year=start.year + 1)
+
+def _to_json(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def _record(model, row):
+    return {column.name: _to_json(getattr(row, column.name)) for column in model.__table__.columns}
+
+def _columns(model, values):
+    # Back from _record: keyword arguments for `model`.
+    kwargs = {}
+    for column in model.__table__.columns:
+        value = values.get(column.name)
+        if value is not None:
+            python_type = column.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is date:
+                value = date.fromisoformat(value)
+            elif python_type is Decimal:
+                value = Decimal(value)
+        kwargs[column.name] = value
+    return kwargs
+
+class InvoiceArchive:
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.cache_size = 8
+        self._files = OrderedDict()
+        self._manifests = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+        self.cache_size = app.config.get('ARCHIVE_CACHE_FILES', 8)
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['invoice_archive'] = self
+
+    def path(self, relative):
+        return os.path.join(self.directory, relative)
+
+    def write(self, directory, name, records):
+        # Returns the file's manifest entry.
+        target = os.path.join(directory, name)
+        digest, rows = hashlib.sha256(), 0
+        with open(target, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', filename='', mtime=0) as f:
+                for record in records:
+                    f.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+                    rows += 1
+            raw.flush()
+            os.fsync(raw.fileno())
+        with open(target, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return {'sha256': digest.hexdigest(), 'rows': rows, 'bytes': os.path.getsize(target)}
+
+    def _read_verified(self, relative, sha256):
+        with open(self.path(relative), 'rb') as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise ValueError(f'Archive file {relative} does not match its checksum')
+        return data
+
+    def manifest(self, year):
+        archived = ArchivedYear.query.get(year)
+        if archived is None:
+            raise LookupError(f'Financial year {year} is not archived')
+        key = (year, archived.manifest_sha256)
+        if key not in self._manifests:
+            self._manifests[key] = json.loads(self._read_verified(f'{year}/manifest.json', archived.manifest_sha256))
+        return self._manifests[key]
+
+    def records(self, relative, sha256):
+        data = self._read_verified(relative, sha256)
+        return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
+
+    def invoices(self, year, relative):
+        # {invoice_id: record} of one month file, cached by checksum.
+        manifest = self.manifest(year)
+        sha256 = manifest['files'][relative]['sha256']
+        key = (relative, sha256)
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+                return self._files[key]
+        invoices = {record['invoice_id']: record for record in self.records(relative, sha256)}
+        with self._lock:
+            self._files[key] = invoices
+            while len(self._files) > self.cache_size:
+                self._files.popitem(last=False)
+        return invoices
+
+    def verify(self, year):
+        # [(file, problem)] for one archived year.
+        problems = []
+        try:
+            manifest = self.manifest(year)
+        except (OSError, ValueError) as e:
+            return [(f'{year}/manifest.json', str(e))]
+        for relative, entry in manifest['files'].items():
+            try:
+                rows = len(self.records(relative, entry['sha256']))
+            except (OSError, ValueError) as e:
+                problems.append((relative, str(e)))
+                continue
+            if rows != entry['rows']:
+                problems.append((relative, f"{rows} rows, manifest says {entry['rows']}"))
+        return problems
+
+invoice_archive = InvoiceArchive()
+
+def archived_invoice(invoice_id):
+    # An Invoice (with line items) rebuilt from the archive, never added to the session;
+    # None if the invoice isn't archived.
+    stub = ArchivedInvoice.query.get(invoice_id)
+    if stub is None:
+        return None
+    record = invoice_archive.invoices(stub.financial_year, stub.archive_file)[invoice_id]
+    invoice = Invoice(**_columns(Invoice, record))
+    invoice.archived = True
+    fees = {fee.fee_id: fee for fee in FeeMaster.query.filter(FeeMaster.fee_id.in_({line['fee_id'] for line in record['line_items']}))}
+    line_items = []
+    for values in record['line_items']:
+        line = InvoiceLineItem(**_columns(InvoiceLineItem, values))
+        set_committed_value(line, 'fee', fees.get(line.fee_id))
+        set_committed_value(line, 'invoice', invoice)
+        line_items.append(line)
+    # Set as loaded values, so no backref puts the copy into the session.
+    set_committed_value(invoice, 'line_items', line_items)
+    set_committed_value(invoice, 'biller', Biller.query.get(invoice.biller_id) if invoice.biller_id else None)
+    set_committed_value(invoice, 'client', Client.query.get(invoice.client_id) if invoice.client_id else None)
+    set_committed_value(invoice, 'issuer', Issuer.query.get(invoice.issuer_id) if invoice.issuer_id else None)
+    return invoice
+
+def archived_revenue():
+    # [(monthly, by_fee)] revenue totals of each archived year, as revenue.revenue_totals gives them.
+    totals = []
+    for year, in db.session.query(ArchivedYear.financial_year).order_by(ArchivedYear.financial_year):
+        files = invoice_archive.manifest(year)['files']
+        year_totals = []
+        for name, keys, counts in (('revenue_monthly', MONTHLY_KEYS, 1), ('revenue_by_fee', FEE_KEYS, 2)):
+            relative = f'{year}/{name}.jsonl.gz'
+            totals_by_key = {}
+            for row in invoice_archive.records(relative, files[relative]['sha256']):
+                key, sums = row[:len(keys)], row[len(keys):]
+                totals_by_key[tuple(key[:-1]) + (date.fromisoformat(key[-1]),)] = (
+                    [int(value) for value in sums[:counts]] + [Decimal(value) for value in sums[counts:]])
+            year_totals.append(totals_by_key)
+        totals.append(tuple(year_totals))
+    return totals
+
+def _kept_chains(start, end):
+    # IDs of invoices in [start, end) whose edit chain has invoices outside it.
+    original, edited = aliased(Invoice), aliased(Invoice)
+    chains = {}
+    rows = db.session.query(EditedInvoice.original_invoice_id, original.invoice_date, EditedInvoice.edited_invoice_id, edited.invoice_date
+                            ).join(original, original.invoice_id == EditedInvoice.original_invoice_id
+                            ).join(edited, edited.invoice_id == EditedInvoice.edited_invoice_id)
+    for original_id, original_date, edited_id, edited_date in rows:
+        chain = chains.setdefault(original_id, {original_id: original_date})
+        chain[edited_id] = edited_date
+    kept = set()
+    for chain in chains.values():
+        inside = {invoice_id for invoice_id, invoice_date in chain.items() if start <= invoice_date < end}
+        if inside and len(inside) < len(chain):
+            kept |= inside
+    return kept
+
+def archive_year(year, dry_run=False, progress=None, today=None):
+    start, end = year_bounds(year)
+    current_start = year_bounds(financial_year(today or date.today()))[0]
+    if end > current_start:
+        raise ValueError(f'Financial year {year} is not closed yet')
+    if ArchivedYear.query.get(year):
+        raise ValueError(f'Financial year {year} is already archived')
+
+    kept = _kept_chains(start, end)
+    in_year = and_(Invoice.invoice_date >= start, Invoice.invoice_date < end,
+                   Invoice.invoice_id.notin_(kept) if kept else true())
+    archived_ids = db.session.query(Invoice.invoice_id).filter(in_year)
+    in_history = and_(FeeHistory.charge_date >= start, FeeHistory.charge_date < end)
+    lines_in_year = and_(InvoiceLineItem.invoice_date >= start, InvoiceLineItem.invoice_date < end,
+                         InvoiceLineItem.invoice_id.in_(archived_ids))
+    counts = {
+        'invoices': archived_ids.count(),
+        'line_items': db.session.query(InvoiceLineItem.line_item_id).filter(lines_in_year).count(),
+        'fee_history': db.session.query(FeeHistory.fee_history_id).filter(in_history).count(),
+        'kept': len(kept),
+    }
+    if dry_run:
+        return counts
+
+    final = invoice_archive.path(year)
+    staging = final + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    files, stubs, archived_lines = {}, [], 0
+
+    month = start
+    while month < end:
+        next_month = month_range(month)[1]
+        in_month = and_(in_year, Invoice.invoice_date >= month, Invoice.invoice_date < next_month)
+        invoices = db.session.query(*Invoice.__table__.columns).filter(in_month).order_by(Invoice.invoice_date, Invoice.invoice_id).all()
+        if invoices:
+            lines = {}
+            for line in db.session.query(*InvoiceLineItem.__table__.columns).join(Invoice, and_(
+                    Invoice.invoice_id == InvoiceLineItem.invoice_id, Invoice.invoice_date == InvoiceLineItem.invoice_date)
+            ).filter(in_month).order_by(InvoiceLineItem.line_item_id):
+                lines.setdefault(line.invoice_id, []).append(_record(InvoiceLineItem, line))
+            archived_lines += sum(map(len, lines.values()))
+            name = f'invoices-{month:%Y-%m}.jsonl.gz'
+            relative = f'{year}/{name}'
+            files[relative] = invoice_archive.write(staging, name, (
+                dict(_record(Invoice, invoice), line_items=lines.get(invoice.invoice_id, [])) for invoice in invoices))
+            stubs += [dict({column: getattr(invoice, column) for column in ArchivedInvoice.__table__.columns.keys()
+                            if column not in ('financial_year', 'archive_file')}, financial_year=year, archive_file=relative)
+                      for invoice in invoices]
+            if progress:
+                progress(f'{month:%Y-%m}: {len(invoices)} invoices written.')
+        month = next_month
+
+    charges = {}
+    def fee_history_records():
+        for row in db.session.query(*FeeHistory.__table__.columns).filter(in_history).order_by(
+                FeeHistory.charge_date, FeeHistory.fee_history_id).yield_per(10000):
+            key = (row.client_id or '', row.fee_id or '', row.charge_date.year)
+            summary = charges.setdefault(key, [0, 0, Decimal(0)])
+            summary[0] += 1
+            summary[1] += row.units or 0
+            summary[2] += row.total or 0
+            yield _record(FeeHistory, row)
+    files[f'{year}/fee_history.jsonl.gz'] = invoice_archive.write(staging, 'fee_history.jsonl.gz', fee_history_records())
+
+    edits = db.session.query(*EditedInvoice.__table__.columns).filter(EditedInvoice.original_invoice_id.in_(archived_ids))
+    files[f'{year}/edited_invoices.jsonl.gz'] = invoice_archive.write(
+        staging, 'edited_invoices.jsonl.gz', (_record(EditedInvoice, row) for row in edits))
+    run_clients = db.session.query(*BillingRunClient.__table__.columns).filter(BillingRunClient.invoice_id.in_(archived_ids))
+    files[f'{year}/billing_run_clients.jsonl.gz'] = invoice_archive.write(
+        staging, 'billing_run_clients.jsonl.gz', (_record(BillingRunClient, row) for row in run_clients))
+
+    monthly, by_fee = revenue_totals(in_year)
+    for name, totals in (('revenue_monthly', monthly), ('revenue_by_fee', by_fee)):
+        files[f'{year}/{name}.jsonl.gz'] = invoice_archive.write(
+            staging, f'{name}.jsonl.gz', ([_to_json(value) for value in key + tuple(sums)] for key, sums in sorted(totals.items())))
+    manifest = {
+        'financial_year': year,
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'archived_at': datetime.utcnow().isoformat(),
+        'files': files,
+        'revenue_columns': {'revenue_monthly': list(MONTHLY_KEYS + MONTHLY_SUMS), 'revenue_by_fee': list(FEE_KEYS + FEE_SUMS)},
+    }
+    manifest_data = json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8')
+    with open(os.path.join(staging, 'manifest.json'), 'wb') as f:
+        f.write(manifest_data)
+        f.flush()
+        os.fsync(f.fileno())
+    # Left over from an attempt whose database transaction didn't commit.
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(staging, final)
+
+    db.session.add(ArchivedYear(financial_year=year, start_date=start, end_date=end, invoices=len(stubs), line_items=archived_lines,
+                                fee_history=files[f'{year}/fee_history.jsonl.gz']['rows'],
+                                manifest_sha256=hashlib.sha256(manifest_data).hexdigest()))
+    db.session.flush()
+    for i in range(0, len(stubs), BATCH_SIZE):
+        db.session.execute(ArchivedInvoice.__table__.insert(), stubs[i:i + BATCH_SIZE])
+    _add_fee_charges(charges)
+
+    db.session.query(BillingRunClient).filter(BillingRunClient.invoice_id.in_(archived_ids)).update(
+        {BillingRunClient.invoice_id: None}, synchronize_session=False)
+    db.session.query(EditedInvoice).filter(EditedInvoice.original_invoice_id.in_(archived_ids)).delete(synchronize_session=False)
+    deleted = {
+        'line_items': db.session.query(InvoiceLineItem).filter(lines_in_year).delete(synchronize_session=False),
+        'invoices': db.session.query(Invoice).filter(in_year).delete(synchronize_session=False),
+        'fee_history': db.session.query(FeeHistory).filter(in_history).delete(synchronize_session=False),
+    }
+    written = {'invoices': len(stubs), 'line_items': archived_lines, 'fee_history': files[f'{year}/fee_history.jsonl.gz']['rows']}
+    if deleted != written:
+        # Rows were added to the year while its files were written.
+        db.session.rollback()
+        raise RuntimeError(f'Financial year {year} changed while being archived (wrote {written}, found {deleted}); run it again')
+    db.session.commit()
+    if progress:
+        progress(f"{year}: {written['invoices']} invoices, {written['line_items']} line items and "
+                 f"{written['fee_history']} fee history rows archived.")
+    return dict(written, kept=len(kept))
+
+def _add_fee_charges(charges):
+    # Calendar years straddle two financial years, so a row may already have half a year in it.
+    keys = list(charges)
+    for i in range(0, len(keys), BATCH_SIZE):
+        batch = keys[i:i + BATCH_SIZE]
+        existing = {(row.client_id, row.fee_id, row.year): row for row in ArchivedFeeCharge.query.filter(
+            ArchivedFeeCharge.client_id.in_({key[0] for key in batch}),
+            ArchivedFeeCharge.year.in_({key[2] for key in batch}))}
+        for key in batch:
+            count, units, total = charges[key]
+            row = existing.get(key)
+            if row is None:
+                db.session.add(ArchivedFeeCharge(client_id=key[0], fee_id=key[1], year=key[2], charges=count, units=units, total=total))
+            else:
+                row.charges += count
+                row.units += units
+                row.total += total
+    db.session.flush()
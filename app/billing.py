@@ -0,0 +1,223 @@
+import calendar
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from models import db, Client, InterchangeFee, BillingRun, BillingRunClient
+from reference_cache import current_biller
+from jobs import enqueue
+from fee_units import staged_units
+from functions import calculate_interchange_line_item, generate_invoice_line_items, get_applicable_fees_for_clients, build_client_invoice
+from revenue import record_invoice
+
+MAX_ATTEMPTS = 3
+
+_worker_app = None
+
+def period_bounds(period):
+    try:
+        if len(period) != 7:
+            raise ValueError
+        start_date = datetime.strptime(period, '%Y-%m').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'period {period!r} is not YYYY-MM')
+    end_date = start_date.replace(day=calendar.monthrange(start_date.year, start_date.month)[1])
+    return start_date, end_date
+
+def load_billing_inputs(path):
+    # JSON: {"<client_id>": {"units": {"<fee_id>": 10}, "interchange_amt": ..., "minimum_interchange": ..., "interchange_percentage": ...}}
+    # CSV: client_id,fee_id,units,interchange_amt,minimum_interchange,interchange_percentage (blank cells are ignored)
+    inputs = {}
+
+    if path.endswith('.json'):
+        with open(path) as f:
+            raw = json.load(f)
+        for client_id, values in raw.items():
+            client_inputs = inputs.setdefault(client_id, {'form_data': {}, 'interchange': None})
+            for fee_id, units in values.get('units', {}).items():
+                client_inputs['form_data'][f'units_{fee_id}'] = str(units)
+            if values.get('interchange_amt') is not None or values.get('minimum_interchange') is not None:
+                client_inputs['interchange'] = _interchange_inputs(values)
+        return inputs
+
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            client_inputs = inputs.setdefault(row['client_id'], {'form_data': {}, 'interchange': None})
+            if row.get('fee_id'):
+                client_inputs['form_data'][f'units_{row["fee_id"]}'] = row.get('units') or '0'
+            if row.get('interchange_amt') or row.get('minimum_interchange'):
+                client_inputs['interchange'] = _interchange_inputs(row)
+    return inputs
+
+def _interchange_inputs(values):
+    return {
+        'interchange_amt': str(values.get('interchange_amt') or 0),
+        'minimum_interchange': str(values.get('minimum_interchange') or 0),
+        'interchange_percentage': str(values.get('interchange_percentage') or 0),
+    }
+
+def bill_client(run_id, client_id, start_date, end_date, client_inputs, applicable_fees):
+    client_inputs = client_inputs or {'form_data': {}, 'interchange': None}
+    error = None
+
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            status, invoice_id = _bill_client_once(run_id, client_id, start_date, end_date, client_inputs, applicable_fees)
+            return client_id, status, invoice_id, None
+        except IntegrityError as e:
+            # Lost a race with another worker (e.g. both creating the same counter row); retry.
+            db.session.rollback()
+            error = str(e.orig)
+        except Exception as e:
+            db.session.rollback()
+            error = f'{type(e).__name__}: {e}'
+            break
+
+    db.session.merge(BillingRunClient(run_id=run_id, client_id=client_id, status='failed', invoice_id=None, error=error))
+    db.session.commit()
+    return client_id, 'failed', None, error
+
+def _bill_client_once(run_id, client_id, start_date, end_date, client_inputs, applicable_fees):
+    client = Client.query.get(client_id)
+    biller = current_biller()
+
+    interchange_line_item = None
+    interchange = client_inputs.get('interchange')
+    if interchange:
+        db.session.add(InterchangeFee(
+            fee_name='Interchange',
+            client_id=client_id,
+            start_date=start_date,
+            end_date=end_date,
+            interchange_amt=interchange['interchange_amt'],
+            minimum_interchange=interchange['minimum_interchange'],
+            charge_date=datetime.now().date()
+        ))
+        db.session.flush()
+        interchange_line_item = calculate_interchange_line_item(client_id, start_date, end_date, interchange['interchange_percentage'])
+
+    line_items = generate_invoice_line_items(client_id, start_date, end_date, applicable_fees, client_inputs['form_data'], interchange_line_item)
+
+    if not line_items:
+        db.session.rollback()
+        db.session.merge(BillingRunClient(run_id=run_id, client_id=client_id, status='skipped', invoice_id=None, error=None))
+        db.session.commit()
+        return 'skipped', None
+
+    invoice = build_client_invoice(client, biller, start_date, line_items)
+    db.session.add(invoice)
+    record_invoice(invoice)
+    db.session.merge(BillingRunClient(run_id=run_id, client_id=client_id, status='done', invoice_id=invoice.invoice_id, error=None))
+    # The PDF is rendered once, by `flask worker`, and stored with the invoice.
+    enqueue('render_invoice_pdf', {'invoice_id': invoice.invoice_id})
+    db.session.commit()
+    return 'done', invoice.invoice_id
+
+def _init_worker(app_config):
+    # The same app as the parent's, settings included, so a run behaves alike whatever the
+    # number of workers.
+    global _worker_app
+    from wsgi import create_app
+    _worker_app = create_app(app_config['ENV'], app_config)
+
+def _with_staged_units(client_inputs, units):
+    # Units staged from an upload fill in fees the run's inputs file doesn't mention.
+    if not units:
+        return client_inputs
+    client_inputs = client_inputs or {'form_data': {}, 'interchange': None}
+    form_data = {f'units_{fee_id}': str(count) for fee_id, count in units.items()}
+    form_data.update(client_inputs['form_data'])
+    return dict(client_inputs, form_data=form_data)
+
+def bill_clients(run_id, client_ids, start_date, end_date, inputs):
+    applicable_fees = get_applicable_fees_for_clients(client_ids, start_date, end_date, exclude_interchange=True)
+    units = staged_units(client_ids, start_date.replace(day=1))
+
+    # Fee masters are shared by every client in the batch; keep them loaded across the per-client commits.
+    session = db.session()
+    expire_on_commit, session.expire_on_commit = session.expire_on_commit, False
+    try:
+        return [bill_client(run_id, client_id, start_date, end_date, _with_staged_units(inputs.get(client_id), units.get(client_id)),
+                            applicable_fees[client_id])
+                for client_id in client_ids]
+    finally:
+        session.expire_on_commit = expire_on_commit
+
+def _bill_shard(run_id, client_ids, start_date, end_date, inputs):
+    with _worker_app.app_context():
+        try:
+            return bill_clients(run_id, client_ids, start_date, end_date, inputs)
+        finally:
+            db.session.remove()
+
+def _start_run(period, issuer_id=None):
+    run = BillingRun.query.filter_by(period=period).first()
+    if run is None:
+        run = BillingRun(period=period)
+        db.session.add(run)
+    run.status = 'running'
+    run.finished_at = None
+    db.session.commit()
+
+    finished = db.session.query(BillingRunClient.client_id).filter(
+        BillingRunClient.run_id == run.run_id,
+        BillingRunClient.status.in_(['done', 'skipped'])
+    )
+    query = db.session.query(Client.client_id).filter(Client.client_id.notin_(finished))
+    if issuer_id:
+        query = query.filter(Client.issuer_id == issuer_id)
+    pending = [client_id for client_id, in query.order_by(Client.client_id)]
+    return run, pending
+
+def run_billing(app, period, inputs=None, workers=1, shard_size=50, issuer_id=None, progress=None):
+    inputs = inputs or {}
+    start_date, end_date = period_bounds(period)
+    started = time.perf_counter()
+
+    with app.app_context():
+        if current_biller() is None:
+            raise RuntimeError('No biller configured.')
+        run, pending = _start_run(period, issuer_id)
+        run_id = run.run_id
+        if progress:
+            progress(f'Billing run {run_id} for {period}: {len(pending)} clients pending.')
+
+        results = []
+        if workers <= 1 or len(pending) <= shard_size:
+            for i in range(0, len(pending), shard_size):
+                results.extend(bill_clients(run_id, pending[i:i + shard_size], start_date, end_date, inputs))
+        else:
+            app_config = dict(app.config)
+            # Child processes open their own connections; don't hand them ours.
+            db.engine.dispose()
+            shards = [pending[i:i + shard_size] for i in range(0, len(pending), shard_size)]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(app_config,)) as executor:
+                futures = [
+                    executor.submit(_bill_shard, run_id, shard, start_date, end_date,
+                                    {client_id: inputs[client_id] for client_id in shard if client_id in inputs})
+                    for shard in shards
+                ]
+                for future in as_completed(futures):
+                    results.extend(future.result())
+                    if progress:
+                        progress(f'{len(results)}/{len(pending)} clients processed.')
+
+        failures = [(client_id, error) for client_id, status, _, error in results if status == 'failed']
+        run = BillingRun.query.get(run_id)
+        run.status = 'failed' if failures else 'completed'
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'run_id': run_id,
+        'period': period,
+        'processed': len(results),
+        'done': sum(1 for result in results if result[1] == 'done'),
+        'skipped': sum(1 for result in results if result[1] == 'skipped'),
+        'failures': failures,
+        'elapsed': elapsed,
+        'clients_per_second': len(results) / elapsed if elapsed else 0.0,
+    }
@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from models import db, Client, Issuer, Product, FeeMaster, ClientProductFeeMapping
+from ids import next_ids
+from reference_cache import bump_reference
+
+# Onboarding in bulk: clients, products and client-product-fee mappings from CSV (with a
+# header row) or JSON Lines. Every row is validated in memory against reference sets
+# loaded up front (issuers, clients, products, fees, and the existing mapping periods of
+# the clients in the file). Valid rows are inserted with executemany in chunks, one
+# transaction, ID allocation and cache version bump per chunk. A dry run validates only and writes nothing.
+
+JSON_EXTENSIONS = ('.jsonl', '.ndjson', '.json')
+CLIENT_TYPES = ['TSP Model', 'Program Manager Model']
+BATCH_SIZE = 1000
+
+IMPORT_KINDS = {
+    # kind: (model, ID counter in ids.ID_SEQUENCES, columns, required columns)
+    'clients': (Client, 'clients',
+                ['client_id', 'client_name', 'issuer_id', 'client_type', 'client_address', 'client_gstin', 'client_email', 'client_contact'],
+                ['client_name', 'issuer_id', 'client_type']),
+    'products': (Product, 'products', ['product_id', 'product_name', 'issuer_id'], ['product_name', 'issuer_id']),
+    'mappings': (ClientProductFeeMapping, None, ['client_id', 'product_id', 'fee_id', 'unit_price', 'start_date', 'end_date'],
+                 ['client_id', 'product_id', 'fee_id', 'start_date', 'end_date']),
+}
+
+def read_rows(stream, filename='', required=()):
+    # Yields (line number, values). Values of a line that can't be read carry an 'error'.
+    if filename.lower().endswith(JSON_EXTENSIONS):
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                values = json.loads(line)
+            except ValueError as e:
+                yield line_number, {'error': f'invalid JSON: {e}'}
+                continue
+            yield line_number, values if isinstance(values, dict) else {'error': 'expected a JSON object'}
+        return
+
+    reader = csv.DictReader(stream)
+    missing = [column for column in required if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(missing)}")
+    for values in reader:
+        yield reader.line_num, values
+
+def import_file(kind, stream, filename='', dry_run=False, chunk_size=BATCH_SIZE, progress=None):
+    required = IMPORT_KINDS[kind][3]
+    started = time.perf_counter()
+    rows = list(read_rows(stream, filename, required))
+
+    validate = {'clients': _validate_clients, 'products': _validate_products, 'mappings': _validate_mappings}[kind]
+    records, rejected = validate(rows)
+    validated = time.perf_counter()
+
+    inserted = 0
+    if records and not dry_run:
+        inserted = _insert(kind, records, chunk_size, progress)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'kind': kind,
+        'dry_run': dry_run,
+        'rows': len(rows),
+        'valid': len(records),
+        'inserted': inserted,
+        'rejected': sorted(rejected),
+        'validate_seconds': validated - started,
+        'elapsed': elapsed,
+        'rows_per_second': len(rows) / elapsed if elapsed else 0.0,
+    }
+
+def error_report(result):
+    report = io.StringIO()
+    writer = csv.writer(report)
+    writer.writerow(['line', 'error'])
+    writer.writerows(result['rejected'])
+    return report.getvalue()
+
+def _text(values, column, model, required=False):
+    value = values.get(column)
+    value = '' if value is None else str(value).strip()
+    if not value:
+        if required:
+            raise ValueError(f'{column} is required')
+        return None
+    length = getattr(model.__table__.c[column].type, 'length', None)
+    if length and len(value) > length:
+        raise ValueError(f'{column} is longer than {length} characters')
+    return value
+
+def _date(values, column):
+    value = str(values.get(column) or '').strip()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{column} {value!r} is not YYYY-MM-DD')
+
+def _ids(column):
+    return {value for value, in db.session.query(column)}
+
+def _check_new_id(value, existing, seen, line, column):
+    if value is None:
+        return
+    if value in existing:
+        raise ValueError(f'{column} {value} already exists')
+    if value in seen:
+        raise ValueError(f'{column} {value} is repeated (first on line {seen[value]})')
+    seen[value] = line
+
+def _validate_rows(rows, parse):
+    records, rejected = [], []
+    for line, values in rows:
+        try:
+            if 'error' in values:
+                raise ValueError(values['error'])
+            records.append(parse(line, values))
+        except ValueError as e:
+            rejected.append((line, str(e)))
+    return records, rejected
+
+def _validate_clients(rows):
+    issuers, existing, seen = _ids(Issuer.issuer_id), _ids(Client.client_id), {}
+
+    def parse(line, values):
+        record = {column: _text(values, column, Client, column in ('client_name', 'issuer_id', 'client_type'))
+                  for column in IMPORT_KINDS['clients'][2]}
+        if record['issuer_id'] not in issuers:
+            raise ValueError(f"issuer_id {record['issuer_id']} does not exist")
+        if record['client_type'] not in CLIENT_TYPES:
+            raise ValueError(f"client_type must be one of {', '.join(CLIENT_TYPES)}")
+        _check_new_id(record['client_id'], existing, seen, line, 'client_id')
+        return record
+
+    return _validate_rows(rows, parse)
+
+def _validate_products(rows):
+    issuers, existing, seen = _ids(Issuer.issuer_id), _ids(Product.product_id), {}
+
+    def parse(line, values):
+        record = {column: _text(values, column, Product, column in ('product_name', 'issuer_id'))
+                  for column in IMPORT_KINDS['products'][2]}
+        if record['issuer_id'] not in issuers:
+            raise ValueError(f"issuer_id {record['issuer_id']} does not exist")
+        _check_new_id(record['product_id'], existing, seen, line, 'product_id')
+        return record
+
+    return _validate_rows(rows, parse)
+
+def _validate_mappings(rows):
+    clients, products, fees = _ids(Client.client_id), _ids(Product.product_id), _ids(FeeMaster.fee_id)
+    periods = _existing_periods({str(values.get('client_id') or '').strip() for _, values in rows} & clients)
+
+    def parse(line, values):
+        record = {column: _text(values, column, ClientProductFeeMapping, True) for column in ('client_id', 'product_id', 'fee_id')}
+        for column, known in (('client_id', clients), ('product_id', products), ('fee_id', fees)):
+            if record[column] not in known:
+                raise ValueError(f'{column} {record[column]} does not exist')
+        try:
+            record['unit_price'] = Decimal(str(values.get('unit_price') or 0).strip())
+        except InvalidOperation:
+            raise ValueError(f"unit_price {values.get('unit_price')!r} is not a number")
+        if record['unit_price'] < 0 or record['unit_price'] != round(record['unit_price'], 2) or record['unit_price'] >= 10 ** 8:
+            raise ValueError('unit_price must be between 0 and 99999999.99 with at most 2 decimals')
+        record['start_date'], record['end_date'] = _date(values, 'start_date'), _date(values, 'end_date')
+        if record['start_date'] > record['end_date']:
+            raise ValueError('start_date is after end_date')
+
+        # Two mappings for the same client, product and fee must not be in force on the same day.
+        key = (record['client_id'], record['product_id'], record['fee_id'])
+        for start, end, source in periods.get(key, ()):
+            if start <= record['end_date'] and end >= record['start_date']:
+                raise ValueError(f'overlaps the {start} to {end} mapping {source}')
+        periods.setdefault(key, []).append((record['start_date'], record['end_date'], f'on line {line}'))
+        return record
+
+    return _validate_rows(rows, parse)
+
+def _existing_periods(client_ids):
+    periods = {}
+    client_ids = sorted(client_ids)
+    for i in range(0, len(client_ids), BATCH_SIZE):
+        rows = db.session.query(
+            ClientProductFeeMapping.client_id, ClientProductFeeMapping.product_id, ClientProductFeeMapping.fee_id,
+            ClientProductFeeMapping.start_date, ClientProductFeeMapping.end_date, ClientProductFeeMapping.mapping_id
+        ).filter(ClientProductFeeMapping.client_id.in_(client_ids[i:i + BATCH_SIZE]))
+        for client_id, product_id, fee_id, start, end, mapping_id in rows:
+            periods.setdefault((client_id, product_id, fee_id), []).append((start, end, f'already saved (mapping {mapping_id})'))
+    return periods
+
+def _insert(kind, records, chunk_size, progress=None):
+    model, id_counter, _, _ = IMPORT_KINDS[kind]
+    id_column = model.__table__.primary_key.columns.values()[0].name
+    table = model.__table__
+    inserted = 0
+    for i in range(0, len(records), chunk_size):
+        chunk = records[i:i + chunk_size]
+        if id_counter:
+            missing = [record for record in chunk if not record[id_column]]
+            for record, new_id in zip(missing, next_ids(id_counter, len(missing)) if missing else []):
+                record[id_column] = new_id
+        else:
+            for record in chunk:
+                record.pop(id_column, None)
+        bump_reference(kind)
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        inserted += len(chunk)
+        if progress:
+            progress(f'{inserted}/{len(records)} {kind} inserted.')
+    return inserted
@@ -0,0 +1,97 @@
+import csv
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy.orm import joinedload, selectinload
+from models import Invoice, InvoiceLineItem
+from invoice_queries import filter_invoices
+from html_to_pdf import render_invoice_html
+from pdf_cache import pdf_cache
+from invoice_pdfs import invoice_pdfs
+
+MANIFEST_COLUMNS = ['invoice_id', 'invoice_number', 'filename', 'status', 'bytes', 'error']
+
+class _ZipStream:
+    # Write-only sink for ZipFile. With no tell()/seek(), ZipFile falls back to streaming
+    # mode and never rewinds, so each member can be handed to the client as soon as it's written.
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def bulk_invoice_query(filters):
+    return filter_invoices(Invoice.query, filters).options(
+        joinedload(Invoice.client),
+        selectinload(Invoice.line_items).joinedload(InvoiceLineItem.fee)
+    ).order_by(Invoice.invoice_date, Invoice.invoice_id).yield_per(100)
+
+def render_invoice_pdfs(invoices, workers=4, render=None):
+    # Templates render here (they need the app context); wkhtmltopdf runs on the pool.
+    # At most 2 * workers PDFs are in flight, so memory doesn't grow with the result set.
+    # Invoices with a stored PDF are read from the artifact store instead. `render` defaults
+    # to pdf_cache.render; callers that store the result pass render_pdf.
+    render = render or pdf_cache.render
+    window = workers * 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for invoice in invoices:
+            if invoice_pdfs.has(invoice):
+                futures[pool.submit(invoice_pdfs.read, invoice)] = (invoice.invoice_id, invoice.invoice_number)
+            else:
+                try:
+                    html = render_invoice_html(invoice)
+                except Exception as e:
+                    yield invoice.invoice_id, invoice.invoice_number, None, f'{type(e).__name__}: {e}'
+                    continue
+                futures[pool.submit(render, html)] = (invoice.invoice_id, invoice.invoice_number)
+
+            if len(futures) >= window:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _result(future, futures.pop(future))
+
+        for future in list(futures):
+            yield _result(future, futures.pop(future))
+
+def _result(future, key):
+    invoice_id, invoice_number = key
+    try:
+        return invoice_id, invoice_number, future.result(), None
+    except Exception as e:
+        return invoice_id, invoice_number, None, f'{type(e).__name__}: {e}'
+
+def stream_invoice_zip(invoices, workers=4):
+    stream = _ZipStream()
+    manifest = io.StringIO()
+    manifest_writer = csv.writer(manifest)
+    manifest_writer.writerow(MANIFEST_COLUMNS)
+    used_names = set()
+
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for invoice_id, invoice_number, data, error in render_invoice_pdfs(invoices, workers):
+            if data is None:
+                manifest_writer.writerow([invoice_id, invoice_number, '', 'failed', 0, error])
+                continue
+
+            filename = f'invoice_{invoice_number}.pdf'
+            if filename in used_names:
+                filename = f'invoice_{invoice_number}_{invoice_id}.pdf'
+            used_names.add(filename)
+
+            archive.writestr(filename, data)
+            manifest_writer.writerow([invoice_id, invoice_number, filename, 'ok', len(data), ''])
+            yield stream.drain()
+
+        archive.writestr('manifest.csv', manifest.getvalue())
+    yield stream.drain()
@@ -0,0 +1,299 @@
+import os
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from billing import load_billing_inputs, period_bounds, run_billing
+from fee_units import import_units, parse_period
+from bulk_import import IMPORT_KINDS, BATCH_SIZE, import_file, error_report
+from export import EXPORT_FORMATS, export_rows, export_lines
+from bulk_pdf import bulk_invoice_query, stream_invoice_zip, render_invoice_pdfs
+from models import db, Invoice, ArchivedYear
+from invoice_pdfs import invoice_pdfs
+from html_to_pdf import render_pdf
+from replica import use_replica
+from jobs import Worker, JOB_HANDLERS
+from revenue import rebuild_revenue
+from archive import invoice_archive, archive_year, archived_revenue
+from partitions import PARTITIONED_TABLES, INTERVALS, is_partitioned, list_partitions, partition_tables, ensure_partitions
+
+billing_cli = AppGroup('billing', help='Batch billing commands.')
+export_cli = AppGroup('export', help='Data export commands.')
+pdfs_cli = AppGroup('pdfs', help='Stored invoice PDF commands.')
+revenue_cli = AppGroup('revenue', help='Revenue summary commands.')
+partitions_cli = AppGroup('partitions', help='Postgres table partitioning commands.')
+archive_cli = AppGroup('archive', help='Archived financial year commands.')
+
+def _billing_period(ctx, param, value):
+    try:
+        period_bounds(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    return value
+
+@billing_cli.command('run')
+@click.option('--period', required=True, callback=_billing_period, help='Billing period as YYYY-MM.')
+@click.option('--inputs', 'inputs_path', type=click.Path(exists=True, dir_okay=False), help='CSV or JSON file with units and interchange inputs.')
+@click.option('--workers', type=int, default=lambda: os.cpu_count() or 1, show_default='CPU count', help='Number of worker processes.')
+@click.option('--shard-size', type=int, default=50, show_default=True, help='Clients per worker task.')
+@click.option('--issuer', 'issuer_id', help='Only bill clients of this issuer.')
+def billing_run(period, inputs_path, workers, shard_size, issuer_id):
+    """Invoice every client for a billing period. Re-running a period resumes it."""
+    inputs = load_billing_inputs(inputs_path) if inputs_path else {}
+    result = run_billing(current_app._get_current_object(), period, inputs, workers=workers,
+                         shard_size=shard_size, issuer_id=issuer_id, progress=click.echo)
+
+    click.echo(f"Processed {result['processed']} clients in {result['elapsed']:.1f}s "
+               f"({result['clients_per_second']:.1f} clients/s): {result['done']} invoiced, "
+               f"{result['skipped']} skipped, {len(result['failures'])} failed.")
+    for client_id, error in result['failures']:
+        click.echo(f'  {client_id}: {error}', err=True)
+    if result['failures']:
+        raise SystemExit(1)
+
+@billing_cli.command('import-units')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--period', help='Only accept rows for this month (YYYY-MM); rows without a period get it.')
+@click.option('--strict', is_flag=True, help='Stage nothing if any row is invalid.')
+@click.option('--errors', 'errors_output', type=click.File('w'), help='Write the rejected rows to this CSV file.')
+def billing_import_units(path, period, strict, errors_output):
+    """Stage dynamic-fee units from a CSV or JSONL file of client_id,fee_id,period,units."""
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            upload = import_units(f, os.path.basename(path), period=parse_period(period) if period else None, strict=strict)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f'Upload {upload.upload_id}: {upload.rows_total} rows, {upload.rows_staged} staged, '
+               f'{upload.rows_rejected} rejected ({upload.status}).')
+    if upload.error_report:
+        if errors_output:
+            errors_output.write(upload.error_report)
+        else:
+            lines = upload.error_report.splitlines()
+            for line in lines[1:21]:
+                click.echo(f'  {line}', err=True)
+            if len(lines) > 21:
+                click.echo(f'  ... {len(lines) - 21} more; use --errors to get them all.', err=True)
+        raise SystemExit(1)
+
+@export_cli.command('invoices')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--from', 'date_from', type=click.DateTime(['%Y-%m-%d']), help='First invoice date to include.')
+@click.option('--to', 'date_to', type=click.DateTime(['%Y-%m-%d']), help='Last invoice date to include.')
+@click.option('--since', 'modified_since', type=click.DateTime(['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']),
+              help='Only rows whose invoice or line item changed after this watermark.')
+@click.option('--output', type=click.File('w'), default='-', help='Output file (default: stdout).')
+def export_invoices(fmt, date_from, date_to, modified_since, output):
+    """Stream invoices joined with their line items as CSV or JSONL."""
+    use_replica()
+    filters = {}
+    if date_from:
+        filters['date_from'] = date_from.date()
+    if date_to:
+        filters['date_to'] = date_to.date()
+    for line in export_lines(export_rows(filters, modified_since), fmt):
+        output.write(line)
+
+@export_cli.command('pdfs')
+@click.option('--issuer', 'issuer_id', help='Only invoices of this issuer.')
+@click.option('--client', 'client_id', help='Only invoices of this client.')
+@click.option('--month', type=click.DateTime(['%Y-%m']), help='Invoice month as YYYY-MM.')
+@click.option('--workers', type=int, help='Parallel renders (default: BULK_PDF_WORKERS).')
+@click.option('--output', type=click.File('wb'), required=True, help='ZIP file to write.')
+def export_pdfs(issuer_id, client_id, month, workers, output):
+    """Render matching invoices in parallel into a ZIP with a manifest.csv."""
+    use_replica()
+    filters = {'issuer_id': issuer_id, 'client_id': client_id}
+    if month:
+        filters['month'] = month.date()
+    workers = workers or current_app.config.get('BULK_PDF_WORKERS', 4)
+    for chunk in stream_invoice_zip(bulk_invoice_query(filters), workers=workers):
+        output.write(chunk)
+
+@pdfs_cli.command('backfill')
+@click.option('--issuer', 'issuer_id', help='Only invoices of this issuer.')
+@click.option('--client', 'client_id', help='Only invoices of this client.')
+@click.option('--month', type=click.DateTime(['%Y-%m']), help='Invoice month as YYYY-MM.')
+@click.option('--force', is_flag=True, help='Re-render invoices that already have a stored PDF.')
+@click.option('--workers', type=int, help='Parallel renders (default: BULK_PDF_WORKERS).')
+@click.option('--batch-size', type=int, default=100, show_default=True, help='Invoices committed per transaction.')
+def backfill_pdfs(issuer_id, client_id, month, force, workers, batch_size):
+    """Render and store the PDF of invoices that don't have one yet."""
+    filters = {'issuer_id': issuer_id, 'client_id': client_id}
+    if month:
+        filters['month'] = month.date()
+    workers = workers or current_app.config.get('BULK_PDF_WORKERS', 4)
+    stored = failed = 0
+    after = ''
+    while True:
+        # Keyset batches by invoice_id, so the query stays cheap however far the backfill got.
+        query = bulk_invoice_query(filters).filter(Invoice.invoice_id > after)
+        if not force:
+            query = query.filter(Invoice.pdf_sha256.is_(None))
+        batch = query.order_by(None).order_by(Invoice.invoice_id).limit(batch_size).all()
+        if not batch:
+            break
+        by_id = {invoice.invoice_id: invoice for invoice in batch}
+        if force:
+            for invoice in batch:
+                invoice.pdf_path = None
+        for invoice_id, invoice_number, data, error in render_invoice_pdfs(batch, workers, render=render_pdf):
+            if data is None:
+                failed += 1
+                click.echo(f'  {invoice_id} ({invoice_number}): {error}', err=True)
+                continue
+            invoice_pdfs.save(by_id[invoice_id], data)
+            stored += 1
+        db.session.commit()
+        after = batch[-1].invoice_id
+        click.echo(f'{stored} stored, {failed} failed')
+    click.echo(f'Backfill finished: {stored} stored, {failed} failed.')
+    if failed:
+        raise SystemExit(1)
+
+@pdfs_cli.command('verify')
+def verify_pdfs():
+    """Check every stored PDF exists and matches its recorded checksum."""
+    use_replica()
+    checked = bad = 0
+    for invoice in Invoice.query.filter(Invoice.pdf_sha256.isnot(None)).order_by(Invoice.invoice_id).yield_per(500):
+        checked += 1
+        if not invoice_pdfs.has(invoice):
+            bad += 1
+            click.echo(f'  {invoice.invoice_id}: missing {invoice.pdf_path}', err=True)
+        elif not invoice_pdfs.verify(invoice):
+            bad += 1
+            click.echo(f'  {invoice.invoice_id}: checksum mismatch {invoice.pdf_path}', err=True)
+    click.echo(f'{checked} stored PDFs checked, {bad} missing or corrupt.')
+    if bad:
+        raise SystemExit(1)
+
+@revenue_cli.command('rebuild')
+def revenue_rebuild():
+    """Recompute revenue_monthly and revenue_by_fee from all invoices in force."""
+    counts = rebuild_revenue(progress=click.echo, archived=archived_revenue())
+    click.echo(f"Rebuilt {counts['revenue_monthly']} monthly and {counts['revenue_by_fee']} per-fee rows.")
+
+def _require_postgres(connection):
+    if connection.dialect.name != 'postgresql':
+        raise click.ClickException('Partitioning needs a Postgres database.')
+
+@partitions_cli.command('convert')
+@click.option('--interval', type=click.Choice(INTERVALS), help='One partition per month or per year. Defaults to PARTITION_INTERVAL, else month.')
+@click.option('--ahead', type=int, help='Future periods to create partitions for. Defaults to PARTITION_AHEAD.')
+def partitions_convert(interval, ahead):
+    """Convert invoices, invoice_line_items and fee_history to partitioned tables, in one transaction."""
+    interval = interval or current_app.config['PARTITION_INTERVAL'] or 'month'
+    ahead = current_app.config['PARTITION_AHEAD'] if ahead is None else ahead
+    connection = db.session.connection()
+    _require_postgres(connection)
+    skipped = partition_tables(connection, interval, ahead, progress=click.echo)
+    db.session.commit()
+    for foreign_key in skipped:
+        click.echo(f'  Foreign key {foreign_key} dropped: it cannot reference a partitioned table.', err=True)
+    click.echo('Partitioned ' + ', '.join(PARTITIONED_TABLES) + f' by {interval}.')
+
+@partitions_cli.command('create')
+@click.option('--ahead', type=int, help='Future periods to create partitions for. Defaults to PARTITION_AHEAD.')
+def partitions_create(ahead):
+    """Create the partitions of the current and coming periods. Run it from cron."""
+    ahead = current_app.config['PARTITION_AHEAD'] if ahead is None else ahead
+    connection = db.session.connection()
+    _require_postgres(connection)
+    created = ensure_partitions(connection, ahead)
+    db.session.commit()
+    for name in created:
+        click.echo(f'  {name}')
+    click.echo(f'{len(created)} partitions created.')
+
+@partitions_cli.command('list')
+def partitions_list():
+    """Show the partitions of each partitioned table with their bounds and estimated rows."""
+    connection = db.session.connection()
+    _require_postgres(connection)
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            click.echo(f'{table}: not partitioned')
+            continue
+        click.echo(f'{table}:')
+        for name, bounds, rows in list_partitions(connection, table):
+            click.echo(f'  {name:32} {bounds:60} {max(rows, 0):>12}')
+
+@archive_cli.command('year')
+@click.argument('year')
+@click.option('--dry-run', is_flag=True, help='Only count what would be archived.')
+def archive_year_command(year, dry_run):
+    """Move a closed financial year (e.g. 2023-24) of invoices, line items and fee history to ARCHIVE_DIR."""
+    try:
+        counts = archive_year(year, dry_run=dry_run, progress=click.echo)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{'Dry run: ' if dry_run else ''}{counts['invoices']} invoices, {counts['line_items']} line items, "
+               f"{counts['fee_history']} fee history rows{' to archive' if dry_run else ' archived'}.")
+    if counts['kept']:
+        click.echo(f"{counts['kept']} invoices kept: their edits are in another year.")
+
+@archive_cli.command('list')
+def archive_list():
+    """Show the archived financial years."""
+    for archived in ArchivedYear.query.order_by(ArchivedYear.financial_year):
+        click.echo(f'{archived.financial_year}  {archived.invoices:>10} invoices  {archived.line_items:>10} line items  '
+                   f'{archived.fee_history:>10} fee history  archived {archived.archived_at:%Y-%m-%d %H:%M}')
+
+@archive_cli.command('verify')
+@click.argument('year', required=False)
+def archive_verify(year):
+    """Check every archive file (or one year's) against its checksum and row count."""
+    years = [year] if year else [archived.financial_year for archived in ArchivedYear.query.order_by(ArchivedYear.financial_year)]
+    bad = 0
+    for name in years:
+        problems = invoice_archive.verify(name)
+        for relative, problem in problems:
+            click.echo(f'  {relative}: {problem}', err=True)
+        bad += len(problems)
+    click.echo(f'{len(years)} archived years checked, {bad} problems.')
+    if bad:
+        raise SystemExit(1)
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(list(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Validate every row but insert nothing.')
+@click.option('--chunk-size', type=int, default=BATCH_SIZE, show_default=True, help='Rows inserted per transaction.')
+@click.option('--errors', 'errors_output', type=click.File('w'), help='Write the rejected rows to this CSV file.')
+@with_appcontext
+def import_command(kind, path, dry_run, chunk_size, errors_output):
+    """Bulk import clients, products or client-product-fee mappings from a CSV or JSONL file."""
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            result = import_file(kind, f, os.path.basename(path), dry_run=dry_run, chunk_size=chunk_size, progress=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f"{'Dry run: ' if dry_run else ''}{result['rows']} rows, {result['valid']} valid, {result['inserted']} inserted, "
+               f"{len(result['rejected'])} rejected in {result['elapsed']:.2f}s ({result['rows_per_second']:.0f} rows/s; "
+               f"validation {result['validate_seconds']:.2f}s).")
+    if result['rejected']:
+        if errors_output:
+            errors_output.write(error_report(result))
+        else:
+            for line, error in result['rejected'][:20]:
+                click.echo(f'  line {line}: {error}', err=True)
+            if len(result['rejected']) > 20:
+                click.echo(f"  ... {len(result['rejected']) - 20} more; use --errors to get them all.", err=True)
+        raise SystemExit(1)
+
+@click.command('worker')
+@click.option('--concurrency', type=int, help='Jobs run at once (default: JOB_WORKER_CONCURRENCY).')
+@click.option('--kind', 'kinds', multiple=True, type=click.Choice(sorted(JOB_HANDLERS)), help='Only run these job kinds.')
+@click.option('--once', is_flag=True, help='Exit when no runnable jobs are left.')
+@click.option('--max-jobs', type=int, help='Exit after claiming this many jobs.')
+@with_appcontext
+def worker_command(concurrency, kinds, once, max_jobs):
+    """Run queued invoice generation and PDF rendering jobs."""
+    app = current_app._get_current_object()
+    worker = Worker(app, concurrency=concurrency or app.config.get('JOB_WORKER_CONCURRENCY', 2),
+                    poll_interval=app.config.get('JOB_POLL_INTERVAL', 1.0), kinds=list(kinds) or None)
+    click.echo(f'Worker {worker.worker_id} started with concurrency {worker.concurrency}.')
+    processed = worker.run(once=once, max_jobs=max_jobs)
+    click.echo(f'Worker {worker.worker_id} stopped after {processed} jobs.')
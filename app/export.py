@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+from sqlalchemy import and_, or_
+from models import db, Invoice, InvoiceLineItem, FeeMaster, Client, Issuer
+from invoice_queries import filter_invoices
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = [
+    ('invoice_id', Invoice.invoice_id),
+    ('invoice_number', Invoice.invoice_number),
+    ('invoice_date', Invoice.invoice_date),
+    ('invoice_month', Invoice.invoice_month),
+    ('invoice_type', Invoice.invoice_type),
+    ('client_id', Client.client_id),
+    ('client_name', Client.client_name),
+    ('client_gstin', Client.client_gstin),
+    ('issuer_id', Issuer.issuer_id),
+    ('issuer_name', Issuer.issuer_name),
+    ('invoice_amount', Invoice.invoice_amount),
+    ('tax_amount', Invoice.tax_amount),
+    ('taxable_amount', Invoice.taxable_amount),
+    ('rounding_up', Invoice.rounding_up),
+    ('grand_total', Invoice.grand_total),
+    ('line_item_id', InvoiceLineItem.line_item_id),
+    ('fee_id', FeeMaster.fee_id),
+    ('fee_name', FeeMaster.fee_name),
+    ('hsn_code', FeeMaster.hsn_code),
+    ('description', InvoiceLineItem.description),
+    ('units', InvoiceLineItem.units),
+    ('unit_price', InvoiceLineItem.unit_price),
+    ('line_total', InvoiceLineItem.total),
+    ('line_gst_amount', InvoiceLineItem.gst_amount),
+    ('line_final_amount', InvoiceLineItem.final_amount),
+    ('invoice_modified_at', Invoice.modified_at),
+    ('line_item_modified_at', InvoiceLineItem.modified_at),
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+def export_query(filters=None, modified_since=None):
+    query = db.session.query(*[column for _, column in EXPORT_COLUMNS]).select_from(Invoice).join(
+        Client, Client.client_id == Invoice.client_id
+    ).outerjoin(
+        Issuer, Issuer.issuer_id == Invoice.issuer_id
+    ).outerjoin(
+        InvoiceLineItem, and_(InvoiceLineItem.invoice_id == Invoice.invoice_id, InvoiceLineItem.invoice_date == Invoice.invoice_date)
+    ).outerjoin(
+        FeeMaster, FeeMaster.fee_id == InvoiceLineItem.fee_id
+    )
+    query = filter_invoices(query, filters or {})
+    if modified_since:
+        query = query.filter(or_(Invoice.modified_at > modified_since, InvoiceLineItem.modified_at > modified_since))
+    return query.order_by(Invoice.invoice_date, Invoice.invoice_id, InvoiceLineItem.line_item_id)
+
+def export_rows(filters=None, modified_since=None):
+    # Server-side cursor, fetched in batches: memory stays flat however many rows match.
+    query = export_query(filters, modified_since).execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+    for row in query:
+        yield row
+
+def _format_value(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def export_lines(rows, fmt='csv'):
+    names = [name for name, _ in EXPORT_COLUMNS]
+
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(names, (_format_value(value) for value in row)))) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for row in rows:
+        writer.writerow(['' if value is None else _format_value(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
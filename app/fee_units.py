@@ -0,0 +1,184 @@
+import calendar
+import csv
+import io
+from datetime import datetime
+from sqlalchemy.dialects import sqlite
+from models import db, ClientProductFeeMapping, FeeUnits, FeeUnitUpload
+from bulk_import import read_rows
+
+# Usage units from the processor's monthly files, one row per (client_id, fee_id, period,
+# units), as CSV with a header row or as JSON Lines. The rows are checked in bulk against
+# the client-product-fee mappings active in their month and upserted into fee_units
+# (COPY on Postgres, executemany elsewhere). Rejected rows go into a CSV report on the
+# upload. Billing runs and enter_units read staged units in place of typed ones.
+
+UNITS_COLUMNS = ['client_id', 'fee_id', 'period', 'units']
+REPORT_COLUMNS = ['line'] + UNITS_COLUMNS + ['error']
+BATCH_SIZE = 1000
+
+def parse_period(value):
+    # 'YYYY-MM', or any date in the month.
+    value = str(value).strip()
+    try:
+        if len(value) == 7:
+            return datetime.strptime(value, '%Y-%m').date()
+        return datetime.strptime(value, '%Y-%m-%d').date().replace(day=1)
+    except ValueError:
+        raise ValueError(f'period {value!r} is not YYYY-MM')
+
+def _parse_row(values, period):
+    client_id = str(values.get('client_id') or '').strip()
+    fee_id = str(values.get('fee_id') or '').strip()
+    if not client_id:
+        raise ValueError('client_id is required')
+    if not fee_id:
+        raise ValueError('fee_id is required')
+
+    row_period = values.get('period')
+    if row_period in (None, ''):
+        if period is None:
+            raise ValueError('period is required')
+        row_period = period
+    else:
+        row_period = parse_period(row_period)
+        if period and row_period != period:
+            raise ValueError(f'period {row_period:%Y-%m} is outside this upload ({period:%Y-%m})')
+
+    units = values.get('units')
+    try:
+        if isinstance(units, bool):
+            raise ValueError
+        units = int(str(units).strip())
+    except ValueError:
+        raise ValueError(f'units {units!r} is not a whole number')
+    if units < 0:
+        raise ValueError('units must not be negative')
+    return client_id, fee_id, row_period, units
+
+def _active_mappings(client_periods):
+    # (client_id, fee_id, period) for every mapping in force during some day of the month.
+    active = set()
+    by_period = {}
+    for client_id, period in client_periods:
+        by_period.setdefault(period, set()).add(client_id)
+    for period, client_ids in by_period.items():
+        month_end = period.replace(day=calendar.monthrange(period.year, period.month)[1])
+        client_ids = sorted(client_ids)
+        for i in range(0, len(client_ids), BATCH_SIZE):
+            rows = db.session.query(ClientProductFeeMapping.client_id, ClientProductFeeMapping.fee_id).filter(
+                ClientProductFeeMapping.client_id.in_(client_ids[i:i + BATCH_SIZE]),
+                ClientProductFeeMapping.start_date <= month_end,
+                ClientProductFeeMapping.end_date >= period
+            ).distinct()
+            active.update((client_id, fee_id, period) for client_id, fee_id in rows)
+    return active
+
+def import_units(stream, filename='', period=None, uploaded_by=None, strict=False):
+    # With `strict`, one bad row rejects the whole file.
+    upload = FeeUnitUpload(filename=filename, period=period, uploaded_by=uploaded_by)
+    db.session.add(upload)
+    db.session.flush()
+
+    parsed, rejected, seen = [], [], {}
+    for line, values in read_rows(stream, filename, ('client_id', 'fee_id', 'units')):
+        raw = [values.get(column, '') for column in UNITS_COLUMNS]
+        try:
+            if 'error' in values:
+                raise ValueError(values['error'])
+            row = _parse_row(values, period)
+        except ValueError as e:
+            rejected.append([line] + raw + [str(e)])
+            continue
+        if row[:3] in seen:
+            rejected.append([line] + raw + [f'duplicate of line {seen[row[:3]]}'])
+            continue
+        seen[row[:3]] = line
+        parsed.append((line, raw, row))
+
+    active = _active_mappings({(client_id, row_period) for _, _, (client_id, _, row_period, _) in parsed})
+    valid = []
+    for line, raw, (client_id, fee_id, row_period, units) in parsed:
+        if (client_id, fee_id, row_period) not in active:
+            rejected.append([line] + raw + [f'no active mapping for client {client_id} and fee {fee_id} in {row_period:%Y-%m}'])
+            continue
+        valid.append({'client_id': client_id, 'fee_id': fee_id, 'period': row_period, 'units': units})
+
+    upload.rows_total = len(valid) + len(rejected)
+    upload.rows_rejected = len(rejected)
+    if rejected and (strict or not valid):
+        upload.status = 'rejected'
+    else:
+        stage_units(valid, upload.upload_id)
+        upload.rows_staged = len(valid)
+        upload.status = 'partial' if rejected else 'staged'
+    if rejected:
+        report = io.StringIO()
+        writer = csv.writer(report)
+        writer.writerow(REPORT_COLUMNS)
+        writer.writerows(sorted(rejected, key=lambda row: row[0]))
+        upload.error_report = report.getvalue()
+    db.session.commit()
+    return upload
+
+def stage_units(rows, upload_id):
+    if not rows:
+        return
+    now = datetime.utcnow()
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        _copy_units(connection, rows, upload_id, now)
+        return
+
+    table = FeeUnits.__table__
+    values = [dict(row, upload_id=upload_id, created_at=now, modified_at=now) for row in rows]
+    if connection.dialect.name == 'sqlite':
+        statement = sqlite.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.client_id, table.c.fee_id, table.c.period],
+            set_={'units': statement.excluded.units, 'upload_id': statement.excluded.upload_id, 'modified_at': statement.excluded.modified_at}
+        )
+        for i in range(0, len(values), BATCH_SIZE):
+            connection.execute(statement, values[i:i + BATCH_SIZE])
+        return
+
+    for i in range(0, len(values), BATCH_SIZE):
+        batch = values[i:i + BATCH_SIZE]
+        for row in batch:
+            connection.execute(table.delete().where(
+                (table.c.client_id == row['client_id']) & (table.c.fee_id == row['fee_id']) & (table.c.period == row['period'])))
+        connection.execute(table.insert(), batch)
+
+def _copy_units(connection, rows, upload_id, now):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows((row['client_id'], row['fee_id'], row['period'].isoformat(), row['units']) for row in rows)
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS fee_units_incoming '
+                       '(client_id varchar(30), fee_id varchar(30), period date, units integer) ON COMMIT DROP')
+        cursor.execute('TRUNCATE fee_units_incoming')
+        cursor.copy_expert('COPY fee_units_incoming (client_id, fee_id, period, units) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            'INSERT INTO fee_units (client_id, fee_id, period, units, upload_id, created_at, modified_at) '
+            'SELECT client_id, fee_id, period, units, %s, %s, %s FROM fee_units_incoming '
+            'ON CONFLICT (client_id, fee_id, period) DO UPDATE '
+            'SET units = EXCLUDED.units, upload_id = EXCLUDED.upload_id, modified_at = EXCLUDED.modified_at',
+            (upload_id, now, now)
+        )
+    finally:
+        cursor.close()
+
+def staged_units(client_ids, period):
+    # {client_id: {fee_id: units}} for one billing month.
+    units = {}
+    client_ids = list(client_ids)
+    for i in range(0, len(client_ids), BATCH_SIZE):
+        rows = db.session.query(FeeUnits.client_id, FeeUnits.fee_id, FeeUnits.units).filter(
+            FeeUnits.period == period,
+            FeeUnits.client_id.in_(client_ids[i:i + BATCH_SIZE])
+        )
+        for client_id, fee_id, count in rows:
+            units.setdefault(client_id, {})[fee_id] = count
+    return units
@@ -1,7 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SelectField, SubmitField, DateField, IntegerField, DecimalField
-from wtforms.validators import DataRequired, Length, ValidationError, Optional, InputRequired
-from models import Client, Issuer, FeeMaster, Product
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, SelectField, SubmitField, DateField, IntegerField, DecimalField, BooleanField
+from wtforms.validators import DataRequired, Length, ValidationError, Optional, InputRequired, Regexp
+from models import FeeMaster
+from reference_cache import issuer_choices, client_choices, product_choices, fee_choices
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=4, max=20)])
@@ -22,7 +24,7 @@ class GenerateClientInvoiceForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(GenerateClientInvoiceForm, self).__init__(*args, **kwargs)
-        self.client_id.choices = [(c.client_id, c.client_name) for c in Client.query.all()]
+        self.client_id.choices = client_choices()
 
     def populate_fees(self, applicable_fees, interchange_mapping):
         for fee in applicable_fees:
@@ -65,7 +67,7 @@ class AddClientForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(AddClientForm, self).__init__(*args, **kwargs)
-        self.issuer_id.choices = [(i.issuer_id, i.issuer_name) for i in Issuer.query.all()]
+        self.issuer_id.choices = issuer_choices()
 
 class AddIssuerForm(FlaskForm):
     issuer_name = StringField('Issuer Name', validators=[DataRequired()])
@@ -85,7 +87,7 @@ class AddProductForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(AddProductForm, self).__init__(*args, **kwargs)
-        self.issuer_id.choices = [(i.issuer_id, i.issuer_name) for i in Issuer.query.all()]
+        self.issuer_id.choices = issuer_choices()
 
 class EditIssuerForm(FlaskForm):
     issuer_name = StringField('Issuer Name', validators=[DataRequired()])
@@ -105,7 +107,7 @@ class EditProductForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(EditProductForm, self).__init__(*args, **kwargs)
-        self.issuer_id.choices = [(i.issuer_id, i.issuer_name) for i in Issuer.query.all()]
+        self.issuer_id.choices = issuer_choices()
 
 class DynamicFeeForm(FlaskForm):
     fee_id = SelectField('Fee', coerce=str, validators=[DataRequired()])
@@ -134,6 +136,18 @@ class ClientProductFeeMappingForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(ClientProductFeeMappingForm, self).__init__(*args, **kwargs)
-        self.client_id.choices = [(c.client_id, c.client_name) for c in Client.query.all()]
-        self.product_id.choices = [(p.product_id, p.product_name) for p in Product.query.all()]
-        self.fee_id.choices = [(f.fee_id, f.fee_name) for f in FeeMaster.query.all()]   
\ No newline at end of file
+        self.client_id.choices = client_choices()
+        self.product_id.choices = product_choices()
+        self.fee_id.choices = fee_choices()   
+
+class UploadUnitsForm(FlaskForm):
+    units_file = FileField('Units File (CSV or JSONL)', validators=[FileRequired(), FileAllowed(['csv', 'jsonl', 'ndjson', 'json'], 'CSV or JSONL files only.')])
+    period = StringField('Billing Period (YYYY-MM)', validators=[Optional(), Regexp(r'^\d{4}-\d{2}$', message='Use YYYY-MM.')])
+    strict = BooleanField('Reject the whole file if any row is invalid')
+    submit = SubmitField('Upload')
+
+class BulkImportForm(FlaskForm):
+    kind = SelectField('Import', choices=[('clients', 'Clients'), ('products', 'Products'), ('mappings', 'Client-Product-Fee Mappings')], validators=[DataRequired()])
+    import_file = FileField('File (CSV or JSONL)', validators=[FileRequired(), FileAllowed(['csv', 'jsonl', 'ndjson', 'json'], 'CSV or JSONL files only.')])
+    dry_run = BooleanField('Dry run: validate only, insert nothing')
+    submit = SubmitField('Import')
@@ -1,9 +1,17 @@
-from datetime import datetime
+from datetime import datetime, date
+from flask import current_app
 from models import db
-from models import Client, ClientProductFeeMapping, FeeMaster, InterchangeFee, InvoiceLineItem, FeeHistory
-from flask import request
-from decimal import Decimal
-from sqlalchemy import extract
+from models import Client, ClientProductFeeMapping, FeeMaster, InterchangeFee, Invoice, InvoiceLineItem, FeeHistory, ArchivedFeeCharge
+from num2words import num2words
+from sqlalchemy import and_, or_
+from ids import next_id, next_ids, next_invoice_number
+from mapping_index import get_mapping_index
+from pricing import GST_RATE_PERCENT, to_paise, from_paise, fee_line_units, interchange_line_units, line_price, invoice_price
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
 
 def calculate_interchange_line_item(client_id, start_date, end_date, interchange_share_percentage):
     interchange_fee = InterchangeFee.query.filter_by(
@@ -13,36 +21,28 @@ def calculate_interchange_line_item(client_id, start_date, end_date, interchange
     ).order_by(InterchangeFee.charge_date.desc()).first()
 
     if interchange_fee:
-        interchange_amt = interchange_fee.interchange_amt
-        minimum_interchange = interchange_fee.minimum_interchange
-
-        if interchange_amt == 0 and minimum_interchange == 0:
+        line_units = interchange_line_units(
+            to_paise(interchange_fee.interchange_amt),
+            to_paise(interchange_fee.minimum_interchange),
+            interchange_share_percentage
+        )
+        if line_units is None:
             return None
+        price = line_price(line_units)
 
-        higher_value = max(interchange_amt, minimum_interchange)
-
-        if higher_value == interchange_amt:
-            interchange_amount_ex_gst = interchange_amt / Decimal('1.18')
-            client_share = interchange_amount_ex_gst * (Decimal(interchange_share_percentage) / 100)
-            gst_amount = client_share * Decimal('0.18')
-            final_amount = client_share + gst_amount
-        else:
-            client_share = minimum_interchange
-            gst_amount = client_share * Decimal('0.18')
-            final_amount = client_share + gst_amount
-
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+        end_date_obj = parse_date(end_date)
         description = f"Interchange Fee ({end_date_obj.strftime('%B %Y')})"
 
         line_item = InvoiceLineItem(
             fee_id=None,    
             units=1,
-            unit_price=final_amount,
-            total=final_amount,
-            gst_amount=gst_amount,
-            final_amount=final_amount,
+            unit_price=from_paise(price.unit_price),
+            total=from_paise(price.total),
+            gst_amount=from_paise(price.gst_amount),
+            final_amount=from_paise(price.final_amount),
             description=description
         )
+        line_item.price_units = line_units
 
         return line_item
     return None
@@ -54,71 +54,203 @@ def generate_invoice_line_items(client_id, start_date, end_date, applicable_fees
     if interchange_line_item:
         line_items.append(interchange_line_item)
 
-    for fee in applicable_fees:
-        units = request.form.get(f'units_{fee.fee_id}', 1)
+    charges = []
+    for fee, mapping in applicable_fees:
+        units = form_data.get(f'units_{fee.fee_id}', 1)
         units = int(units) if units else 0
 
         if units == 0:
             continue
 
-        mapping = ClientProductFeeMapping.query.filter_by(
+        charges.append((fee, mapping, units))
+
+    fee_history_ids = next_ids('fee_history', len(charges)) if charges else []
+
+    for (fee, mapping, units), fee_history_id in zip(charges, fee_history_ids):
+        unit_price_paise = to_paise(mapping.unit_price)
+        line_units = fee_line_units(unit_price_paise, units)
+        price = line_price(line_units, unit_price_paise)
+
+        line_item = InvoiceLineItem(
+            invoice=None,  # Set invoice to None initially
+            fee=fee,
+            units=units,
+            unit_price=mapping.unit_price,
+            total=from_paise(price.total),
+            gst_amount=from_paise(price.gst_amount),
+            final_amount=from_paise(price.final_amount)
+        )
+        line_item.price_units = line_units
+        line_items.append(line_item)
+
+        fee_history = FeeHistory(
+            fee_history_id=fee_history_id,
             client_id=client.client_id,
-            fee_id=fee.fee_id
-        ).first()
-
-        if mapping:
-            fee_amount = mapping.unit_price * units
-            gst_amount = fee_amount * Decimal('0.18')
-            final_amount = fee_amount + gst_amount
-
-            line_item = InvoiceLineItem(
-                invoice=None,  # Set invoice to None initially
-                fee=fee,
-                units=units,
-                unit_price=mapping.unit_price,
-                total=fee_amount,
-                gst_amount=gst_amount,
-                final_amount=final_amount
-            )
-            line_items.append(line_item)
-
-            fee_history = FeeHistory(
-                fee_history_id=generate_fee_history_id(),
-                client_id=client.client_id,
-                issuer_id=client.issuer_id,
-                fee_id=fee.fee_id,
-                charge_date=start_date,
-                units=units,
-                total=fee_amount
-            )
-            db.session.add(fee_history)
+            issuer_id=client.issuer_id,
+            fee_id=fee.fee_id,
+            charge_date=start_date,
+            units=units,
+            total=from_paise(price.total)
+        )
+        db.session.add(fee_history)
 
     return line_items
 
+def build_client_invoice(client, biller, start_date, line_items):
+    invoice = Invoice(
+        invoice_id=generate_invoice_id(),
+        biller_id=biller.biller_id,
+        client_id=client.client_id,
+        issuer_id=client.issuer_id,
+        invoice_number=generate_invoice_number(),
+        invoice_date=datetime.now().date(),
+        invoice_amount=0,
+        tax_rate=GST_RATE_PERCENT,
+        tax_amount=0,
+        total_amount=0,
+        invoice_type='client',
+        invoice_month=start_date,
+        charge_date=datetime.now().date()
+    )
+
+    invoice.line_items = line_items
+
+    price = invoice_price([line_item.price_units for line_item in line_items])
+
+    invoice.invoice_amount = from_paise(price.invoice_amount)
+    invoice.tax_amount = from_paise(price.tax_amount)
+    invoice.total_amount = from_paise(price.total_amount)
+    invoice.taxable_amount = from_paise(price.taxable_amount)
+    invoice.rounding_up = from_paise(price.rounding_up)
+    invoice.grand_total = from_paise(price.grand_total)
+    invoice.invoice_amount_in_words = num2words(invoice.grand_total, lang='en_IN', to='currency', currency='INR')
+
+    return invoice
+
+CLIENT_BATCH_SIZE = 500
+
+def month_range(day):
+    start = day.replace(day=1)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+def year_range(day):
+    return day.replace(month=1, day=1), day.replace(year=day.year + 1, month=1, day=1)
+
 def get_applicable_fees(client_id, start_date, end_date, exclude_interchange=False):
-    mappings = ClientProductFeeMapping.query.filter(
-        ClientProductFeeMapping.client_id == client_id,
+    return get_applicable_fees_for_clients([client_id], start_date, end_date, exclude_interchange)[client_id]
+
+def get_applicable_fees_for_clients(client_ids, start_date, end_date, exclude_interchange=False):
+    # {client_id: [(FeeMaster, mapping)]}, the mapping being the one in force that prices the fee.
+    start_date = parse_date(start_date)
+    end_date = parse_date(end_date)
+    applicable_fees = {client_id: [] for client_id in client_ids}
+    client_ids = list(applicable_fees)
+
+    for i in range(0, len(client_ids), CLIENT_BATCH_SIZE):
+        batch = client_ids[i:i + CLIENT_BATCH_SIZE]
+        for client_id, fee, mapping in _applicable_fees_for_batch(batch, start_date, end_date, exclude_interchange):
+            applicable_fees[client_id].append((fee, mapping))
+
+    return applicable_fees
+
+def _active_fee_rows(client_ids, start_date, end_date):
+    # (client_id, FeeMaster, mapping) for every mapping in force during the period, by mapping_id.
+    if current_app.config.get('MAPPING_INDEX_ENABLED'):
+        mappings = get_mapping_index().active_for_clients(client_ids, start_date, end_date)
+        fee_ids = {mapping.fee_id for mapping in mappings}
+        fees = {fee.fee_id: fee for fee in FeeMaster.query.filter(FeeMaster.fee_id.in_(fee_ids))} if fee_ids else {}
+        return [(mapping.client_id, fees[mapping.fee_id], mapping) for mapping in mappings if mapping.fee_id in fees]
+
+    rows = db.session.query(ClientProductFeeMapping, FeeMaster).join(
+        FeeMaster, FeeMaster.fee_id == ClientProductFeeMapping.fee_id
+    ).filter(
+        ClientProductFeeMapping.client_id.in_(client_ids),
         ClientProductFeeMapping.start_date <= end_date,
         ClientProductFeeMapping.end_date >= start_date
-    ).all()
-    applicable_fees = []
+    ).order_by(ClientProductFeeMapping.mapping_id)
+    return [(mapping.client_id, fee, mapping) for mapping, fee in rows]
+
+def _applicable_fees_for_batch(client_ids, start_date, end_date, exclude_interchange):
+    rows = _active_fee_rows(client_ids, start_date, end_date)
 
-    for mapping in mappings:
-        fee = FeeMaster.query.get(mapping.fee_id)
+    if exclude_interchange:
+        rows = [(client_id, fee, mapping) for client_id, fee, mapping in rows if fee.fee_name.lower() != 'interchange']
+    if not rows:
+        return []
 
-        if fee.fee_name.lower() == 'interchange' and exclude_interchange:
+    charged_ever, charged_in_year, charged_in_month = _charged_fee_keys(client_ids, [fee for _, fee, _ in rows], start_date)
+
+    applicable = []
+    for client_id, fee, mapping in rows:
+        key = (client_id, fee.fee_id)
+        if fee.fee_frequency == 'One-time' and key in charged_ever:
             continue
-        elif fee.fee_frequency == 'One-time' and fee_already_charged(client_id, fee.fee_id):
+        elif fee.fee_frequency == 'Yearly' and key in charged_in_year:
             continue
-        elif fee.fee_frequency == 'Yearly' and fee_already_charged_yearly(client_id, fee.fee_id, start_date):
+        elif fee.fee_frequency == 'Monthly' and key in charged_in_month:
             continue
-        elif fee.fee_frequency == 'Monthly':
-            if not fee_already_charged_monthly(client_id, fee.fee_id, start_date):
-                applicable_fees.append(fee)
-        else:
-            applicable_fees.append(fee)
+        applicable.append((client_id, fee, mapping))
 
-    return applicable_fees
+    return applicable
+
+def _charged_fee_keys(client_ids, fees, start_date):
+    # Periodic fees are looked up in their own year or month, as half-open ranges on
+    # charge_date, so a partitioned fee_history (partitions.py) only reads those
+    # partitions. One-time fees need all of history and get a query of their own; OR-ing
+    # them in would make every lookup read every partition.
+    one_time_ids = {fee.fee_id for fee in fees if fee.fee_frequency == 'One-time'}
+    yearly_ids = {fee.fee_id for fee in fees if fee.fee_frequency == 'Yearly'}
+    monthly_ids = {fee.fee_id for fee in fees if fee.fee_frequency == 'Monthly'}
+    year_start, next_year_start = year_range(start_date)
+    month_start, next_month_start = month_range(start_date)
+
+    charged_ever, charged_in_year, charged_in_month = set(), set(), set()
+    if one_time_ids:
+        charged_ever.update(db.session.query(FeeHistory.client_id, FeeHistory.fee_id).filter(
+            FeeHistory.client_id.in_(client_ids),
+            FeeHistory.fee_id.in_(one_time_ids)
+        ).distinct())
+
+    conditions = []
+    if yearly_ids:
+        conditions.append(and_(
+            FeeHistory.fee_id.in_(yearly_ids),
+            FeeHistory.charge_date >= year_start,
+            FeeHistory.charge_date < next_year_start
+        ))
+    if monthly_ids:
+        conditions.append(and_(
+            FeeHistory.fee_id.in_(monthly_ids),
+            FeeHistory.charge_date >= month_start,
+            FeeHistory.charge_date < next_month_start
+        ))
+    if conditions:
+        history = db.session.query(FeeHistory.client_id, FeeHistory.fee_id).filter(
+            FeeHistory.client_id.in_(client_ids),
+            or_(*conditions)
+        ).distinct()
+        for client_id, fee_id in history:
+            if fee_id in yearly_ids:
+                charged_in_year.add((client_id, fee_id))
+            if fee_id in monthly_ids:
+                charged_in_month.add((client_id, fee_id))
+
+    # Charges of archived years (archive.py) count too. Those years are closed, so no
+    # monthly check can fall in them.
+    if one_time_ids or yearly_ids:
+        archived = db.session.query(ArchivedFeeCharge.client_id, ArchivedFeeCharge.fee_id).filter(
+            ArchivedFeeCharge.client_id.in_(client_ids),
+            or_(ArchivedFeeCharge.fee_id.in_(one_time_ids),
+                and_(ArchivedFeeCharge.fee_id.in_(yearly_ids), ArchivedFeeCharge.year == start_date.year))
+        ).distinct()
+        for client_id, fee_id in archived:
+            if fee_id in one_time_ids:
+                charged_ever.add((client_id, fee_id))
+            if fee_id in yearly_ids:
+                charged_in_year.add((client_id, fee_id))
+
+    return charged_ever, charged_in_year, charged_in_month
 
 def fee_already_charged(client_id, fee_id):
     fee_history = FeeHistory.query.filter(
@@ -126,26 +258,35 @@ def fee_already_charged(client_id, fee_id):
         FeeHistory.fee_id == fee_id
     ).first()
 
-    return fee_history is not None
+    return fee_history is not None or ArchivedFeeCharge.query.filter_by(client_id=client_id, fee_id=fee_id).first() is not None
 
 def fee_already_charged_yearly(client_id, fee_id, start_date):
+    year_start, next_year_start = year_range(parse_date(start_date))
     fee_history = FeeHistory.query.filter(
         FeeHistory.client_id == client_id,
         FeeHistory.fee_id == fee_id,
-        extract('year', FeeHistory.charge_date) == start_date.year
+        FeeHistory.charge_date >= year_start,
+        FeeHistory.charge_date < next_year_start
     ).first()
 
-    return fee_history is not None
+    return fee_history is not None or ArchivedFeeCharge.query.get((client_id, fee_id, year_start.year)) is not None
 
 def fee_already_charged_monthly(client_id, fee_id, start_date):
+    month_start, next_month_start = month_range(parse_date(start_date))
     fee_history = FeeHistory.query.filter(
         FeeHistory.client_id == client_id,
         FeeHistory.fee_id == fee_id,
-        extract('year', FeeHistory.charge_date) == start_date.year,
-        extract('month', FeeHistory.charge_date) == start_date.month
+        FeeHistory.charge_date >= month_start,
+        FeeHistory.charge_date < next_month_start
     ).first()
 
     return fee_history is not None
 
 def generate_fee_history_id():
-    return f'FEEHIST-{datetime.now().strftime("%Y%m%d")}-{FeeHistory.query.count() + 1}'
\ No newline at end of file
+    return next_id('fee_history')
+
+def generate_invoice_id():
+    return next_id('invoices')
+
+def generate_invoice_number():
+    return next_invoice_number()
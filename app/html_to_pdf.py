@@ -1,18 +1,229 @@
 import pdfkit
 import os
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from io import BytesIO
+from flask import render_template
+from metrics import PDF_RENDER_SECONDS, PDF_RENDERER_QUEUE_DEPTH, PDF_RENDERER_IN_FLIGHT, PDF_RENDERER_REJECTIONS
+from pdf_native import render_invoice_document
+
+class RendererBusy(Exception):
+    pass
+
+class RenderTimeout(Exception):
+    pass
+
+class PdfkitRenderer:
+    # One wkhtmltopdf process per job; the configuration lookup is done once.
+
+    def __init__(self, wkhtmltopdf_path=None, timeout=None):
+        self.wkhtmltopdf_path = wkhtmltopdf_path or os.environ.get('WKHTMLTOPDF_PATH', '/usr/bin/wkhtmltopdf')
+        self.timeout = timeout
+        self._configuration = None
+
+    def render(self, html, timeout=None):
+        if self._configuration is None:
+            self._configuration = pdfkit.configuration(wkhtmltopdf=self.wkhtmltopdf_path)
+        # Drive wkhtmltopdf ourselves so a hung render can be killed.
+        args = pdfkit.PDFKit(html, 'string', configuration=self._configuration).command()
+        try:
+            result = subprocess.run(args, input=html.encode('utf-8'), capture_output=True, timeout=timeout or self.timeout)
+        except subprocess.TimeoutExpired:
+            raise RenderTimeout(f'wkhtmltopdf did not finish within {timeout or self.timeout}s')
+        if result.returncode != 0 or not result.stdout:
+            raise IOError(f'wkhtmltopdf exited with code {result.returncode}: {result.stderr.decode("utf-8", errors="replace")}')
+        return result.stdout
+
+    def close(self):
+        pass
+
+class NativeRenderer:
+    # Draws the invoice in-process (pdf_native): no subprocess, but it only understands the
+    # invoice template's markup. It can't be interrupted, so `timeout` is not enforced.
+
+    def __init__(self, static_folder=None):
+        self.static_folder = static_folder
+
+    def render(self, html, timeout=None):
+        return render_invoice_document(html, self.static_folder)
+
+    def close(self):
+        pass
+
+class PooledRenderer:
+    # N long-lived workers, each owning a backend renderer that is recycled after
+    # `recycle_after` jobs. Jobs wait in a bounded queue; a full queue fails fast with
+    # RendererBusy instead of tying up the web worker.
+
+    def __init__(self, factory, workers=2, queue_size=16, timeout=30, recycle_after=100):
+        self.factory = factory
+        self.workers = workers
+        self.timeout = timeout
+        self.recycle_after = recycle_after
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._metrics = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0, 'recycled': 0,
+            'in_flight': 0, 'latency_seconds_sum': 0.0, 'latency_seconds_max': 0.0,
+        }
+
+    def _ensure_started(self):
+        # Threads don't survive a fork (e.g. gunicorn --preload), so start them in the
+        # process that actually renders.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._threads = [threading.Thread(target=self._work, name=f'pdf-renderer-{i}', daemon=True) for i in range(self.workers)]
+                for thread in self._threads:
+                    thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, html):
+        self._ensure_started()
+        future = Future()
+        try:
+            self._jobs.put_nowait((html, future, time.perf_counter()))
+        except queue.Full:
+            self._count('rejected')
+            PDF_RENDERER_REJECTIONS.inc()
+            raise RendererBusy('PDF renderer queue is full')
+        PDF_RENDERER_QUEUE_DEPTH.inc()
+        self._count('submitted')
+        return future
+
+    def render(self, html, timeout=None):
+        timeout = timeout or self.timeout
+        # The caller waits up to one timeout for a renderer and one more for the render,
+        # which the worker bounds with the same timeout. A job given up on while still
+        # queued is cancelled, so no renderer spends time on it.
+        future = self.submit(html)
+        try:
+            return future.result(timeout=timeout * 2 if timeout else None)
+        except FutureTimeout:
+            future.cancel()
+            self._count('timeouts')
+            raise RenderTimeout(f'PDF render did not finish within {timeout * 2}s')
+
+    def _work(self):
+        renderer, jobs_done = self.factory(), 0
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            html, future, queued_at = job
+            PDF_RENDERER_QUEUE_DEPTH.dec()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self._count('in_flight')
+            PDF_RENDERER_IN_FLIGHT.inc()
+            try:
+                future.set_result(renderer.render(html, timeout=self.timeout))
+                self._count('completed')
+            except RenderTimeout as e:
+                self._count('timeouts')
+                future.set_exception(e)
+            except Exception as e:
+                self._count('failed')
+                future.set_exception(e)
+            finally:
+                PDF_RENDERER_IN_FLIGHT.dec()
+                with self._lock:
+                    latency = time.perf_counter() - queued_at
+                    self._metrics['in_flight'] -= 1
+                    self._metrics['latency_seconds_sum'] += latency
+                    self._metrics['latency_seconds_max'] = max(self._metrics['latency_seconds_max'], latency)
+
+            jobs_done += 1
+            if self.recycle_after and jobs_done >= self.recycle_after:
+                renderer.close()
+                renderer, jobs_done = self.factory(), 0
+                self._count('recycled')
+        renderer.close()
+
+    def _count(self, name):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['queue_depth'] = self._jobs.qsize()
+        return metrics
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+RENDERER_BACKENDS = {
+    'pdfkit': lambda app: PdfkitRenderer(app.config.get('WKHTMLTOPDF_PATH'), app.config.get('PDF_RENDER_TIMEOUT')),
+    'native': lambda app: NativeRenderer(app.static_folder),
+}
+
+_renderer = None
+_backend_name = 'pdfkit'
+
+def init_renderer(app):
+    global _renderer, _backend_name
+    _backend_name = app.config.get('PDF_RENDERER_BACKEND', 'pdfkit')
+    backend = RENDERER_BACKENDS[_backend_name]
+    if app.config.get('PDF_RENDERER_POOL_SIZE'):
+        _renderer = PooledRenderer(
+            lambda: backend(app),
+            workers=app.config['PDF_RENDERER_POOL_SIZE'],
+            queue_size=app.config.get('PDF_RENDERER_QUEUE_SIZE', 16),
+            timeout=app.config.get('PDF_RENDER_TIMEOUT'),
+            recycle_after=app.config.get('PDF_RENDERER_RECYCLE_AFTER', 100)
+        )
+    else:
+        _renderer = backend(app)
+    app.extensions['pdf_renderer'] = _renderer
+    return _renderer
+
+def backend_name():
+    return _backend_name
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = PdfkitRenderer()
+    return _renderer
+
+def render_invoice_html(invoice):
+    return render_template('invoice_template.html', invoice=invoice, client=invoice.client, line_items=invoice.line_items)
+
+def render_pdf(html):
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        pdf = get_renderer().render(html)
+        outcome = 'ok'
+        return pdf
+    except RendererBusy:
+        outcome = 'busy'
+        raise
+    except RenderTimeout:
+        outcome = 'timeout'
+        raise
+    finally:
+        PDF_RENDER_SECONDS.labels(_backend_name, outcome).observe(time.perf_counter() - started)
 
 def generate_pdf_from_html(html, output_path=None):
-    # Configure pdfkit
-    config = pdfkit.configuration(wkhtmltopdf=os.environ.get('WKHTMLTOPDF_PATH', '/usr/bin/wkhtmltopdf'))
+    pdf = render_pdf(html)
 
-    # Generate the PDF from the HTML
     if output_path:
-        pdfkit.from_string(html, output_path, configuration=config)
-        with open(output_path, 'rb') as f:
-            pdf_data = f.read()
+        with open(output_path, 'wb') as f:
+            f.write(pdf)
+        pdf_data = pdf
     else:
-        pdf = pdfkit.from_string(html, False, configuration=config)
         pdf_data = BytesIO(pdf)
 
-    return pdf_data
\ No newline at end of file
+    return pdf_data
@@ -0,0 +1,76 @@
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from models import db, IdCounter, User, Client, Issuer, FeeMaster, Product, Invoice, FeeHistory
+
+# Counter name -> (ID prefix, primary key column). Existing IDs look like '<PREFIX>-<YYYYMMDD>-<n>'.
+ID_SEQUENCES = {
+    'users': ('USER', User.user_id),
+    'clients': ('CLIENT', Client.client_id),
+    'issuers': ('ISSUER', Issuer.issuer_id),
+    'fee_master': ('FEE', FeeMaster.fee_id),
+    'products': ('PROD', Product.product_id),
+    'invoices': ('INV', Invoice.invoice_id),
+    'fee_history': ('FEEHIST', FeeHistory.fee_history_id),
+}
+
+def allocate(name, count=1, seed=None):
+    # Reserves `count` consecutive values of counter `name`. The counter row stays locked
+    # until the caller's transaction ends, so values are never handed out twice and roll
+    # back together with whatever used them (which keeps invoice numbers gap-free).
+    last = _increment(name, count)
+    if last is None:
+        _create_counter(name, seed() if seed else 0)
+        last = _increment(name, count)
+    return range(last - count + 1, last + 1)
+
+def _increment(name, count):
+    statement = IdCounter.__table__.update().where(IdCounter.name == name).values(
+        value=IdCounter.value + count,
+        modified_at=datetime.utcnow()
+    )
+    if db.engine.dialect.implicit_returning:
+        return db.session.execute(statement.returning(IdCounter.value)).scalar()
+    if db.session.execute(statement).rowcount != 1:
+        return None
+    return db.session.query(IdCounter.value).filter(IdCounter.name == name).scalar()
+
+def _create_counter(name, value):
+    try:
+        with db.session.begin_nested():
+            db.session.add(IdCounter(name=name, value=value))
+    except IntegrityError:
+        # Another transaction created it first.
+        pass
+
+def _max_suffix(query):
+    # One-off scan used only to seed a counter that doesn't exist yet.
+    highest = 0
+    for value, in query:
+        suffix = value.rsplit('-', 1)[-1]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+def next_ids(name, count=1):
+    prefix, column = ID_SEQUENCES[name]
+    today = datetime.now().strftime('%Y%m%d')
+    numbers = allocate(name, count, seed=lambda: _max_suffix(db.session.query(column)))
+    return [f'{prefix}-{today}-{n}' for n in numbers]
+
+def next_id(name):
+    return next_ids(name)[0]
+
+def financial_year(day):
+    start_year = day.year if day.month >= 4 else day.year - 1
+    return f'{start_year}-{str(start_year + 1)[-2:]}'
+
+def next_invoice_number(invoice_date=None):
+    invoice_date = invoice_date or datetime.now().date()
+    fy = financial_year(invoice_date)
+    start_year = int(fy[:4])
+    fy_invoices = db.session.query(Invoice.invoice_number).filter(
+        Invoice.invoice_date >= invoice_date.replace(year=start_year, month=4, day=1),
+        Invoice.invoice_date < invoice_date.replace(year=start_year + 1, month=4, day=1)
+    )
+    n = allocate(f'invoice_number:{fy}', seed=lambda: _max_suffix(fy_invoices))[0]
+    return f'INV-{invoice_date.strftime("%Y%m%d")}-{n}'
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import tempfile
+from datetime import datetime
+from flask import current_app, request
+from werkzeug.utils import secure_filename, send_file
+from html_to_pdf import render_invoice_html, render_pdf
+from pdf_cache import pdf_cache
+
+# Issued invoices never change (edit_invoice writes a new Invoice), so each one is rendered
+# once, by the render_invoice_pdf job, and kept under INVOICE_PDF_DIR. The invoice row
+# records where (pdf_path, relative to the store) and the file's SHA-256, which is also
+# its ETag. Views stream the file with conditional and Range support, or hand it to the
+# front-end server with INVOICE_PDF_OFFLOAD:
+#   x-sendfile        Apache/lighttpd: X-Sendfile with the absolute path.
+#   x-accel-redirect  nginx: X-Accel-Redirect to INVOICE_PDF_ACCEL_PREFIX + pdf_path, e.g.
+#                     location /protected-invoices/ { internal; alias <INVOICE_PDF_DIR>/; }
+# The front-end server usually runs as another user, so files get INVOICE_PDF_FILE_MODE
+# (0644 by default) rather than mkstemp's 0600.
+
+OFFLOAD_MODES = ('x-sendfile', 'x-accel-redirect')
+
+class InvoicePdfStore:
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.offload = None
+        self.accel_prefix = None
+        self.file_mode = 0o644
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('INVOICE_PDF_DIR') or os.path.join(app.instance_path, 'invoice_pdfs')
+        self.offload = app.config.get('INVOICE_PDF_OFFLOAD') or None
+        if self.offload and self.offload not in OFFLOAD_MODES:
+            raise ValueError(f'INVOICE_PDF_OFFLOAD must be one of {OFFLOAD_MODES}, not {self.offload!r}')
+        self.accel_prefix = app.config.get('INVOICE_PDF_ACCEL_PREFIX', '/protected-invoices/')
+        self.file_mode = app.config.get('INVOICE_PDF_FILE_MODE', 0o644)
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['invoice_pdfs'] = self
+
+    def relative_path(self, invoice):
+        # One directory per invoice month keeps directories small and archiving simple.
+        month = invoice.invoice_month or invoice.invoice_date
+        return f'{month:%Y-%m}/{secure_filename(invoice.invoice_id)}.pdf'
+
+    def path(self, invoice):
+        return os.path.join(self.directory, invoice.pdf_path)
+
+    def has(self, invoice):
+        return bool(invoice.pdf_path) and os.path.exists(self.path(invoice))
+
+    def save(self, invoice, data):
+        relative = self.relative_path(invoice)
+        target = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, self.file_mode)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        invoice.pdf_path = relative
+        invoice.pdf_sha256 = hashlib.sha256(data).hexdigest()
+        invoice.pdf_size = len(data)
+        invoice.pdf_rendered_at = datetime.utcnow()
+
+    def read(self, invoice):
+        with open(self.path(invoice), 'rb') as f:
+            return f.read()
+
+    def verify(self, invoice):
+        digest = hashlib.sha256()
+        with open(self.path(invoice), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest() == invoice.pdf_sha256
+
+    def send(self, invoice, as_attachment=False):
+        download_name = f'invoice_{invoice.invoice_number}.pdf'
+        if self.offload == 'x-accel-redirect':
+            response = current_app.response_class(mimetype='application/pdf')
+            response.headers['X-Accel-Redirect'] = self.accel_prefix + invoice.pdf_path
+            response.headers['Content-Disposition'] = f"{'attachment' if as_attachment else 'inline'}; filename={download_name}"
+            response.set_etag(invoice.pdf_sha256)
+            response.last_modified = invoice.pdf_rendered_at
+            return response.make_conditional(request.environ)
+        return send_file(
+            self.path(invoice), request.environ,
+            mimetype='application/pdf',
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=invoice.pdf_sha256,
+            last_modified=invoice.pdf_rendered_at,
+            max_age=current_app.config.get('INVOICE_PDF_MAX_AGE', 0),
+            use_x_sendfile=self.offload == 'x-sendfile',
+            response_class=current_app.response_class
+        )
+
+invoice_pdfs = InvoicePdfStore()
+
+def store_invoice_pdf(invoice):
+    # Not through pdf_cache: the stored file is the only copy kept.
+    invoice_pdfs.save(invoice, render_pdf(render_invoice_html(invoice)))
+
+def send_invoice_pdf(invoice, as_attachment=False):
+    if invoice_pdfs.has(invoice):
+        return invoice_pdfs.send(invoice, as_attachment)
+    # Not rendered yet (job still queued, or an invoice from before the store): render on
+    # the fly; `flask pdfs backfill` stores it for next time.
+    if invoice.pdf_path:
+        current_app.logger.warning(f'Stored PDF for invoice {invoice.invoice_id} is missing: {invoice.pdf_path}')
+    response = current_app.response_class(pdf_cache.render(render_invoice_html(invoice)), mimetype='application/pdf')
+    response.headers['Content-Disposition'] = f"{'attachment' if as_attachment else 'inline'}; filename=invoice_{invoice.invoice_number}.pdf"
+    return response
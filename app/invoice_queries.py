@@ -0,0 +1,131 @@
+import base64
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from models import db, Invoice, ArchivedInvoice
+from functions import month_range
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+COUNT_CAP = 10000
+
+def invoice_filters_from_args(args):
+    filters = {}
+    for name in ('client_id', 'issuer_id'):
+        if args.get(name):
+            filters[name] = args[name]
+    if args.get('month'):
+        try:
+            filters['month'] = datetime.strptime(args['month'], '%Y-%m').date()
+        except ValueError:
+            pass
+    for name in ('min_amount', 'max_amount'):
+        if args.get(name):
+            try:
+                filters[name] = Decimal(args[name])
+            except InvalidOperation:
+                pass
+    for name in ('date_from', 'date_to'):
+        if args.get(name):
+            try:
+                filters[name] = datetime.strptime(args[name], '%Y-%m-%d').date()
+            except ValueError:
+                pass
+    return filters
+
+def filter_invoices(query, filters, model=Invoice):
+    # `model` may also be ArchivedInvoice, which has the same columns.
+    if filters.get('client_id'):
+        query = query.filter(model.client_id == filters['client_id'])
+    if filters.get('issuer_id'):
+        query = query.filter(model.issuer_id == filters['issuer_id'])
+    if filters.get('month'):
+        month_start, next_month_start = month_range(filters['month'])
+        query = query.filter(model.invoice_month >= month_start, model.invoice_month < next_month_start)
+    if filters.get('min_amount') is not None:
+        query = query.filter(model.total_amount >= filters['min_amount'])
+    if filters.get('max_amount') is not None:
+        query = query.filter(model.total_amount <= filters['max_amount'])
+    if filters.get('date_from'):
+        query = query.filter(model.invoice_date >= filters['date_from'])
+    if filters.get('date_to'):
+        query = query.filter(model.invoice_date <= filters['date_to'])
+    return query
+
+def encode_cursor(invoice):
+    raw = f'{invoice.invoice_date.isoformat()}|{invoice.invoice_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        invoice_date, invoice_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+        return date.fromisoformat(invoice_date), invoice_id
+    except (ValueError, UnicodeError):
+        return None
+
+def keyset_page(query, after=None, before=None, per_page=DEFAULT_PAGE_SIZE, archived=None):
+    # Newest first, ordered by (invoice_date, invoice_id) so the page boundary is stable
+    # and each page is an index range scan rather than an OFFSET. invoice_id compares as
+    # text, so within a day 'INV-...-10' sorts before 'INV-...-9' rather than in creation
+    # order (the templates say so). `archived` is the same
+    # filter over ArchivedInvoice; its stubs are merged in by the same key.
+    per_page = max(1, min(per_page or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    sources = [(query, Invoice)] + ([(archived, ArchivedInvoice)] if archived is not None else [])
+    counts = [approximate_count(source, model) for source, model in sources]
+    total, total_is_estimate = sum(count for count, _ in counts), any(estimate for _, estimate in counts)
+    if total > COUNT_CAP:
+        total, total_is_estimate = COUNT_CAP, True
+
+    before_key = decode_cursor(before) if before else None
+    after_key = decode_cursor(after) if after else None
+    rows = []
+    for source, model in sources:
+        source = source.options(
+            joinedload(model.biller),
+            joinedload(model.client),
+            joinedload(model.issuer)
+        )
+        rows += _keyset_rows(source, model, before_key, after_key, per_page + 1)
+
+    if before_key:
+        rows = sorted(rows, key=lambda invoice: (invoice.invoice_date, invoice.invoice_id))[:per_page + 1]
+        has_more = len(rows) > per_page
+        invoices = list(reversed(rows[:per_page]))
+        has_newer, has_older = has_more, True
+    else:
+        rows = sorted(rows, key=lambda invoice: (invoice.invoice_date, invoice.invoice_id), reverse=True)[:per_page + 1]
+        invoices = rows[:per_page]
+        has_newer, has_older = bool(after_key), len(rows) > per_page
+
+    return {
+        'invoices': invoices,
+        'next_cursor': encode_cursor(invoices[-1]) if invoices and has_older else None,
+        'prev_cursor': encode_cursor(invoices[0]) if invoices and has_newer else None,
+        'total': total,
+        'total_is_estimate': total_is_estimate,
+        'per_page': per_page,
+    }
+
+def _keyset_rows(query, model, before_key, after_key, limit):
+    if before_key:
+        invoice_date, invoice_id = before_key
+        return query.filter(or_(
+            model.invoice_date > invoice_date,
+            and_(model.invoice_date == invoice_date, model.invoice_id > invoice_id)
+        )).order_by(model.invoice_date.asc(), model.invoice_id.asc()).limit(limit).all()
+    if after_key:
+        invoice_date, invoice_id = after_key
+        query = query.filter(or_(
+            model.invoice_date < invoice_date,
+            and_(model.invoice_date == invoice_date, model.invoice_id < invoice_id)
+        ))
+    return query.order_by(model.invoice_date.desc(), model.invoice_id.desc()).limit(limit).all()
+
+def approximate_count(query, model=Invoice):
+    # Counting stops at COUNT_CAP so a huge, unfiltered history doesn't cost a full scan.
+    capped = query.with_entities(model.invoice_id).order_by(None).limit(COUNT_CAP + 1).subquery()
+    total = db.session.query(db.func.count()).select_from(capped).scalar()
+    if total > COUNT_CAP:
+        return COUNT_CAP, True
+    return total, False
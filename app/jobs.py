@@ -0,0 +1,243 @@
+import json
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, and_
+from models import db, Job, Client, Invoice
+from functions import parse_date, get_applicable_fees, calculate_interchange_line_item, generate_invoice_line_items, build_client_invoice
+from reference_cache import current_biller
+from invoice_pdfs import invoice_pdfs, store_invoice_pdf
+from revenue import record_invoice
+
+# A small job queue kept in the `jobs` table. Workers claim rows with
+# SELECT ... FOR UPDATE SKIP LOCKED, so any number of `flask worker` processes can share it.
+# A claimed job is leased until locked_until (JOB_VISIBILITY_TIMEOUT); if its worker dies,
+# another worker picks it up once the lease runs out. Handlers only add to the session:
+# their writes commit in the same transaction that marks the job done, so a job that is
+# retried never leaves half of its work behind.
+
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+def enqueue(kind, payload, created_by=None, parent_job_id=None, max_attempts=None):
+    # Adds the job to the session; it becomes visible to workers when the caller commits.
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        status='queued',
+        max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 3),
+        run_after=datetime.utcnow(),
+        created_by=created_by,
+        parent_job_id=parent_job_id
+    )
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+def claim_jobs(worker_id, limit, kinds=None):
+    now = datetime.utcnow()
+    lease = timedelta(seconds=current_app.config.get('JOB_VISIBILITY_TIMEOUT', 300))
+    query = db.session.query(Job.job_id, Job.attempts).filter(or_(
+        and_(Job.status == 'queued', Job.run_after <= now),
+        and_(Job.status == 'running', Job.locked_until < now)
+    ))
+    if kinds:
+        query = query.filter(Job.kind.in_(kinds))
+    candidates = query.order_by(Job.job_id).limit(limit).with_for_update(skip_locked=True).all()
+
+    claimed = []
+    for job_id, attempts in candidates:
+        # The attempts check makes the claim safe where FOR UPDATE is a no-op (SQLite).
+        updated = Job.query.filter(Job.job_id == job_id, Job.attempts == attempts).update({
+            'status': 'running',
+            'attempts': attempts + 1,
+            'locked_by': worker_id,
+            'locked_until': now + lease,
+        }, synchronize_session=False)
+        if updated:
+            claimed.append(job_id)
+    db.session.commit()
+    return claimed
+
+def run_job(job_id, worker_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.status != 'running' or job.locked_by != worker_id:
+        return None
+    kind, attempt = job.kind, job.attempts
+    handler = JOB_HANDLERS.get(kind)
+
+    try:
+        if handler is None:
+            raise LookupError(f'No handler for job kind {kind!r}')
+        result = handler(job, json.loads(job.payload))
+
+        # If the lease ran out mid-job another worker owns it now; let that run win.
+        db.session.refresh(job, with_for_update=True)
+        if job.locked_by != worker_id or job.attempts != attempt:
+            db.session.rollback()
+            current_app.logger.warning(f'Job {job_id} ({kind}): lease lost on attempt {attempt}, discarding result')
+            return None
+
+        job.status = 'done'
+        job.result = json.dumps(result) if result is not None else None
+        job.error = None
+        job.finished_at = datetime.utcnow()
+        job.locked_until = None
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f'Job {job_id} ({kind}) failed on attempt {attempt}')
+        job = db.session.get(Job, job_id)
+        if job.locked_by != worker_id or job.attempts != attempt:
+            return None
+        job.error = f'{type(e).__name__}: {e}'
+        job.locked_until = None
+        if job.attempts < job.max_attempts:
+            backoff = current_app.config.get('JOB_RETRY_BACKOFF', 10) * 2 ** (job.attempts - 1)
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=backoff)
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+    return job.status
+
+def run_inline(job):
+    # JOBS_RUN_INLINE: process a just-committed job in the request (no worker needed).
+    worker_id = f'inline-{os.getpid()}'
+    if claim_specific(job.job_id, worker_id):
+        run_job(job.job_id, worker_id)
+
+def claim_specific(job_id, worker_id):
+    lease = timedelta(seconds=current_app.config.get('JOB_VISIBILITY_TIMEOUT', 300))
+    updated = Job.query.filter(Job.job_id == job_id, Job.status == 'queued').update({
+        'status': 'running',
+        'attempts': Job.attempts + 1,
+        'locked_by': worker_id,
+        'locked_until': datetime.utcnow() + lease,
+    }, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+def dispatch(job):
+    # Call after committing the transaction that enqueued `job`.
+    if current_app.config.get('JOBS_RUN_INLINE'):
+        run_inline(job)
+        for child in Job.query.filter_by(parent_job_id=job.job_id, status='queued').all():
+            dispatch(child)
+
+def job_status(job):
+    status = {
+        'job_id': job.job_id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    children = Job.query.filter_by(parent_job_id=job.job_id).order_by(Job.job_id).all()
+    if children:
+        status['children'] = [job_status(child) for child in children]
+    return status
+
+class Worker:
+    # Polls for jobs and runs up to `concurrency` of them at once on threads, each with its
+    # own app context (and so its own scoped session). SIGTERM/SIGINT stop claiming new
+    # jobs and wait for the running ones.
+
+    def __init__(self, app, concurrency=2, poll_interval=1.0, kinds=None):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.kinds = kinds
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self._stopping = threading.Event()
+
+    def stop(self, *args):
+        self._stopping.set()
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                return run_job(job_id, self.worker_id)
+            finally:
+                db.session.remove()
+
+    def _claim(self, limit):
+        with self.app.app_context():
+            try:
+                return claim_jobs(self.worker_id, limit, self.kinds)
+            finally:
+                db.session.remove()
+
+    def run(self, once=False, max_jobs=None):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            while not self._stopping.is_set():
+                running = {future for future in running if not future.done()}
+                free = self.concurrency - len(running)
+                if max_jobs:
+                    free = min(free, max_jobs - self.processed)
+                job_ids = self._claim(free) if free > 0 else []
+                for job_id in job_ids:
+                    running.add(pool.submit(self._run, job_id))
+                self.processed += len(job_ids)
+
+                if max_jobs and self.processed >= max_jobs:
+                    break
+                if once and not job_ids and not running:
+                    # Nothing queued and nothing in flight that could still enqueue follow-ups.
+                    break
+                if job_ids:
+                    continue
+                if running:
+                    wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                else:
+                    self._stopping.wait(self.poll_interval)
+        return self.processed
+
+@job_handler('generate_invoice')
+def generate_invoice_job(job, payload):
+    client_id = payload['client_id']
+    start_date, end_date = parse_date(payload['start_date']), parse_date(payload['end_date'])
+    client = db.session.get(Client, client_id)
+    if client is None:
+        raise LookupError(f'Client {client_id} not found')
+
+    applicable_fees = get_applicable_fees(client_id, start_date, end_date, exclude_interchange=True)
+    interchange_line_item = calculate_interchange_line_item(client_id, start_date, end_date, payload.get('interchange_percentage'))
+    line_items = generate_invoice_line_items(client_id, start_date, end_date, applicable_fees, payload.get('form_data', {}), interchange_line_item)
+
+    invoice = build_client_invoice(client, current_biller(), start_date, line_items)
+    db.session.add(invoice)
+    record_invoice(invoice)
+    db.session.flush()
+    current_app.logger.info(f'Job {job.job_id}: invoice {invoice.invoice_number} generated for client {client_id}')
+
+    render = enqueue('render_invoice_pdf', {'invoice_id': invoice.invoice_id}, created_by=job.created_by, parent_job_id=job.job_id)
+    return {'invoice_id': invoice.invoice_id, 'invoice_number': invoice.invoice_number, 'render_job_id': render.job_id}
+
+@job_handler('render_invoice_pdf')
+def render_invoice_pdf_job(job, payload):
+    invoice = db.session.get(Invoice, payload['invoice_id'])
+    if invoice is None:
+        raise LookupError(f"Invoice {payload['invoice_id']} not found")
+    if not invoice_pdfs.has(invoice):
+        store_invoice_pdf(invoice)
+    return {'invoice_id': invoice.invoice_id, 'invoice_number': invoice.invoice_number,
+            'bytes': invoice.pdf_size, 'sha256': invoice.pdf_sha256}
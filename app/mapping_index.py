@@ -0,0 +1,168 @@
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import timedelta
+from models import db, ClientProductFeeMapping
+from reference_cache import reference_version
+
+# "Which mappings of client X are in force during [a, b]?" answered from memory. Each
+# worker builds the index from one scan of client_product_fee_mapping and keeps it in step
+# through the 'mappings' cache version (see reference_cache): writers bump it in the same
+# transaction as the change, and the next lookup re-reads only rows modified since the
+# last load. A row count that no longer matches (rows deleted) forces a full rescan.
+# Results match the SQL overlap query: start_date <= b AND end_date >= a, by mapping_id.
+# Lookups take no lock: refresh builds changed per-client dicts as copies and swaps them
+# in, so a dict a reader holds is never modified.
+
+MappingEntry = namedtuple('MappingEntry', ['mapping_id', 'client_id', 'product_id', 'fee_id', 'unit_price', 'start_date', 'end_date'])
+
+# modified_at comes from the app servers' clocks; re-read a little before the last load.
+CLOCK_SKEW = timedelta(minutes=5)
+SCAN_BATCH_SIZE = 10000
+
+class IntervalList:
+    # The mappings of one (client, fee) sorted by start_date, plus a segment tree over that
+    # order holding the latest end_date below each node. A lookup bisects off the entries
+    # starting after b, then walks only subtrees whose latest end reaches a:
+    # O(log n + k log n) for k matches.
+    __slots__ = ('entries', 'starts', 'size', 'max_end')
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: (entry.start_date, entry.mapping_id))
+        self.starts = [entry.start_date for entry in self.entries]
+        size = 1
+        while size < len(self.entries):
+            size *= 2
+        max_end = [None] * (2 * size)
+        for i, entry in enumerate(self.entries):
+            max_end[size + i] = entry.end_date
+        for node in range(size - 1, 0, -1):
+            left, right = max_end[2 * node], max_end[2 * node + 1]
+            max_end[node] = left if right is None or (left is not None and left >= right) else right
+        self.size = size
+        self.max_end = max_end
+
+    def __len__(self):
+        return len(self.entries)
+
+    def overlapping(self, start, end):
+        limit = bisect_right(self.starts, end)
+        found = []
+        stack = [(1, 0, self.size)]
+        while stack:
+            node, low, high = stack.pop()
+            latest = self.max_end[node]
+            if low >= limit or latest is None or latest < start:
+                continue
+            if node >= self.size:
+                found.append(self.entries[low])
+                continue
+            middle = (low + high) // 2
+            stack.append((2 * node + 1, middle, high))
+            stack.append((2 * node, low, middle))
+        return found
+
+class MappingIndex:
+
+    def __init__(self):
+        self.version = None
+        self.by_client = {}
+        self.entries = {}
+        self.loaded_until = None
+        self.lock = threading.Lock()
+
+    def _query(self):
+        return db.session.query(
+            ClientProductFeeMapping.mapping_id, ClientProductFeeMapping.client_id, ClientProductFeeMapping.product_id,
+            ClientProductFeeMapping.fee_id, ClientProductFeeMapping.unit_price, ClientProductFeeMapping.start_date,
+            ClientProductFeeMapping.end_date, ClientProductFeeMapping.modified_at
+        )
+
+    def load(self, version=None):
+        entries, grouped, loaded_until = {}, {}, None
+        for row in self._query().yield_per(SCAN_BATCH_SIZE):
+            entry = MappingEntry(*row[:7])
+            entries[entry.mapping_id] = entry
+            grouped.setdefault(entry.client_id, {}).setdefault(entry.fee_id, []).append(entry)
+            if row.modified_at is not None and (loaded_until is None or row.modified_at > loaded_until):
+                loaded_until = row.modified_at
+        self.by_client = {client_id: {fee_id: IntervalList(items) for fee_id, items in fees.items()}
+                          for client_id, fees in grouped.items()}
+        self.entries = entries
+        self.loaded_until = loaded_until
+        self.version = version
+
+    def refresh(self, version=None):
+        if self.version is None or self.loaded_until is None:
+            self.load(version)
+            return
+
+        changed, loaded_until = {}, self.loaded_until
+        for row in self._query().filter(ClientProductFeeMapping.modified_at >= self.loaded_until - CLOCK_SKEW):
+            changed[row.mapping_id] = MappingEntry(*row[:7])
+            if row.modified_at > loaded_until:
+                loaded_until = row.modified_at
+
+        total = db.session.query(db.func.count(ClientProductFeeMapping.mapping_id)).scalar()
+        if total != len(self.entries.keys() | changed.keys()):
+            self.load(version)
+            return
+
+        touched = {}
+        for mapping_id, entry in changed.items():
+            previous = self.entries.get(mapping_id)
+            if previous == entry:
+                continue
+            if previous is not None:
+                touched.setdefault((previous.client_id, previous.fee_id), set()).add(mapping_id)
+            touched.setdefault((entry.client_id, entry.fee_id), set()).add(mapping_id)
+            self.entries[mapping_id] = entry
+
+        by_client, copied = dict(self.by_client), set()
+        for (client_id, fee_id), mapping_ids in touched.items():
+            if client_id not in copied:
+                by_client[client_id] = dict(by_client.get(client_id, {}))
+                copied.add(client_id)
+            fees = by_client[client_id]
+            current = fees.get(fee_id)
+            kept = [entry for entry in (current.entries if current else []) if entry.mapping_id not in mapping_ids]
+            kept += [self.entries[mapping_id] for mapping_id in mapping_ids
+                     if (self.entries[mapping_id].client_id, self.entries[mapping_id].fee_id) == (client_id, fee_id)]
+            if kept:
+                fees[fee_id] = IntervalList(kept)
+            else:
+                fees.pop(fee_id, None)
+        for client_id in copied:
+            if not by_client[client_id]:
+                del by_client[client_id]
+        self.by_client = by_client
+        self.loaded_until = loaded_until
+        self.version = version
+
+    def active(self, client_id, start_date, end_date, fee_id=None):
+        fees = self.by_client.get(client_id, {})
+        if fee_id is None:
+            lists = fees.values()
+        else:
+            lists = [fees[fee_id]] if fee_id in fees else []
+        found = [entry for intervals in lists for entry in intervals.overlapping(start_date, end_date)]
+        found.sort(key=lambda entry: entry.mapping_id)
+        return found
+
+    def active_for_clients(self, client_ids, start_date, end_date):
+        found = [entry for client_id in client_ids for entry in self.active(client_id, start_date, end_date)]
+        found.sort(key=lambda entry: entry.mapping_id)
+        return found
+
+_index = MappingIndex()
+
+def get_mapping_index():
+    version = reference_version('mappings')
+    if _index.version != version:
+        with _index.lock:
+            if _index.version != version:
+                _index.refresh(version)
+    return _index
+
+def active_mappings(client_id, start_date, end_date, fee_id=None):
+    return get_mapping_index().active(client_id, start_date, end_date, fee_id)
@@ -0,0 +1,128 @@
+import hmac
+import logging
+import os
+import time
+from flask import g, request, has_request_context, Response, abort
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+
+# Prometheus metrics for requests, SQL, template rendering and PDF generation.
+# Under gunicorn every worker has its own counters; with PROMETHEUS_MULTIPROC_DIR set
+# (gunicorn.conf.py does this) prometheus_client writes them to files in that directory
+# and /metrics sums the files, so any worker can answer a scrape for all of them.
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to build the response, by endpoint.',
+                            ['endpoint', 'method', 'status'])
+REQUEST_QUERIES = Histogram('http_request_queries', 'SQL statements issued per request.', ['endpoint'],
+                            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+REQUEST_QUERY_SECONDS = Histogram('http_request_query_duration_seconds', 'Time per request spent waiting on SQL.', ['endpoint'])
+SLOW_QUERIES = Counter('db_slow_queries_total', 'Statements slower than SLOW_QUERY_SECONDS.', ['endpoint'])
+TEMPLATE_SECONDS = Histogram('template_render_duration_seconds', 'Jinja render time per top-level template.', ['template'])
+PDF_RENDER_SECONDS = Histogram('pdf_render_duration_seconds', 'HTML to PDF conversion time.', ['backend', 'outcome'],
+                               buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+REPLICA_FALLBACKS = Counter('db_replica_fallbacks_total', 'Times a replica read failed and was retried on the primary.')
+PDF_CACHE_EVENTS = Counter('pdf_cache_events_total', 'PDF cache hits, misses and evictions.', ['event'])
+# Pooled PDF renderer (PDF_RENDERER_POOL_SIZE); 'livesum' adds up the workers still running.
+PDF_RENDERER_QUEUE_DEPTH = Gauge('pdf_renderer_queue_depth', 'Render jobs waiting for a renderer.', multiprocess_mode='livesum')
+PDF_RENDERER_IN_FLIGHT = Gauge('pdf_renderer_in_flight', 'Render jobs being rendered.', multiprocess_mode='livesum')
+PDF_RENDERER_REJECTIONS = Counter('pdf_renderer_rejected_total', 'Render jobs refused because the queue was full.')
+
+slow_query_log = logging.getLogger('invoices.slow_query')
+
+_slow_query_seconds = None
+_listening = False
+
+class TimedTemplate(Template):
+    # Included and extended templates render through the parent, so only the template
+    # passed to render_template is observed.
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_SECONDS.labels(self.name or 'string').observe(time.perf_counter() - started)
+
+def _endpoint():
+    if not has_request_context():
+        return 'none'
+    return request.endpoint or 'unmatched'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['_query_started'].pop()
+    if has_request_context() and '_metrics_started' in g:
+        g._metrics_queries += 1
+        g._metrics_query_seconds += elapsed
+
+    if _slow_query_seconds is not None and elapsed >= _slow_query_seconds:
+        endpoint = _endpoint()
+        SLOW_QUERIES.labels(endpoint).inc()
+        route = f'{request.method} {request.path} ({endpoint})' if has_request_context() else f'pid {os.getpid()} outside a request'
+        slow_query_log.warning('Slow query %.3fs in %s: %s', elapsed, route, ' '.join(statement.split())[:2000])
+
+def _handle_error(context):
+    # after_cursor_execute doesn't fire for a failed statement.
+    if context.connection is not None and context.connection.info.get('_query_started'):
+        context.connection.info['_query_started'].pop()
+
+def _start_request():
+    g._metrics_started = time.perf_counter()
+    g._metrics_queries = 0
+    g._metrics_query_seconds = 0.0
+
+def _finish_request(response):
+    # Measured until the view returns; streamed bodies (exports, ZIPs) keep going after this.
+    started = g.pop('_metrics_started', None)
+    if started is None or request.endpoint == 'static':
+        return response
+    endpoint = _endpoint()
+    REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(time.perf_counter() - started)
+    REQUEST_QUERIES.labels(endpoint).observe(g._metrics_queries)
+    REQUEST_QUERY_SECONDS.labels(endpoint).observe(g._metrics_query_seconds)
+    return response
+
+def metrics_registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def init_metrics(app):
+    global _slow_query_seconds, _listening
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    _slow_query_seconds = app.config.get('SLOW_QUERY_SECONDS')
+    if not _listening:
+        # Engines are created lazily (and per process), so listen on the class.
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listening = True
+
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+    # Scrapers show a bearer token or come from an allowed address; with neither configured
+    # /metrics is only served in debug and testing.
+    token = app.config.get('METRICS_TOKEN')
+    allowed_ips = set(app.config.get('METRICS_ALLOWED_IPS') or ())
+    open_access = not token and not allowed_ips and (app.debug or app.testing)
+
+    def metrics():
+        if not open_access and request.remote_addr not in allowed_ips:
+            if not token:
+                abort(404)
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                abort(403)
+        return Response(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
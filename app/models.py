@@ -1,8 +1,21 @@
-from flask_sqlalchemy import SQLAlchemy
+from replica import RoutingSQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import DDL, event
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+# The *_trgm indexes below are pg_trgm GIN indexes serving search.py's ILIKE queries on
+# Postgres; other databases get ordinary indexes on the same columns. The *_prefix ones,
+# on (length, lower-cased value), let it read prefix matches shortest first.
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+def trigram_index(name, column):
+    return db.Index(name, column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+def prefix_index(name, column):
+    return db.Index(name, db.literal_column(f'length({column})'), db.literal_column(f'lower({column})'),
+                    postgresql_ops={f'lower({column})': 'text_pattern_ops'})
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -53,6 +66,14 @@ class Client(db.Model):
 
     __table_args__ = (
         db.CheckConstraint(client_type.in_(['TSP Model', 'Program Manager Model'])),
+        db.Index('ix_clients_client_email', client_email, postgresql_where=client_email.isnot(None), sqlite_where=client_email.isnot(None)),
+        db.Index('ix_clients_issuer_id', issuer_id),
+        trigram_index('ix_clients_client_name_trgm', 'client_name'),
+        trigram_index('ix_clients_client_gstin_trgm', 'client_gstin'),
+        trigram_index('ix_clients_client_email_trgm', 'client_email'),
+        prefix_index('ix_clients_client_name_prefix', 'client_name'),
+        prefix_index('ix_clients_client_gstin_prefix', 'client_gstin'),
+        prefix_index('ix_clients_client_email_prefix', 'client_email'),
     )
 
 class Product(db.Model):
@@ -97,6 +118,10 @@ class ClientProductFeeMapping(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_client_product_fee_mapping_client_dates', client_id, start_date, end_date),
+    )
+
 class InterchangeFee(db.Model):
     __tablename__ = 'interchange_fees'
     interchange_fee_id = db.Column(db.Integer, primary_key=True)
@@ -111,6 +136,10 @@ class InterchangeFee(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_interchange_fees_client_period', client_id, start_date, end_date, charge_date),
+    )
+
 class Invoice(db.Model):
     __tablename__ = 'invoices'
     invoice_id = db.Column(db.String(30), primary_key=True)
@@ -133,14 +162,34 @@ class Invoice(db.Model):
     rounding_up = db.Column(db.Numeric(10, 2))
     grand_total = db.Column(db.Numeric(10, 2))
     invoice_amount_in_words = db.Column(db.Text)
+    pdf_path = db.Column(db.String(255))  # relative to INVOICE_PDF_DIR
+    pdf_sha256 = db.Column(db.String(64))
+    pdf_size = db.Column(db.Integer)
+    pdf_rendered_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # True on invoices read back from the archive (archive.py), which aren't in the session.
+    archived = False
+
+    __table_args__ = (
+        db.Index('ix_invoices_date_id', invoice_date, invoice_id),
+        db.Index('ix_invoices_client_date_id', client_id, invoice_date, invoice_id),
+        db.Index('ix_invoices_issuer_month', issuer_id, invoice_month),
+        db.Index('ix_invoices_modified_at', modified_at),
+        trigram_index('ix_invoices_invoice_number_trgm', 'invoice_number'),
+        prefix_index('ix_invoices_invoice_number_prefix', 'invoice_number'),
+    )
+
 class InvoiceLineItem(db.Model):
     __tablename__ = 'invoice_line_items'
     line_item_id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.String(30), db.ForeignKey('invoices.invoice_id'))
-    invoice = db.relationship('Invoice', backref='line_items')
+    # Copied from the invoice when the line is saved; the partition key when the tables are
+    # partitioned (partitions.py), and part of the join so that loading lines prunes.
+    invoice_date = db.Column(db.Date)
+    invoice = db.relationship('Invoice', backref='line_items', primaryjoin='and_(Invoice.invoice_id == foreign(InvoiceLineItem.invoice_id), '
+                                                                            'Invoice.invoice_date == foreign(InvoiceLineItem.invoice_date))')
     fee_id = db.Column(db.String(30), db.ForeignKey('fee_master.fee_id'))
     fee = db.relationship('FeeMaster', backref='invoice_line_items')
     units = db.Column(db.Integer)
@@ -152,6 +201,14 @@ class InvoiceLineItem(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Unrounded (total, gst, final) from pricing.py, set while an invoice is being built.
+    price_units = None
+
+    __table_args__ = (
+        db.Index('ix_invoice_line_items_invoice_id', invoice_id),
+        db.Index('ix_invoice_line_items_modified_at', modified_at),
+    )
+
 class FeeHistory(db.Model):
     __tablename__ = 'fee_history'
     fee_history_id = db.Column(db.String(30), primary_key=True)
@@ -167,6 +224,10 @@ class FeeHistory(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_fee_history_client_fee_charge_date', client_id, fee_id, charge_date),
+    )
+
 class EditedInvoice(db.Model):
     __tablename__ = 'edited_invoices'
     id = db.Column(db.Integer, primary_key=True)
@@ -177,4 +238,184 @@ class EditedInvoice(db.Model):
 
     original_invoice = db.relationship('Invoice', foreign_keys=[original_invoice_id])
     edited_invoice = db.relationship('Invoice', foreign_keys=[edited_invoice_id])
-    editor = db.relationship('User')
\ No newline at end of file
+    editor = db.relationship('User')
+
+class BillingRun(db.Model):
+    __tablename__ = 'billing_runs'
+    run_id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default='running')
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.CheckConstraint(status.in_(['running', 'completed', 'failed'])),
+    )
+
+class BillingRunClient(db.Model):
+    __tablename__ = 'billing_run_clients'
+    run_id = db.Column(db.Integer, db.ForeignKey('billing_runs.run_id'), primary_key=True)
+    run = db.relationship('BillingRun', backref='clients')
+    client_id = db.Column(db.String(30), db.ForeignKey('clients.client_id'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)
+    invoice_id = db.Column(db.String(30), db.ForeignKey('invoices.invoice_id'))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.CheckConstraint(status.in_(['done', 'skipped', 'failed'])),
+    )
+
+class IdCounter(db.Model):
+    __tablename__ = 'id_counters'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    job_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(100))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    parent_job_id = db.Column(db.Integer, db.ForeignKey('jobs.job_id'))
+    created_by = db.Column(db.String(30), db.ForeignKey('users.user_id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.CheckConstraint(status.in_(['queued', 'running', 'done', 'failed'])),
+        db.Index('ix_jobs_status_run_after', status, run_after),
+        db.Index('ix_jobs_parent_job_id', parent_job_id),
+    )
+
+class FeeUnitUpload(db.Model):
+    __tablename__ = 'fee_unit_uploads'
+    upload_id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255))
+    period = db.Column(db.Date)  # set when the upload was restricted to one billing period
+    status = db.Column(db.String(20), nullable=False, default='processing')
+    rows_total = db.Column(db.Integer, nullable=False, default=0)
+    rows_staged = db.Column(db.Integer, nullable=False, default=0)
+    rows_rejected = db.Column(db.Integer, nullable=False, default=0)
+    error_report = db.Column(db.Text)  # CSV of the rejected rows
+    uploaded_by = db.Column(db.String(30), db.ForeignKey('users.user_id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.CheckConstraint(status.in_(['processing', 'staged', 'partial', 'rejected'])),
+    )
+
+class FeeUnits(db.Model):
+    # Usage units per client, fee and billing month, staged from processor files. They
+    # stand in for the units typed into enter_units.html when invoices are generated.
+    __tablename__ = 'fee_units'
+    client_id = db.Column(db.String(30), db.ForeignKey('clients.client_id'), primary_key=True)
+    fee_id = db.Column(db.String(30), db.ForeignKey('fee_master.fee_id'), primary_key=True)
+    period = db.Column(db.Date, primary_key=True)  # first day of the billing month
+    units = db.Column(db.Integer, nullable=False)
+    upload_id = db.Column(db.Integer, db.ForeignKey('fee_unit_uploads.upload_id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    modified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.CheckConstraint(units >= 0),
+        db.Index('ix_fee_units_period_client', period, client_id),
+    )
+
+class RevenueMonthly(db.Model):
+    # Totals of the invoices in force (not replaced by an edit) per issuer, client and
+    # month, kept by revenue.py in the same transaction as each invoice. '' stands for
+    # an invoice without an issuer or client.
+    __tablename__ = 'revenue_monthly'
+    issuer_id = db.Column(db.String(30), primary_key=True)
+    client_id = db.Column(db.String(30), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # first day of the invoice month
+    invoices = db.Column(db.Integer, nullable=False, default=0)
+    taxable_amount = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    tax_amount = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    grand_total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_revenue_monthly_month', month),
+    )
+
+class RevenueByFee(db.Model):
+    # Line item totals of the same invoices per issuer, client, fee and month. fee_id ''
+    # collects lines without a catalogue fee (interchange).
+    __tablename__ = 'revenue_by_fee'
+    issuer_id = db.Column(db.String(30), primary_key=True)
+    client_id = db.Column(db.String(30), primary_key=True)
+    fee_id = db.Column(db.String(30), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    line_items = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.BigInteger, nullable=False, default=0)
+    total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    gst_amount = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    final_amount = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_revenue_by_fee_month_fee', month, fee_id),
+    )
+
+class ArchivedYear(db.Model):
+    # A closed financial year moved out to files by archive.py. The manifest lists each
+    # file with its SHA-256; its own checksum is kept here.
+    __tablename__ = 'archived_years'
+    financial_year = db.Column(db.String(7), primary_key=True)  # '2023-24'
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)  # exclusive
+    invoices = db.Column(db.Integer, nullable=False, default=0)
+    line_items = db.Column(db.Integer, nullable=False, default=0)
+    fee_history = db.Column(db.Integer, nullable=False, default=0)
+    manifest_sha256 = db.Column(db.String(64), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchivedInvoice(db.Model):
+    # What's left in the database of an archived invoice: the columns invoice_history lists,
+    # and the archive file holding the rest and its line items.
+    __tablename__ = 'archived_invoices'
+    invoice_id = db.Column(db.String(30), primary_key=True)
+    financial_year = db.Column(db.String(7), db.ForeignKey('archived_years.financial_year'), nullable=False)
+    archive_file = db.Column(db.String(255), nullable=False)  # relative to ARCHIVE_DIR
+    biller_id = db.Column(db.String(30), db.ForeignKey('biller.biller_id'))
+    biller = db.relationship('Biller')
+    client_id = db.Column(db.String(30), db.ForeignKey('clients.client_id'))
+    client = db.relationship('Client')
+    issuer_id = db.Column(db.String(30), db.ForeignKey('issuers.issuer_id'))
+    issuer = db.relationship('Issuer')
+    invoice_number = db.Column(db.String(50), nullable=False)
+    invoice_date = db.Column(db.Date, nullable=False)
+    invoice_amount = db.Column(db.Numeric(10, 2), nullable=False)
+    tax_amount = db.Column(db.Numeric(10, 2))
+    total_amount = db.Column(db.Numeric(10, 2))
+    invoice_type = db.Column(db.String(20))
+    invoice_month = db.Column(db.Date)
+    charge_date = db.Column(db.Date)
+
+    archived = True
+
+    __table_args__ = (
+        db.Index('ix_archived_invoices_date_id', invoice_date, invoice_id),
+        db.Index('ix_archived_invoices_client_date_id', client_id, invoice_date, invoice_id),
+    )
+
+class ArchivedFeeCharge(db.Model):
+    # Archived fee_history folded to one row per client, fee and calendar year: enough for
+    # the One-time and Yearly eligibility checks.
+    __tablename__ = 'archived_fee_charges'
+    client_id = db.Column(db.String(30), primary_key=True)
+    fee_id = db.Column(db.String(30), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    charges = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.BigInteger, nullable=False, default=0)
+    total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
@@ -0,0 +1,224 @@
+import re
+from datetime import date
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from models import db, Invoice, InvoiceLineItem, FeeHistory
+
+# Optional Postgres declarative partitioning of the tables that grow with every billing
+# run, by range of their date column, one partition per month or per year, plus a
+# <table>_default partition for anything outside them. Queries that bound the date with
+# literal half-open ranges (functions._charged_fee_keys, the fee_already_charged_* checks)
+# then read only the partitions in range.
+#
+# Postgres requires the partition key in every unique constraint, so once partitioned the
+# primary keys become (id, date). invoice_line_items references invoices through
+# (invoice_id, invoice_date); edited_invoices and billing_run_clients have no date to
+# carry, so their foreign keys to invoices are dropped rather than recreated.
+#
+# `flask partitions convert` (or the migration, with PARTITION_INTERVAL set) converts the
+# tables in place; `flask partitions create` adds the coming periods' partitions and is
+# meant to run from cron. Needs Postgres 12 or later. Functions take the connection to
+# use, so the migration can run them inside its own transaction.
+
+PARTITIONED_TABLES = {
+    # table: (model, partition key, primary key once partitioned)
+    'invoices': (Invoice, 'invoice_date', ('invoice_id', 'invoice_date')),
+    'invoice_line_items': (InvoiceLineItem, 'invoice_date', ('line_item_id', 'invoice_date')),
+    'fee_history': (FeeHistory, 'charge_date', ('fee_history_id', 'charge_date')),
+}
+INTERVALS = ('month', 'year')
+
+# (referencing table, referenced table): the columns to use when the referenced table is partitioned.
+COMPOSITE_FOREIGN_KEYS = {
+    ('invoice_line_items', 'invoices'): ('invoice_id', 'invoice_date'),
+}
+
+def period_start(day, interval):
+    return day.replace(day=1) if interval == 'month' else day.replace(month=1, day=1)
+
+def next_period(start, interval):
+    if interval == 'year':
+        return start.replace(year=start.year + 1)
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+def partition_name(table, start, interval):
+    return f'{table}_{start:%Y_%m}' if interval == 'month' else f'{table}_{start:%Y}'
+
+def _execute(connection, sql, **params):
+    return connection.execute(text(sql), params)
+
+def is_partitioned(connection, table):
+    return _execute(connection, 'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)', table=table).first() is not None
+
+def list_partitions(connection, table):
+    # [(name, bounds, estimated rows)]
+    return _execute(connection, 'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint '
+                                'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                                'WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname', table=table).all()
+
+def partition_interval(connection, table):
+    # Read back from the partition names.
+    for name, _, _ in list_partitions(connection, table):
+        if re.fullmatch(rf'{table}_\d{{4}}_\d{{2}}', name):
+            return 'month'
+        if re.fullmatch(rf'{table}_\d{{4}}', name):
+            return 'year'
+    return None
+
+def create_partition(connection, table, start, interval, parent=None):
+    # Returns False if the partition already exists. Rows for the period already sitting in
+    # the default partition are moved into the new one.
+    parent = parent or table
+    key = PARTITIONED_TABLES[table][1]
+    name = partition_name(table, start, interval)
+    if _execute(connection, 'SELECT to_regclass(:name)', name=name).scalar():
+        return False
+    end = next_period(start, interval)
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    in_range = f'{key} >= :start AND {key} < :end'
+    if not _execute(connection, f'SELECT 1 FROM {table}_default WHERE {in_range} LIMIT 1', start=start, end=end).first():
+        _execute(connection, f'CREATE TABLE {name} PARTITION OF {parent} {bounds}')
+        return True
+
+    _execute(connection, f'CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    _execute(connection, f'INSERT INTO {name} SELECT * FROM {table}_default WHERE {in_range}', start=start, end=end)
+    _execute(connection, f'DELETE FROM {table}_default WHERE {in_range}', start=start, end=end)
+    _execute(connection, f'ALTER TABLE {parent} ATTACH PARTITION {name} {bounds}')
+    return True
+
+def ensure_partitions(connection, ahead=3, today=None):
+    # Partitions for the current period and `ahead` more, on every partitioned table.
+    created = []
+    for table in PARTITIONED_TABLES:
+        interval = partition_interval(connection, table) if is_partitioned(connection, table) else None
+        if interval is None:
+            continue
+        start = period_start(today or date.today(), interval)
+        for _ in range(ahead + 1):
+            if create_partition(connection, table, start, interval):
+                created.append(partition_name(table, start, interval))
+            start = next_period(start, interval)
+    return created
+
+def _drop_incoming_foreign_keys(connection, table):
+    rows = _execute(connection, "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+                                "WHERE contype = 'f' AND confrelid = to_regclass(:table)", table=table).all()
+    for name, referencing in rows:
+        _execute(connection, f'ALTER TABLE {referencing} DROP CONSTRAINT "{name}"')
+
+def _add_foreign_key(connection, table, column, target, referenced):
+    # Returns False where Postgres can't enforce it (see the module comment).
+    if is_partitioned(connection, target):
+        columns = COMPOSITE_FOREIGN_KEYS.get((table, target))
+        if columns is None:
+            return False
+        column = referenced = ', '.join(columns)
+    _execute(connection, f'ALTER TABLE {table} ADD FOREIGN KEY ({column}) REFERENCES {target} ({referenced})')
+    return True
+
+def _restore_foreign_keys(connection, table):
+    # The model's foreign keys from and to `table`. Returns those left out.
+    skipped = []
+    for other in db.metadata.sorted_tables:
+        for foreign_key in other.foreign_keys:
+            target = foreign_key.column.table.name
+            if table not in (other.name, target):
+                continue
+            if not _add_foreign_key(connection, other.name, foreign_key.parent.name, target, foreign_key.column.name):
+                skipped.append(f'{other.name}.{foreign_key.parent.name} -> {target}')
+    return skipped
+
+def _serial_sequences(connection, table):
+    model = PARTITIONED_TABLES[table][0]
+    sequences = []
+    for column in model.__table__.primary_key.columns:
+        sequence = _execute(connection, 'SELECT pg_get_serial_sequence(:table, :column)', table=table, column=column.name).scalar()
+        if sequence:
+            sequences.append((sequence, column.name))
+    return sequences
+
+def _replace_table(connection, table, new):
+    # Drops `table` and puts `new` in its place, keeping the id sequences, then builds the
+    # model's indexes and foreign keys on it.
+    model = PARTITIONED_TABLES[table][0]
+    sequences = _serial_sequences(connection, table)
+    for sequence, _ in sequences:
+        _execute(connection, f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    _drop_incoming_foreign_keys(connection, table)
+    _execute(connection, f'DROP TABLE {table}')
+    _execute(connection, f'ALTER TABLE {new} RENAME TO {table}')
+    _execute(connection, f'ALTER TABLE {table} RENAME CONSTRAINT {new}_pkey TO {table}_pkey')
+    for sequence, column in sequences:
+        _execute(connection, f'ALTER SEQUENCE {sequence} OWNED BY {table}.{column}')
+    for index in model.__table__.indexes:
+        connection.execute(CreateIndex(index))
+    skipped = _restore_foreign_keys(connection, table)
+    _execute(connection, f'ANALYZE {table}')
+    return skipped
+
+def partition_table(connection, table, interval, ahead=3, progress=None):
+    # Copies `table` into a partitioned table of the same name, one partition per period
+    # from its earliest row to `ahead` periods past today. Returns the foreign keys dropped.
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+    if is_partitioned(connection, table):
+        return []
+    key, primary_key = PARTITIONED_TABLES[table][1:]
+    new = f'{table}_partitioned'
+
+    # The partition key can't be null.
+    if table == 'invoice_line_items':
+        _execute(connection, 'UPDATE invoice_line_items SET invoice_date = invoices.invoice_date FROM invoices '
+                             'WHERE invoices.invoice_id = invoice_line_items.invoice_id AND invoice_line_items.invoice_date IS NULL')
+    _execute(connection, f'UPDATE {table} SET {key} = COALESCE(CAST(created_at AS date), CURRENT_DATE) WHERE {key} IS NULL')
+
+    _execute(connection, f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ({key})')
+    _execute(connection, f'ALTER TABLE {new} ALTER COLUMN {key} SET NOT NULL')
+    _execute(connection, f"ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY ({', '.join(primary_key)})")
+    _execute(connection, f'CREATE TABLE {table}_default PARTITION OF {new} DEFAULT')
+
+    today = date.today()
+    first, last = _execute(connection, f'SELECT min({key}), max({key}) FROM {table}').one()
+    start = period_start(min(first or today, today), interval)
+    end = period_start(max(last or today, today), interval)
+    for _ in range(ahead):
+        end = next_period(end, interval)
+    copied = 0
+    while start <= end:
+        create_partition(connection, table, start, interval, parent=new)
+        stop = next_period(start, interval)
+        copied += _execute(connection, f'INSERT INTO {new} SELECT * FROM {table} WHERE {key} >= :start AND {key} < :stop',
+                           start=start, stop=stop).rowcount
+        if progress:
+            progress(f'{table}: {copied} rows copied, up to {stop}.')
+        start = stop
+
+    return _replace_table(connection, table, new)
+
+def unpartition_table(connection, table, progress=None):
+    if not is_partitioned(connection, table):
+        return []
+    model, key, _ = PARTITIONED_TABLES[table]
+    new = f'{table}_plain'
+    primary_key = ', '.join(column.name for column in model.__table__.primary_key.columns)
+    _execute(connection, f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    if model.__table__.c[key].nullable:
+        _execute(connection, f'ALTER TABLE {new} ALTER COLUMN {key} DROP NOT NULL')
+    copied = _execute(connection, f'INSERT INTO {new} SELECT * FROM {table}').rowcount
+    _execute(connection, f'ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY ({primary_key})')
+    if progress:
+        progress(f'{table}: {copied} rows copied.')
+    return _replace_table(connection, table, new)
+
+def partition_tables(connection, interval, ahead=3, progress=None):
+    # Invoices first: line items reference them.
+    skipped = []
+    for table in PARTITIONED_TABLES:
+        skipped += partition_table(connection, table, interval, ahead, progress)
+    return skipped
+
+def unpartition_tables(connection, progress=None):
+    skipped = []
+    for table in reversed(list(PARTITIONED_TABLES)):
+        skipped += unpartition_table(connection, table, progress)
+    return skipped
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import tempfile
+import threading
+from html_to_pdf import render_pdf, backend_name
+from metrics import PDF_CACHE_EVENTS
+
+# Eviction walks the whole directory, so it frees down to this fraction of
+# PDF_CACHE_MAX_BYTES and doesn't rerun on every put once the cache is full.
+EVICT_TO = 0.9
+
+class PdfCache:
+    # Content-addressed: entries are keyed on the SHA-256 of the renderer backend and the
+    # rendered invoice HTML, so anything that changes the output (an edit, a client
+    # address, the template, switching backends) misses. Each process adds what it writes
+    # to the size found by its last scan and only scans again once that is over budget, so
+    # with several workers the directory can run over by their unscanned writes meanwhile.
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_bytes = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._total = None
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('PDF_CACHE_DIR') or os.path.join(app.instance_path, 'pdf_cache')
+        self.max_bytes = app.config.get('PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['pdf_cache'] = self
+
+    def key(self, html):
+        return hashlib.sha256(f'{backend_name()}\0{html}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pdf')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # mtime doubles as the LRU clock.
+            os.utime(path)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return data
+
+    def put(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            if self._total is not None:
+                self._total += len(data)
+            over = self._total is None or self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def render(self, html):
+        key = self.key(html)
+        data = self.get(key)
+        if data is None:
+            data = render_pdf(html)
+            self.put(key, data)
+        return data
+
+    def _evict(self):
+        # Another thread already scanning will bring the total down.
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pdf'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            if total > self.max_bytes:
+                for _, size, path in sorted(entries):
+                    if total <= self.max_bytes * EVICT_TO:
+                        break
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        continue
+                    total -= size
+                    self._count('evictions')
+            with self._lock:
+                self._total = total
+        finally:
+            self._evict_lock.release()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        PDF_CACHE_EVENTS.labels(name).inc()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+pdf_cache = PdfCache()
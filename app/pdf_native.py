@@ -0,0 +1,690 @@
+import html.parser
+import os
+import re
+import struct
+import zlib
+from functools import lru_cache
+
+# Draws invoice_template.html to PDF in-process, for the 'native' renderer backend.
+# This is not a browser. It lays out the markup the invoice template uses: block and
+# flex-row divs, h1, p, strong, img, table, ol and br. The template's CSS is mirrored
+# in the constants below, so change them together with the template's <style>. Text
+# uses the base-14 PDF fonts (Helvetica for Arial), so no fonts are embedded.
+
+PAGE_WIDTH, PAGE_HEIGHT = 595.28, 841.89  # A4, like wkhtmltopdf
+PAGE_MARGIN = 28.35  # 10mm, wkhtmltopdf's default
+PX = 0.6  # one CSS px in points; under 96 dpi (0.75) so a short invoice fits on one page, as with wkhtmltopdf
+BORDER_WIDTH = 1 * PX
+BODY_PADDING = 20 * PX
+FONT_SIZE = 12 * PX
+LINE_HEIGHT = 1.15
+LOGO_SIZE = (100 * PX, 100 * PX)
+CELL_PADDING = 8 * PX
+HEADER_FILL = (0x17 / 255, 0xae / 255, 0xff / 255)
+LIST_INDENT = 40 * PX
+
+CENTERED = {'header', 'company-info', 'footer'}
+RIGHT_ALIGNED = {'totals', 'shipped-to'}
+FLEX_ROWS = {'client-info': 'equal', 'invoice-details': 'spread'}  # flex: 1 vs. sized to content
+DIV_MARGIN_BOTTOM = {'header': 20 * PX, 'company-info': 20 * PX, 'client-info': 20 * PX,
+                     'invoice-details': 20 * PX, 'totals': 20 * PX, 'bank-info': 40 * PX}
+DIV_FONT_SIZE = {'footer': 14 * PX}
+PINNED_TO_BOTTOM = {'footer'}  # margin-top: auto in a 100vh flex column
+
+INLINE_TAGS = {'strong', 'b', 'em', 'i', 'span', 'a', 'small', 'br'}
+VOID_TAGS = {'img', 'br', 'meta', 'link', 'hr', 'input'}
+SKIPPED_TAGS = {'head', 'style', 'script', 'title'}
+
+_HELVETICA = ([278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278] + [556] * 10 +
+              [278, 278, 584, 584, 584, 556, 1015] +
+              [667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611] +
+              [278, 278, 278, 469, 556, 333] +
+              [556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500] +
+              [334, 260, 334, 584])
+_HELVETICA_BOLD = ([278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278] + [556] * 10 +
+                   [333, 333, 584, 584, 584, 611, 975] +
+                   [722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611] +
+                   [333, 278, 333, 584, 556, 333] +
+                   [556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611, 611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500] +
+                   [389, 280, 389, 584])
+_EXTRA_WIDTHS = {'\xa0': 278, '©': 737, '®': 737, '°': 400, '•': 350, '–': 556, '—': 1000,
+                 '‘': 222, '’': 222, '“': 333, '”': 333, '€': 556}
+_WIDTHS = (
+    {**{chr(32 + i): w for i, w in enumerate(_HELVETICA)}, **_EXTRA_WIDTHS},
+    {**{chr(32 + i): w for i, w in enumerate(_HELVETICA_BOLD)}, **_EXTRA_WIDTHS},
+)
+
+_SPACE = re.compile(r'[ \t\r\n\f]+')
+
+def render_invoice_document(html, static_folder=None):
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    document = _Document()
+    layout = _Layout(document)
+    for block in _blocks(builder.root, layout.width, 'left', FONT_SIZE, static_folder):
+        layout.place(block)
+    return document.output()
+
+# -- HTML ------------------------------------------------------------------------------
+
+class _Node:
+    __slots__ = ('tag', 'attrs', 'children')
+
+    def __init__(self, tag, attrs=()):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.children = []
+
+    @property
+    def classes(self):
+        return set((self.attrs.get('class') or '').split())
+
+class _TreeBuilder(html.parser.HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = _Node('root')
+        self._stack = [self.root]
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skipping += 1
+        if self._skipping:
+            return
+        node = _Node(tag, attrs)
+        self._stack[-1].children.append(node)
+        if tag not in VOID_TAGS:
+            self._stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self._skipping:
+            self._stack[-1].children.append(_Node(tag, attrs))
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skipping = max(self._skipping - 1, 0)
+            return
+        if self._skipping:
+            return
+        # Close up to the matching element, tolerating unclosed children.
+        for depth in range(len(self._stack) - 1, 0, -1):
+            if self._stack[depth].tag == tag:
+                del self._stack[depth:]
+                break
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._stack[-1].children.append(data)
+
+def _inline(node, bold=False, runs=None):
+    runs = [] if runs is None else runs
+    for child in node.children:
+        if isinstance(child, str):
+            runs.append((child, bold))
+        elif child.tag == 'br':
+            runs.append(('\n', bold))
+        else:
+            _inline(child, bold or child.tag in ('strong', 'b'), runs)
+    return runs
+
+# -- Text ------------------------------------------------------------------------------
+
+def _encodable(text):
+    # The base-14 fonts are used with WinAnsiEncoding (cp1252).
+    return text.encode('cp1252', 'replace').decode('cp1252')
+
+def _text_width(text, bold, size):
+    widths = _WIDTHS[bold]
+    return sum(widths.get(char, 556) for char in text) * size / 1000
+
+def _words(runs):
+    # Whitespace collapses as in HTML; <br> starts a new line. Returns lines of words,
+    # each word a list of (text, bold) pieces.
+    lines, word = [[]], []
+    for text, bold in runs:
+        if text == '\n':
+            if word:
+                lines[-1].append(word)
+                word = []
+            lines.append([])
+            continue
+        for i, piece in enumerate(_SPACE.split(text)):
+            if i and word:
+                lines[-1].append(word)
+                word = []
+            if piece:
+                word.append((_encodable(piece), bold))
+    if word:
+        lines[-1].append(word)
+    return lines
+
+def _word_width(word, size):
+    return sum(_text_width(text, bold, size) for text, bold in word)
+
+def _wrap(runs, size, width):
+    wrapped = []
+    space = _text_width(' ', False, size)
+    for words in _words(runs):
+        line, line_width = [], 0.0
+        for word in words:
+            word_width = _word_width(word, size)
+            if line and line_width + space + word_width > width:
+                wrapped.append((line, line_width))
+                line, line_width = [], 0.0
+            if line:
+                line.append((' ', word[0][1]))
+                line_width += space
+            line.extend(word)
+            line_width += word_width
+        if line:
+            wrapped.append((line, line_width))
+    return wrapped
+
+# -- Blocks ----------------------------------------------------------------------------
+
+class _Block:
+    margin_top = 0.0
+    margin_bottom = 0.0
+    left = 0.0
+    height = 0.0
+    pinned = False
+    repeat = None  # a table's header row, redrawn when the table breaks across pages
+
+    @property
+    def natural_width(self):
+        return 0.0
+
+class _Paragraph(_Block):
+
+    def __init__(self, lines, size, align, width, margin=0.0):
+        self.lines = lines
+        self.size = size
+        self.align = align
+        self.width = width
+        self.margin_top = self.margin_bottom = margin
+        self.height = len(lines) * size * LINE_HEIGHT
+
+    @property
+    def natural_width(self):
+        return max((line_width for _, line_width in self.lines), default=0.0)
+
+    def draw(self, document, x, top):
+        line_height = self.size * LINE_HEIGHT
+        for line, line_width in self.lines:
+            offset = 0.0
+            if self.align == 'right':
+                offset = self.width - line_width
+            elif self.align == 'center':
+                offset = (self.width - line_width) / 2
+            document.text(x + offset, top, line, self.size)
+            top += line_height
+
+class _Spacer(_Block):
+
+    def __init__(self, height):
+        self.height = height
+
+    def draw(self, document, x, top):
+        pass
+
+class _Image(_Block):
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.image_width = width
+        self.height = height
+
+    @property
+    def natural_width(self):
+        return self.image_width
+
+    def draw(self, document, x, top):
+        document.image(self.path, x, top, self.image_width, self.height)
+
+class _Stack(_Block):
+    # Blocks drawn one under the other with their margins collapsed. `contained` keeps the
+    # outer margins inside (flex items are their own formatting context).
+
+    def __init__(self, blocks, contained=False):
+        self.blocks = blocks
+        self.offsets = []
+        top, margin = 0.0, 0.0
+        for i, block in enumerate(blocks):
+            gap = max(margin, block.margin_top) if i or contained else 0.0
+            top += gap
+            self.offsets.append(top)
+            top += block.height
+            margin = block.margin_bottom
+        if contained:
+            top += margin
+        elif blocks:
+            self.margin_top = blocks[0].margin_top
+            self.margin_bottom = blocks[-1].margin_bottom
+        self.height = top
+
+    @property
+    def natural_width(self):
+        return max((block.left + block.natural_width for block in self.blocks), default=0.0)
+
+    def draw(self, document, x, top):
+        for block, offset in zip(self.blocks, self.offsets):
+            block.draw(document, x + block.left, top + offset)
+
+class _Row(_Block):
+
+    def __init__(self, columns, margin_bottom):
+        self.columns = columns
+        self.margin_bottom = margin_bottom
+        self.height = max((column.height for column in columns), default=0.0)
+
+    def draw(self, document, x, top):
+        for column in self.columns:
+            column.draw(document, x + column.left, top)
+
+class _TableRow(_Block):
+
+    def __init__(self, cells, widths, header):
+        self.cells = cells
+        self.widths = widths
+        self.header = header
+        lines = max((len(cell) for cell in cells), default=0)
+        self.height = max(lines, 1) * FONT_SIZE * LINE_HEIGHT + 2 * CELL_PADDING
+
+    def draw(self, document, x, top):
+        line_height = FONT_SIZE * LINE_HEIGHT
+        for cell, width in zip(self.cells, self.widths):
+            document.rect(x, top, width, self.height, fill=HEADER_FILL if self.header else None)
+            line_top = top + CELL_PADDING
+            for line, line_width in cell:
+                offset = (width - 2 * CELL_PADDING - line_width) / 2 if self.header else 0.0
+                document.text(x + CELL_PADDING + offset, line_top, line, FONT_SIZE)
+                line_top += line_height
+            x += width
+
+def _blocks(node, width, align, size, static_folder):
+    blocks, inline = [], []
+    for child in node.children + [None]:
+        if child is not None and (isinstance(child, str) or child.tag in INLINE_TAGS):
+            inline.append(child)
+            continue
+        if inline:
+            text = _Node('span')
+            text.children = inline
+            lines = _wrap(_inline(text), size, width)
+            if lines:
+                blocks.append(_Paragraph(lines, size, align, width))
+            elif any(isinstance(c, _Node) and c.tag == 'br' for c in inline):
+                blocks.append(_Spacer(size * LINE_HEIGHT))
+            inline = []
+        if child is not None:
+            blocks.extend(_element(child, width, align, size, static_folder))
+    return blocks
+
+def _element(node, width, align, size, static_folder):
+    tag, classes = node.tag, node.classes
+    if tag == 'img':
+        path = _image_path(node.attrs.get('src'), static_folder)
+        return [_Image(path, *LOGO_SIZE)] if path else []
+    if tag in ('h1', 'h2', 'h3'):
+        heading = size * {'h1': 2.0, 'h2': 1.5, 'h3': 1.17}[tag]
+        return [_Paragraph(_wrap(_inline(node, True), heading, width), heading, align, width, margin=0.67 * heading)]
+    if tag == 'p':
+        lines = _wrap(_inline(node), size, width)
+        return [_Paragraph(lines, size, align, width, margin=size)] if lines else []
+    if tag == 'table':
+        return _table(node, width)
+    if tag in ('ol', 'ul'):
+        return _list(node, width, size, static_folder)
+
+    if classes & CENTERED:
+        align = 'center'
+    elif classes & RIGHT_ALIGNED:
+        align = 'right'
+    elif tag == 'div':
+        align = 'left' if 'billed-to' in classes else align
+    for name in classes:
+        size = DIV_FONT_SIZE.get(name, size)
+    margin_bottom = max([DIV_MARGIN_BOTTOM.get(name, 0.0) for name in classes] + [0.0])
+
+    for name in classes:
+        if name in FLEX_ROWS:
+            return [_flex_row(node, width, size, FLEX_ROWS[name], margin_bottom, static_folder)]
+
+    blocks = _blocks(node, width, align, size, static_folder)
+    if not blocks:
+        return []
+    if classes & PINNED_TO_BOTTOM:
+        stack = _Stack(blocks)
+        stack.pinned = True
+        return [stack]
+    blocks[-1].margin_bottom = max(blocks[-1].margin_bottom, margin_bottom)
+    return blocks
+
+def _flex_row(node, width, size, mode, margin_bottom, static_folder):
+    items = [child for child in node.children if isinstance(child, _Node)]
+    if not items:
+        return _Spacer(0.0)
+    columns = []
+    for item in items:
+        item_width = width / len(items)
+        if mode == 'spread':
+            # Sized to content: lay out unconstrained first to measure it.
+            natural = _Stack(_blocks(item, width, 'left', size, static_folder), contained=True).natural_width
+            item_width = min(natural, item_width)
+        columns.append(_Stack(_element(item, item_width, 'left', size, static_folder), contained=True))
+        columns[-1].column_width = item_width
+
+    if mode == 'equal':
+        for i, column in enumerate(columns):
+            column.left = i * width / len(columns)
+    else:
+        gap = (width - sum(column.column_width for column in columns)) / max(len(columns) - 1, 1)
+        left = 0.0
+        for column in columns:
+            column.left = left
+            left += column.column_width + gap
+    return _Row(columns, margin_bottom)
+
+def _list(node, width, size, static_folder):
+    blocks = []
+    number = 0
+    for child in node.children:
+        if isinstance(child, str):
+            continue
+        if child.tag == 'br':
+            blocks.append(_Spacer(size * LINE_HEIGHT))
+        elif child.tag == 'li':
+            number += 1
+            lines = _wrap(_inline(child), size, width - LIST_INDENT)
+            marker = f'{number}.' if node.tag == 'ol' else '•'
+            blocks.append(_ListItem(_Paragraph(lines, size, 'left', width - LIST_INDENT), marker))
+    if blocks:
+        blocks[0].margin_top = size
+        blocks[-1].margin_bottom = size
+    return blocks
+
+class _ListItem(_Block):
+
+    def __init__(self, paragraph, marker):
+        self.paragraph = paragraph
+        self.marker = marker
+        self.height = max(paragraph.height, paragraph.size * LINE_HEIGHT)
+
+    def draw(self, document, x, top):
+        size = self.paragraph.size
+        marker_width = _text_width(self.marker, False, size)
+        document.text(x + LIST_INDENT - marker_width - size / 2, top, [(self.marker, False)], size)
+        self.paragraph.draw(document, x + LIST_INDENT, top)
+
+def _table(node, width):
+    rows = []
+    for tr in _descendants(node, 'tr'):
+        rows.append([cell for cell in tr.children if isinstance(cell, _Node) and cell.tag in ('th', 'td')])
+    rows = [row for row in rows if row]
+    if not rows:
+        return []
+    columns = max(len(row) for row in rows)
+    space = _text_width(' ', False, FONT_SIZE)
+    padding = 2 * CELL_PADDING
+
+    # CSS automatic table layout, roughly: a column never gets narrower than its longest
+    # word and shares out the rest in proportion to its unwrapped content.
+    min_widths, max_widths = [padding] * columns, [padding] * columns
+    cell_runs = []
+    for row in rows:
+        row_runs = []
+        for i, cell in enumerate(row):
+            runs = _inline(cell, cell.tag == 'th')
+            words = [word for line in _words(runs) for word in line]
+            word_widths = [_word_width(word, FONT_SIZE) for word in words]
+            min_widths[i] = max(min_widths[i], max(word_widths, default=0.0) + padding)
+            max_widths[i] = max(max_widths[i], sum(word_widths) + space * max(len(words) - 1, 0) + padding)
+            row_runs.append(runs)
+        cell_runs.append(row_runs)
+
+    total_min, total_max = sum(min_widths), sum(max_widths)
+    if total_max <= width:
+        widths = [w * width / total_max for w in max_widths]
+    elif total_min >= width:
+        widths = min_widths
+    else:
+        share = (width - total_min) / (total_max - total_min)
+        widths = [low + (high - low) * share for low, high in zip(min_widths, max_widths)]
+
+    blocks, header = [], None
+    for row, row_runs in zip(rows, cell_runs):
+        is_header = all(cell.tag == 'th' for cell in row)
+        cells = [_wrap(runs, FONT_SIZE, w - padding) for runs, w in zip(row_runs, widths)]
+        block = _TableRow(cells, widths, is_header)
+        if is_header:
+            header = block
+        else:
+            block.repeat = header
+        blocks.append(block)
+    blocks[-1].margin_bottom = 20 * PX
+    return blocks
+
+def _descendants(node, tag):
+    for child in node.children:
+        if isinstance(child, _Node):
+            if child.tag == tag:
+                yield child
+            else:
+                yield from _descendants(child, tag)
+
+def _image_path(src, static_folder):
+    # Only the app's own static files: the template refers to them as /static/...
+    if not src or not static_folder or not src.startswith('/static/'):
+        return None
+    root = os.path.realpath(static_folder)
+    path = os.path.realpath(os.path.join(root, src[len('/static/'):]))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+# -- Pages -----------------------------------------------------------------------------
+
+class _Layout:
+    # Places blocks top-down on A4 pages inside the body's border and padding.
+
+    def __init__(self, document):
+        self.document = document
+        self.inset = PAGE_MARGIN + BORDER_WIDTH + BODY_PADDING
+        self.width = PAGE_WIDTH - 2 * self.inset
+        self.bottom = PAGE_HEIGHT - self.inset
+        self._new_page()
+
+    def _new_page(self):
+        self.document.new_page()
+        self.document.rect(PAGE_MARGIN, PAGE_MARGIN, PAGE_WIDTH - 2 * PAGE_MARGIN, PAGE_HEIGHT - 2 * PAGE_MARGIN)
+        self.top = self.inset
+        self.margin = 0.0
+
+    def place(self, block):
+        if block.pinned:
+            if self.top + max(self.margin, block.margin_top) + block.height > self.bottom:
+                self._new_page()
+            block.draw(self.document, self.inset + block.left, self.bottom - block.height)
+            self.top, self.margin = self.bottom, 0.0
+            return
+
+        gap = max(self.margin, block.margin_top)
+        if self.top + gap + block.height > self.bottom and self.top > self.inset:
+            self._new_page()
+            gap = 0.0
+            if block.repeat is not None:
+                self.place(block.repeat)
+        self.top += gap
+        block.draw(self.document, self.inset + block.left, self.top)
+        self.top += block.height
+        self.margin = block.margin_bottom
+
+# -- PDF -------------------------------------------------------------------------------
+
+class _Document:
+
+    def __init__(self):
+        self.pages = []
+        self.images = {}
+
+    def new_page(self):
+        self.ops = [f'{BORDER_WIDTH:.2f} w']
+        self.pages.append(self.ops)
+
+    def text(self, x, top, segments, size):
+        # `top` is the top of the line box; PDF wants the baseline, from the bottom.
+        baseline = PAGE_HEIGHT - top - size * (LINE_HEIGHT - 1) / 2 - size * 0.8
+        ops = [f'BT {x:.2f} {baseline:.2f} Td']
+        font, text = None, []
+        for piece, bold in segments + [(None, None)]:
+            if bold != font and text:
+                ops.append(f'/F{2 if font else 1} {size:.2f} Tf ({_escape("".join(text))}) Tj')
+                text = []
+            font = bold
+            if piece is not None:
+                text.append(piece)
+        ops.append('ET')
+        self.ops.append(' '.join(ops))
+
+    def rect(self, x, top, width, height, fill=None):
+        y = PAGE_HEIGHT - top - height
+        if fill:
+            self.ops.append(f'{fill[0]:.3f} {fill[1]:.3f} {fill[2]:.3f} rg {x:.2f} {y:.2f} {width:.2f} {height:.2f} re B 0 g')
+        else:
+            self.ops.append(f'{x:.2f} {y:.2f} {width:.2f} {height:.2f} re S')
+
+    def image(self, path, x, top, width, height):
+        if path not in self.images:
+            self.images[path] = f'Im{len(self.images) + 1}'
+        y = PAGE_HEIGHT - top - height
+        self.ops.append(f'q {width:.2f} 0 0 {height:.2f} {x:.2f} {y:.2f} cm /{self.images[path]} Do Q')
+
+    def output(self):
+        objects = [None, None,
+                   b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+                   b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>']
+
+        xobjects = []
+        for path, name in self.images.items():
+            image = _load_png(path, os.path.getmtime(path))
+            smask = ''
+            if image.alpha is not None:
+                objects.append(_stream(f'/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} '
+                                       f'/ColorSpace /DeviceGray /BitsPerComponent 8', image.alpha))
+                smask = f' /SMask {len(objects)} 0 R'
+            objects.append(_stream(f'/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} '
+                                   f'/ColorSpace {image.color_space} /BitsPerComponent 8{image.decode_parms}{smask}', image.data))
+            xobjects.append(f'/{name} {len(objects)} 0 R')
+
+        resources = f'/Font << /F1 3 0 R /F2 4 0 R >> /XObject << {" ".join(xobjects)} >>'
+        kids = []
+        for ops in self.pages:
+            objects.append(_stream('', zlib.compress('\n'.join(ops).encode('latin-1'), 6)))
+            objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                           f'/Resources << {resources} >> /Contents {len(objects)} 0 R >>'.encode('latin-1'))
+            kids.append(f'{len(objects)} 0 R')
+        objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+        objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'.encode('latin-1')
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(out)
+
+def _escape(text):
+    return text.encode('cp1252', 'replace').decode('latin-1').replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def _stream(dictionary, data, filtered=True):
+    head = f'<< {dictionary} /Length {len(data)}{" /Filter /FlateDecode" if filtered else ""} >>'.strip()
+    return head.encode('latin-1') + b'\nstream\n' + data + b'\nendstream'
+
+# -- PNG -------------------------------------------------------------------------------
+
+class _Png:
+    __slots__ = ('width', 'height', 'color_space', 'decode_parms', 'data', 'alpha')
+
+@lru_cache(maxsize=8)
+def _load_png(path, mtime):
+    # 8-bit, non-interlaced PNGs. Without alpha the IDAT data goes into the PDF as is
+    # (PDF understands PNG row filters); with alpha the rows are unfiltered here, once per
+    # process, to split the colour and the soft mask.
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError(f'{path} is not a PNG')
+    pos, idat = 8, []
+    while pos < len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b'IHDR':
+            width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', body)
+        elif kind == b'IDAT':
+            idat.append(body)
+        elif kind == b'IEND':
+            break
+    if depth != 8 or interlace or color not in (0, 2, 4, 6):
+        raise ValueError(f'{path}: only 8-bit non-interlaced grey/RGB(A) PNGs are supported')
+
+    image = _Png()
+    image.width, image.height = width, height
+    colors = 3 if color in (2, 6) else 1
+    image.color_space = '/DeviceRGB' if colors == 3 else '/DeviceGray'
+    if color in (0, 2):
+        image.decode_parms = f' /DecodeParms << /Predictor 15 /Colors {colors} /Columns {width} >>'
+        image.data, image.alpha = b''.join(idat), None
+        return image
+
+    channels = colors + 1
+    pixels = _unfilter(zlib.decompress(b''.join(idat)), width, height, channels)
+    color_bytes = bytearray(width * height * colors)
+    for channel in range(colors):
+        color_bytes[channel::colors] = pixels[channel::channels]
+    image.decode_parms = ''
+    image.data = zlib.compress(bytes(color_bytes), 6)
+    image.alpha = zlib.compress(bytes(pixels[colors::channels]), 6)
+    return image
+
+def _unfilter(raw, width, height, bpp):
+    stride = width * bpp
+    out = bytearray(height * stride)
+    prior = bytearray(stride)
+    pos = 0
+    for row in range(height):
+        kind = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + stride])
+        pos += stride + 1
+        if kind == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xff
+        elif kind == 2:
+            for i in range(stride):
+                line[i] = (line[i] + prior[i]) & 0xff
+        elif kind == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prior[i]) >> 1)) & 0xff
+        elif kind == 4:
+            for i in range(bpp):
+                line[i] = (line[i] + prior[i]) & 0xff
+            for i in range(bpp, stride):
+                a, b, c = line[i - bpp], prior[i], prior[i - bpp]
+                p, q = b - c, a - c
+                pa, pb, pc = abs(p), abs(q), abs(p + q)
+                if pa <= pb and pa <= pc:
+                    line[i] = (line[i] + a) & 0xff
+                elif pb <= pc:
+                    line[i] = (line[i] + b) & 0xff
+                else:
+                    line[i] = (line[i] + c) & 0xff
+        out[row * stride:(row + 1) * stride] = line
+        prior = line
+    return out
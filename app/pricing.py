@@ -0,0 +1,238 @@
+from collections import namedtuple
+from functools import lru_cache
+from decimal import Decimal, Context, ROUND_HALF_UP, ROUND_HALF_EVEN
+
+# Fixed-point pricing. Money is passed in and out as integer paise; internally every
+# amount is an integer count of 1/UNITS_PER_PAISA paise. That denominator makes 18% GST
+# and the "interchange / 1.18 * share%" calculation exact, so nothing is rounded until a
+# value is stored, exactly like the unrounded Decimal sums the invoice totals used to use.
+#
+# One catch: interchange / 1.18 is a recurring decimal, and the Decimal code carried a
+# 28-digit approximation of it. That rounds the same as the exact amount everywhere except
+# on a half paisa, where the approximation decided which way it went. Interchange share
+# lines keep their inputs, and any line or invoice with such a tie is priced again the
+# Decimal way (same operations, same context) so that stored amounts stay identical.
+
+GST_RATE_PERCENT = 18
+PERCENT_SCALE = 10 ** 4  # share percentages with up to 4 decimal places are priced in units
+UNITS_PER_PAISA = (100 + GST_RATE_PERCENT) * 10 ** 6
+HALF_PAISA = UNITS_PER_PAISA // 2
+UNITS_PER_RUPEE = UNITS_PER_PAISA * 100
+# interchange / 1.18 * share% -- with UNITS_PER_PAISA = 118 * 10**6 this reduces to an integer
+# product: interchange_paise * share (in 1/PERCENT_SCALE percent) * SHARE_UNITS.
+SHARE_UNITS = UNITS_PER_PAISA // ((100 + GST_RATE_PERCENT) * PERCENT_SCALE)
+
+# decimal's default context, which the Decimal code ran under.
+DECIMAL_CONTEXT = Context(prec=28, rounding=ROUND_HALF_EVEN)
+GST_RATE = Decimal(GST_RATE_PERCENT) / 100
+CENT = Decimal('0.01')
+
+LinePrice = namedtuple('LinePrice', ['unit_price', 'total', 'gst_amount', 'final_amount'])
+InvoicePrice = namedtuple('InvoicePrice', ['invoice_amount', 'tax_amount', 'total_amount', 'taxable_amount', 'rounding_up', 'grand_total'])
+
+def to_paise(amount):
+    return int((Decimal(amount or 0) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+def from_paise(paise):
+    return Decimal(paise).scaleb(-2)
+
+class _ShareUnits(tuple):
+    # (total, gst, final) units of an interchange share line, with what it takes to redo it in Decimal.
+    def __new__(cls, units, interchange_paise, share_percentage):
+        line = super().__new__(cls, units)
+        line.inputs = interchange_paise, share_percentage
+        return line
+
+@lru_cache(maxsize=256)
+def _percent(value):
+    # The share in 1/PERCENT_SCALE percent, or None when it has more decimal places than that.
+    scaled = Decimal(value or 0) * PERCENT_SCALE
+    if scaled != scaled.to_integral_value():
+        return None
+    return int(scaled)
+
+def _is_tie(units):
+    return units % UNITS_PER_PAISA == HALF_PAISA
+
+def _round(units):
+    # ROUND_HALF_UP (half away from zero) to whole paise, same as Decimal.quantize and a numeric(10, 2) column.
+    if units >= 0:
+        return (units + HALF_PAISA) // UNITS_PER_PAISA
+    return -((HALF_PAISA - units) // UNITS_PER_PAISA)
+
+def _round_decimal(amount):
+    # The same rounding for an amount in rupees.
+    return int(amount.quantize(CENT, rounding=ROUND_HALF_UP).scaleb(2))
+
+def fee_line_units(unit_price_paise, units):
+    total = unit_price_paise * units * UNITS_PER_PAISA
+    gst = total * GST_RATE_PERCENT // 100
+    return total, gst, total + gst
+
+def interchange_line_units(interchange_paise, minimum_paise, share_percentage):
+    if interchange_paise == 0 and minimum_paise == 0:
+        return None
+
+    if interchange_paise < minimum_paise:
+        client_share = minimum_paise * UNITS_PER_PAISA
+        gst = client_share * GST_RATE_PERCENT // 100
+        return client_share + gst, gst, client_share + gst
+
+    percent = _percent(share_percentage)
+    if percent is None:
+        # Too many decimal places for units; Decimal it is.
+        return _decimal_share_line(interchange_paise, share_percentage)
+    client_share = interchange_paise * percent * SHARE_UNITS
+    gst = client_share * GST_RATE_PERCENT // 100
+    return _ShareUnits((client_share + gst, gst, client_share + gst), interchange_paise, share_percentage)
+
+def _decimal_share_line(interchange_paise, share_percentage):
+    # The Decimal code's interchange share line, in rupees.
+    context = DECIMAL_CONTEXT
+    client_share = context.multiply(context.divide(from_paise(interchange_paise), Decimal('1.18')),
+                                    context.divide(Decimal(share_percentage or 0), 100))
+    gst = context.multiply(client_share, GST_RATE)
+    final = context.add(client_share, gst)
+    return final, gst, final
+
+def _decimal_line(line_units):
+    # Any line as the Decimal code had it. Fee and minimum interchange lines are exact in both,
+    # and their units convert to rupees exactly.
+    if isinstance(line_units, _ShareUnits):
+        return _decimal_share_line(*line_units.inputs)
+    if isinstance(line_units[2], Decimal):
+        return line_units
+    return tuple(Decimal(value * 10 ** 4 // UNITS_PER_PAISA).scaleb(-6) for value in line_units)
+
+def line_price(line_units, unit_price_paise=None):
+    if isinstance(line_units, _ShareUnits) and (_is_tie(line_units[1]) or _is_tie(line_units[2])):
+        line_units = _decimal_line(line_units)
+    total, gst, final = line_units
+    round_ = _round_decimal if isinstance(final, Decimal) else _round
+    return LinePrice(
+        unit_price=round_(final) if unit_price_paise is None else unit_price_paise,
+        total=round_(total),
+        gst_amount=round_(gst),
+        final_amount=round_(final)
+    )
+
+def invoice_price(lines_units):
+    if any(isinstance(final, Decimal) for _, _, final in lines_units):
+        return _decimal_invoice_price([_decimal_line(line_units) for line_units in lines_units])
+
+    invoice_amount = tax_amount = total_amount = 0
+    for total, gst, final in lines_units:
+        invoice_amount += total
+        tax_amount += gst
+        total_amount += final
+
+    if (_is_tie(invoice_amount) or _is_tie(tax_amount) or _is_tie(total_amount) or _is_tie(total_amount - tax_amount)) \
+            and any(isinstance(line_units, _ShareUnits) for line_units in lines_units):
+        return _decimal_invoice_price([_decimal_line(line_units) for line_units in lines_units])
+    return _units_invoice_price(invoice_amount, tax_amount, total_amount)
+
+def _units_invoice_price(invoice_amount, tax_amount, total_amount):
+    grand_total = _round(total_amount)
+    return InvoicePrice(
+        invoice_amount=_round(invoice_amount),
+        tax_amount=_round(tax_amount),
+        total_amount=_round(total_amount),
+        taxable_amount=_round(total_amount - tax_amount),
+        rounding_up=_round(grand_total * UNITS_PER_PAISA - total_amount),
+        grand_total=grand_total
+    )
+
+def _decimal_invoice_price(decimal_lines):
+    # The Decimal code's sums, line by line in order; each addition rounds to 28 digits.
+    context = DECIMAL_CONTEXT
+    invoice_amount = tax_amount = total_amount = Decimal(0)
+    for total, gst, final in decimal_lines:
+        invoice_amount = context.add(invoice_amount, total)
+        tax_amount = context.add(tax_amount, gst)
+        total_amount = context.add(total_amount, final)
+
+    grand_total = total_amount.quantize(CENT, rounding=ROUND_HALF_UP)
+    return InvoicePrice(
+        invoice_amount=_round_decimal(invoice_amount),
+        tax_amount=_round_decimal(tax_amount),
+        total_amount=_round_decimal(total_amount),
+        taxable_amount=_round_decimal(context.subtract(total_amount, tax_amount)),
+        rounding_up=_round_decimal(context.subtract(grand_total, total_amount)),
+        grand_total=_round_decimal(grand_total)
+    )
+
+def _decimal_spec(line):
+    # A price_invoices line spec as the Decimal code had it (None for an empty interchange line).
+    if line[0] == 'fee':
+        amount = line[1] * line[2]
+        total = Decimal(amount).scaleb(-2)
+        gst = Decimal(amount * GST_RATE_PERCENT).scaleb(-4)
+        return total, gst, total + gst
+    if line[1] == 0 and line[2] == 0:
+        return None
+    if line[1] >= line[2]:
+        return _decimal_share_line(line[1], line[3])
+    gst = Decimal(line[2] * GST_RATE_PERCENT).scaleb(-4)
+    final = Decimal(line[2]).scaleb(-2) + gst
+    return final, gst, final
+
+def price_invoices(invoices):
+    # Batch entry point. Each invoice is a list of line specs:
+    #   ('fee', unit_price_paise, units)
+    #   ('interchange', interchange_paise, minimum_paise, share_percentage)
+    # Returns [(line_prices, invoice_price)] with every amount in paise. Line prices are plain
+    # tuples in LinePrice field order (building namedtuples costs more than the arithmetic);
+    # interchange lines that price to nothing (both amounts zero) come back as None.
+    #
+    # Same arithmetic as the per-line functions above, unrolled: fee lines are whole paise
+    # until GST, so they are summed in paise and only scaled to units once per invoice.
+    results = []
+    for lines in invoices:
+        line_prices = []
+        fee_total = 0
+        total = gst = final = 0
+        shares = inexact = False
+        for line in lines:
+            if line[0] == 'fee':
+                amount = line[1] * line[2]
+                line_gst = (amount * GST_RATE_PERCENT + 50) // 100
+                line_prices.append((line[1], amount, line_gst, amount + line_gst))
+                fee_total += amount
+                continue
+
+            if line[1] == 0 and line[2] == 0:
+                line_prices.append(None)
+                continue
+            if line[1] < line[2]:
+                client_share = line[2] * UNITS_PER_PAISA
+            else:
+                percent = _percent(line[3])
+                if percent is None:
+                    line_prices.append(tuple(line_price(_decimal_share_line(line[1], line[3]))))
+                    inexact = True
+                    continue
+                client_share = line[1] * percent * SHARE_UNITS
+                shares = True
+            line_gst = client_share * GST_RATE_PERCENT // 100
+            line_final = client_share + line_gst
+            total += line_final
+            gst += line_gst
+            final += line_final
+            if line[1] >= line[2] and (_is_tie(line_gst) or _is_tie(line_final)):
+                decimal_final, decimal_gst, _ = _decimal_share_line(line[1], line[3])
+                rounded, rounded_gst = _round_decimal(decimal_final), _round_decimal(decimal_gst)
+            else:
+                rounded, rounded_gst = _round(line_final), _round(line_gst)
+            line_prices.append((rounded, rounded, rounded_gst, rounded))
+
+        fee_units = fee_total * UNITS_PER_PAISA
+        fee_gst = fee_units * GST_RATE_PERCENT // 100
+        total += fee_units
+        gst += fee_gst
+        final += fee_units + fee_gst
+        if inexact or (shares and (_is_tie(total) or _is_tie(gst) or _is_tie(final) or _is_tie(final - gst))):
+            decimal_lines = [_decimal_spec(line) for line in lines]
+            results.append((line_prices, _decimal_invoice_price([line for line in decimal_lines if line is not None])))
+        else:
+            results.append((line_prices, _units_invoice_price(total, gst, final)))
+    return results
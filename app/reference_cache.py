@@ -0,0 +1,85 @@
+import threading
+from collections import namedtuple
+from flask import g, has_app_context
+from models import db, IdCounter, Biller, Client, Issuer, Product, FeeMaster
+from ids import allocate
+
+# Master tables change rarely but are read on nearly every admin request. Each worker keeps
+# its own copy tagged with a version number stored in id_counters ('cache:<name>'); writers
+# bump the version in the same transaction as the change, and the next request in every
+# worker sees the new number and reloads.
+
+BillerSnapshot = namedtuple('BillerSnapshot', ['biller_id', 'biller_name', 'biller_address', 'biller_gstin', 'biller_email', 'biller_contact'])
+
+REFERENCE_LOADERS = {
+    'issuers': lambda: [(i.issuer_id, i.issuer_name) for i in Issuer.query.all()],
+    'clients': lambda: [(c.client_id, c.client_name) for c in Client.query.all()],
+    'products': lambda: [(p.product_id, p.product_name) for p in Product.query.all()],
+    'fee_master': lambda: [(f.fee_id, f.fee_name) for f in FeeMaster.query.all()],
+    'biller': lambda: _biller_snapshot(Biller.query.first()),
+}
+
+# Versioned like the tables above, but cached elsewhere (mapping_index).
+VERSIONED_ELSEWHERE = ['mappings']
+
+_entries = {}
+_lock = threading.Lock()
+
+def _biller_snapshot(biller):
+    if biller is None:
+        return None
+    return BillerSnapshot(*(getattr(biller, field) for field in BillerSnapshot._fields))
+
+def _counter_name(name):
+    return f'cache:{name}'
+
+def _versions():
+    # One query per request covers every table.
+    versions = g.get('_reference_versions') if has_app_context() else None
+    if versions is None:
+        names = list(REFERENCE_LOADERS) + VERSIONED_ELSEWHERE
+        rows = db.session.query(IdCounter.name, IdCounter.value).filter(
+            IdCounter.name.in_([_counter_name(name) for name in names])
+        ).all()
+        stored = dict(rows)
+        versions = {name: stored.get(_counter_name(name), 0) for name in names}
+        if has_app_context():
+            g._reference_versions = versions
+    return versions
+
+def get_reference(name):
+    version = _versions()[name]
+    entry = _entries.get(name)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    value = REFERENCE_LOADERS[name]()
+    with _lock:
+        current = _entries.get(name)
+        if current is None or current[0] <= version:
+            _entries[name] = (version, value)
+    return value
+
+def reference_version(name):
+    return _versions()[name]
+
+def bump_reference(*names):
+    for name in names:
+        allocate(_counter_name(name))
+    if has_app_context():
+        g.pop('_reference_versions', None)
+
+def issuer_choices():
+    return list(get_reference('issuers'))
+
+def client_choices():
+    return list(get_reference('clients'))
+
+def product_choices():
+    return list(get_reference('products'))
+
+def fee_choices():
+    return list(get_reference('fee_master'))
+
+def current_biller():
+    return get_reference('biller')
@@ -0,0 +1,62 @@
+import time
+from functools import wraps
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.exc import OperationalError
+from metrics import REPLICA_FALLBACKS
+
+# Read-only views opt into the 'replica' bind (SQLALCHEMY_BINDS) with @read_replica.
+# While the flag is set, every statement from a session with no pending writes goes to
+# the replica. If the replica can't be reached, the view runs again on the primary and the
+# replica is skipped for REPLICA_RETRY_SECONDS.
+
+REPLICA_BIND = 'replica'
+
+_replica_down_until = 0.0
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context() and g.get('_read_replica') and not (self.new or self.dirty or self.deleted):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+def replica_configured():
+    return REPLICA_BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+def replica_available():
+    return replica_configured() and time.monotonic() >= _replica_down_until
+
+def mark_replica_down():
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + current_app.config.get('REPLICA_RETRY_SECONDS', 30)
+    REPLICA_FALLBACKS.inc()
+    current_app.logger.warning('Read replica unavailable; using the primary for %ss', current_app.config.get('REPLICA_RETRY_SECONDS', 30))
+
+def use_replica(enabled=True):
+    # For code outside a view (CLI exports). Stays on for the rest of the app context.
+    g._read_replica = enabled and replica_available()
+    return g._read_replica
+
+def read_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not use_replica():
+            return view(*args, **kwargs)
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            # Connection refused, replica restarting, or a query cancelled by replay
+            # conflicts: the read is safe to repeat on the primary.
+            state = get_state(current_app)
+            state.db.session.rollback()
+            mark_replica_down()
+            g._read_replica = False
+            return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,174 @@
+from sqlalchemy import and_, text
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Invoice, InvoiceLineItem, EditedInvoice, RevenueMonthly, RevenueByFee
+
+# Revenue reporting reads revenue_monthly and revenue_by_fee, never invoices. Each place
+# that saves an invoice adds its amounts to those rows before its commit (record_invoice),
+# and an edit moves the replaced invoice's amounts out (record_edit), so the totals cover
+# exactly the invoices in force: those not replaced by an edit. `flask revenue rebuild`
+# recomputes both tables from scratch, adding the totals saved with archived years (archive.py).
+
+MONTHLY_KEYS = ('issuer_id', 'client_id', 'month')
+MONTHLY_SUMS = ('invoices', 'taxable_amount', 'tax_amount', 'grand_total')
+FEE_KEYS = ('issuer_id', 'client_id', 'fee_id', 'month')
+FEE_SUMS = ('line_items', 'units', 'total', 'gst_amount', 'final_amount')
+BATCH_SIZE = 1000
+
+GROUPINGS = ('issuer', 'client', 'fee', 'month')
+
+def month_of(invoice_month, invoice_date):
+    return (invoice_month or invoice_date).replace(day=1)
+
+def _add(totals, key, amounts):
+    current = totals.get(key)
+    if current is None:
+        totals[key] = list(amounts)
+    else:
+        for i, amount in enumerate(amounts):
+            current[i] += amount
+
+def _contributions(invoice, sign, monthly, by_fee):
+    issuer_id, client_id = invoice.issuer_id or '', invoice.client_id or ''
+    month = month_of(invoice.invoice_month, invoice.invoice_date)
+    _add(monthly, (issuer_id, client_id, month),
+         (sign, sign * (invoice.taxable_amount or 0), sign * (invoice.tax_amount or 0), sign * (invoice.grand_total or 0)))
+    for line in invoice.line_items:
+        _add(by_fee, (issuer_id, client_id, line.fee_id or '', month),
+             (sign, sign * (line.units or 0), sign * (line.total or 0), sign * (line.gst_amount or 0), sign * (line.final_amount or 0)))
+
+def record_invoice(invoice):
+    monthly, by_fee = {}, {}
+    _contributions(invoice, 1, monthly, by_fee)
+    _increment(RevenueMonthly, MONTHLY_KEYS, MONTHLY_SUMS, monthly)
+    _increment(RevenueByFee, FEE_KEYS, FEE_SUMS, by_fee)
+
+def _in_force(invoice):
+    # Not replaced by an edit, and, if it is itself an edit, the latest edit of its original.
+    if db.session.query(EditedInvoice.id).filter(EditedInvoice.original_invoice_id == invoice.invoice_id).first():
+        return False
+    edit = db.session.query(EditedInvoice).filter(EditedInvoice.edited_invoice_id == invoice.invoice_id).first()
+    return edit is None or not db.session.query(EditedInvoice.id).filter(
+        EditedInvoice.original_invoice_id == edit.original_invoice_id, EditedInvoice.id > edit.id).first()
+
+def record_edit(original, edited):
+    # Call before adding the EditedInvoice row. The edit takes the place of the original,
+    # or of the original's latest edit if it was edited before.
+    monthly, by_fee = {}, {}
+    _contributions(edited, 1, monthly, by_fee)
+    previous = db.session.query(EditedInvoice).filter(
+        EditedInvoice.original_invoice_id == original.invoice_id, EditedInvoice.edited_invoice_id != edited.invoice_id
+    ).order_by(EditedInvoice.id.desc()).first()
+    replaced = previous.edited_invoice if previous else original
+    if _in_force(replaced):
+        _contributions(replaced, -1, monthly, by_fee)
+    _increment(RevenueMonthly, MONTHLY_KEYS, MONTHLY_SUMS, monthly)
+    _increment(RevenueByFee, FEE_KEYS, FEE_SUMS, by_fee)
+
+def _increment(model, keys, sums, totals):
+    if not totals:
+        return
+    table = model.__table__
+    # Sorted, so concurrent writers take row locks in the same order.
+    values = [dict(zip(keys + sums, key + tuple(amounts))) for key, amounts in sorted(totals.items())]
+    dialect = db.session.connection().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c[column] for column in keys],
+            set_={column: table.c[column] + statement.excluded[column] for column in sums}
+        )
+        db.session.execute(statement, values)
+    else:
+        for value in values:
+            match = and_(*(table.c[column] == value[column] for column in keys))
+            updated = db.session.execute(table.update().where(match).values({column: table.c[column] + value[column] for column in sums}))
+            if updated.rowcount == 0:
+                db.session.execute(table.insert(), value)
+
+    # Rows whose last invoice (or line) was moved out by an edit go, as a rebuild wouldn't have them.
+    count = table.c[sums[0]]
+    for value in values:
+        if value[sums[0]] < 0:
+            db.session.execute(table.delete().where(and_(count == 0, *(table.c[column] == value[column] for column in keys))))
+
+def revenue_totals(*criteria, progress=None):
+    # ({monthly key: sums}, {per-fee key: sums}) over the invoices in force matching `criteria`.
+    later_edit = db.aliased(EditedInvoice)
+    superseded_edits = db.session.query(EditedInvoice.edited_invoice_id).filter(
+        db.session.query(later_edit.id).filter(later_edit.original_invoice_id == EditedInvoice.original_invoice_id,
+                                               later_edit.id > EditedInvoice.id).exists())
+    in_force = and_(~Invoice.invoice_id.in_(db.session.query(EditedInvoice.original_invoice_id)),
+                    ~Invoice.invoice_id.in_(superseded_edits), *criteria)
+    monthly = {}
+    invoices = db.session.query(Invoice.issuer_id, Invoice.client_id, Invoice.invoice_month, Invoice.invoice_date,
+                                Invoice.taxable_amount, Invoice.tax_amount, Invoice.grand_total).filter(in_force)
+    for issuer_id, client_id, invoice_month, invoice_date, taxable, tax, grand_total in invoices.yield_per(10000):
+        _add(monthly, (issuer_id or '', client_id or '', month_of(invoice_month, invoice_date)), (1, taxable or 0, tax or 0, grand_total or 0))
+    if progress:
+        progress(f'{len(monthly)} issuer/client/month totals.')
+
+    by_fee = {}
+    lines = db.session.query(Invoice.issuer_id, Invoice.client_id, Invoice.invoice_month, Invoice.invoice_date, InvoiceLineItem.fee_id,
+                             InvoiceLineItem.units, InvoiceLineItem.total, InvoiceLineItem.gst_amount, InvoiceLineItem.final_amount
+                             ).join(InvoiceLineItem, and_(InvoiceLineItem.invoice_id == Invoice.invoice_id, InvoiceLineItem.invoice_date == Invoice.invoice_date)).filter(in_force)
+    for issuer_id, client_id, invoice_month, invoice_date, fee_id, units, total, gst, final in lines.yield_per(10000):
+        _add(by_fee, (issuer_id or '', client_id or '', fee_id or '', month_of(invoice_month, invoice_date)),
+             (1, units or 0, total or 0, gst or 0, final or 0))
+    if progress:
+        progress(f'{len(by_fee)} issuer/client/fee/month totals.')
+    return monthly, by_fee
+
+def rebuild_revenue(progress=None, archived=()):
+    # `archived`: (monthly, by_fee) totals of invoices no longer in the table (archive.archived_revenue).
+    if db.session.connection().dialect.name == 'postgresql':
+        # Invoices committed while this runs wait to add their amounts until it's done,
+        # rather than adding them to rows about to be replaced.
+        db.session.execute(text('LOCK TABLE revenue_monthly, revenue_by_fee IN EXCLUSIVE MODE'))
+    db.session.query(RevenueByFee).delete(synchronize_session=False)
+    db.session.query(RevenueMonthly).delete(synchronize_session=False)
+
+    monthly, by_fee = revenue_totals(progress=progress)
+    for archived_monthly, archived_by_fee in archived:
+        for totals, extra in ((monthly, archived_monthly), (by_fee, archived_by_fee)):
+            for key, amounts in extra.items():
+                _add(totals, key, amounts)
+
+    for model, keys, sums, totals in ((RevenueMonthly, MONTHLY_KEYS, MONTHLY_SUMS, monthly), (RevenueByFee, FEE_KEYS, FEE_SUMS, by_fee)):
+        values = [dict(zip(keys + sums, key + tuple(amounts))) for key, amounts in totals.items()]
+        for i in range(0, len(values), BATCH_SIZE):
+            db.session.execute(model.__table__.insert(), values[i:i + BATCH_SIZE])
+    db.session.commit()
+    return {'revenue_monthly': len(monthly), 'revenue_by_fee': len(by_fee)}
+
+def revenue_summary(group_by, month_from=None, month_to=None, issuer_id=None, client_id=None, fee_id=None, order_by=None, limit=None):
+    # Totals grouped by any of GROUPINGS. Grouping or filtering by fee reads
+    # revenue_by_fee (line item amounts), anything else revenue_monthly (invoice amounts).
+    by_fee = 'fee' in group_by or fee_id is not None
+    model, sums = (RevenueByFee, FEE_SUMS) if by_fee else (RevenueMonthly, MONTHLY_SUMS)
+    columns = {'issuer': model.issuer_id, 'client': model.client_id, 'month': model.month}
+    if by_fee:
+        columns['fee'] = model.fee_id
+    groups = [columns[name] for name in group_by]
+    totals = [db.func.sum(getattr(model, column)).label(column) for column in sums]
+
+    query = db.session.query(*groups, *totals)
+    if month_from:
+        query = query.filter(model.month >= month_from)
+    if month_to:
+        query = query.filter(model.month <= month_to)
+    if issuer_id is not None:
+        query = query.filter(model.issuer_id == issuer_id)
+    if client_id is not None:
+        query = query.filter(model.client_id == client_id)
+    if fee_id is not None:
+        query = query.filter(model.fee_id == fee_id)
+    if groups:
+        query = query.group_by(*groups)
+    if order_by in sums:
+        query = query.order_by(db.func.sum(getattr(model, order_by)).desc())
+    elif groups:
+        query = query.order_by(*groups)
+    if limit:
+        query = query.limit(limit)
+
+    return [dict(zip(list(group_by) + list(sums), row)) for row in query]
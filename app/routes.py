@@ -1,14 +1,27 @@
-from functions import calculate_interchange_line_item, generate_invoice_line_items, get_applicable_fees
-from num2words import num2words
+from functions import parse_date, get_applicable_fees, generate_invoice_id, generate_invoice_number
 from werkzeug.security import generate_password_hash
 from werkzeug.security import check_password_hash
-from flask import Blueprint, render_template, redirect, url_for, flash, request, make_response
+from flask import Blueprint, render_template, redirect, url_for, flash, request, make_response, Response, stream_with_context, session
 from flask_login import login_user, logout_user, login_required, current_user
-from models import db, User, Biller, Client, Issuer, FeeMaster, ClientProductFeeMapping, Invoice, Product, FeeHistory, InvoiceLineItem, InterchangeFee
-from forms import LoginForm, RegistrationForm, GenerateClientInvoiceForm, AddClientForm, AddIssuerForm, AddFeeForm, AddProductForm, EditIssuerForm, EditFeeForm, EditProductForm, DynamicFeeForm, InterchangeFeeForm, ClientProductFeeMappingForm, EditInvoiceForm
+from models import db, User, Biller, Client, Issuer, FeeMaster, ClientProductFeeMapping, Invoice, Product, FeeHistory, InvoiceLineItem, InterchangeFee, EditedInvoice, Job, FeeUnitUpload, ArchivedInvoice
+from forms import LoginForm, RegistrationForm, GenerateClientInvoiceForm, AddClientForm, AddIssuerForm, AddFeeForm, AddProductForm, EditIssuerForm, EditFeeForm, EditProductForm, DynamicFeeForm, InterchangeFeeForm, ClientProductFeeMappingForm, EditInvoiceForm, UploadUnitsForm, BulkImportForm
 from datetime import datetime, timedelta
-from flask import render_template_string
-from html_to_pdf import generate_pdf_from_html
+from html_to_pdf import RendererBusy, RenderTimeout
+from invoice_pdfs import send_invoice_pdf
+from ids import next_id
+from reference_cache import bump_reference, issuer_choices, client_choices, fee_choices
+from invoice_queries import invoice_filters_from_args, filter_invoices, keyset_page
+from export import EXPORT_FORMATS, export_rows, export_lines
+from bulk_pdf import bulk_invoice_query, stream_invoice_zip
+from replica import read_replica
+from jobs import enqueue, dispatch, job_status
+from fee_units import import_units, parse_period, staged_units
+from bulk_import import import_file
+from revenue import GROUPINGS, record_edit, revenue_summary
+from archive import archived_invoice
+from user_cache import SESSION_KEY, stamp_session
+from search import search
+import io
 from flask import current_app
 import os
 from decimal import Decimal
@@ -28,6 +41,7 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         if user and check_password_hash(user.password, form.password.data):
             login_user(user)
+            stamp_session(user)
             if user.role == 'admin':
                 return redirect(url_for('main.admin_home'))
             else:
@@ -54,6 +68,7 @@ def register():
 @login_required
 def logout():
     logout_user()
+    session.pop(SESSION_KEY, None)
     flash('You have been logged out.', 'success')
     return redirect(url_for('main.home'))
 
@@ -65,16 +80,89 @@ def admin_home():
         return redirect(url_for('main.home'))
     return render_template('admin_home.html')
 
+def _revenue_filters(args, default_months=None):
+    month_to = parse_period(args['to']) if args.get('to') else None
+    month_from = parse_period(args['from']) if args.get('from') else None
+    if default_months and month_to is None:
+        month_to = datetime.now().date().replace(day=1)
+    if default_months and month_from is None:
+        months = month_to.year * 12 + month_to.month - default_months
+        month_from = month_to.replace(year=months // 12, month=months % 12 + 1)
+    return {'month_from': month_from, 'month_to': month_to, 'issuer_id': args.get('issuer_id') or None}
+
+@blueprint.route('/revenue')
+@login_required
+@read_replica
+def revenue_dashboard():
+    if current_user.role != 'admin':
+        flash('Access denied. You must be an admin to access this page.', 'danger')
+        return redirect(url_for('main.home'))
+
+    try:
+        filters = _revenue_filters(request.args, default_months=12)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('main.revenue_dashboard'))
+
+    # Only the revenue_* summary tables are read here, however long the invoice history.
+    return render_template(
+        'revenue_dashboard.html',
+        totals=revenue_summary([], **filters)[0],
+        by_month=revenue_summary(['month'], **filters),
+        by_issuer=revenue_summary(['issuer'], order_by='grand_total', **filters),
+        top_clients=revenue_summary(['client'], order_by='grand_total', limit=10, **filters),
+        top_fees=revenue_summary(['fee'], order_by='total', limit=10, **filters),
+        issuer_names=dict(issuer_choices()),
+        client_names=dict(client_choices()),
+        fee_names=dict(fee_choices()),
+        issuers=issuer_choices(),
+        filters=filters
+    )
+
+@blueprint.route('/api/revenue')
+@login_required
+@read_replica
+def revenue_api():
+    if current_user.role != 'admin':
+        return {'error': 'Admins only.'}, 403
+
+    group_by = [name for name in request.args.get('group_by', 'month').split(',') if name]
+    unknown = [name for name in group_by if name not in GROUPINGS]
+    if unknown:
+        return {'error': f"Unknown grouping {', '.join(unknown)}; use {', '.join(GROUPINGS)}."}, 400
+    try:
+        filters = _revenue_filters(request.args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    rows = revenue_summary(group_by, client_id=request.args.get('client_id') or None, fee_id=request.args.get('fee_id') or None,
+                           order_by=request.args.get('order_by'), limit=request.args.get('limit', type=int), **filters)
+    for row in rows:
+        for name, value in row.items():
+            if name == 'month':
+                row[name] = value.strftime('%Y-%m')
+            elif isinstance(value, Decimal):
+                row[name] = str(value)
+    return {
+        'group_by': group_by,
+        'from': filters['month_from'].strftime('%Y-%m') if filters['month_from'] else None,
+        'to': filters['month_to'].strftime('%Y-%m') if filters['month_to'] else None,
+        'rows': rows,
+    }
+
 @blueprint.route('/user')
 @login_required
+@read_replica
 def user_home():
     if current_user.role != 'user':
         flash('Access denied. You must be a user to access this page.', 'danger')
         return redirect(url_for('main.home'))
     
-    invoices = Invoice.query.all()
-    
-    return render_template('user_home.html', invoices=invoices)
+    filters = invoice_filters_from_args(request.args)
+    page = keyset_page(filter_invoices(Invoice.query, filters), after=request.args.get('after'),
+                       before=request.args.get('before'), per_page=request.args.get('per_page', type=int))
+
+    return render_template('user_home.html', invoices=page['invoices'], page=page, filters=request.args)
 
 @blueprint.route('/generate-client-invoices', methods=['GET', 'POST'])
 @login_required
@@ -113,7 +201,86 @@ def enter_units():
 
         return generate_invoices(client_id, start_date, end_date, form_data, applicable_fees, interchange_share_percentage)
 
-    return render_template('enter_units.html', applicable_fees=applicable_fees)
+    units = staged_units([client_id], parse_date(start_date).replace(day=1)).get(client_id, {})
+    return render_template('enter_units.html', applicable_fees=[fee for fee, _ in applicable_fees], staged_units=units)
+
+@blueprint.route('/upload-units', methods=['GET', 'POST'])
+@login_required
+def upload_units():
+    if current_user.role != 'admin':
+        flash('Access denied. You must be an admin to access this page.', 'danger')
+        return redirect(url_for('main.home'))
+
+    form = UploadUnitsForm()
+    if form.validate_on_submit():
+        upload_file = form.units_file.data
+        period = parse_period(form.period.data) if form.period.data else None
+        try:
+            upload = import_units(io.TextIOWrapper(upload_file.stream, encoding='utf-8-sig', newline=''), upload_file.filename,
+                                  period=period, uploaded_by=current_user.user_id, strict=form.strict.data)
+        except (ValueError, UnicodeDecodeError) as e:
+            db.session.rollback()
+            flash(f'Could not read {upload_file.filename}: {e}', 'danger')
+            return redirect(url_for('main.upload_units'))
+
+        current_app.logger.info(f"Units upload {upload.upload_id}: {upload.rows_staged} staged, {upload.rows_rejected} rejected")
+        if upload.status == 'staged':
+            flash(f'{upload.rows_staged} rows staged.', 'success')
+        elif upload.status == 'partial':
+            flash(f'{upload.rows_staged} rows staged, {upload.rows_rejected} rejected. Download the error report below.', 'warning')
+        else:
+            flash(f'Nothing staged: {upload.rows_rejected} of {upload.rows_total} rows rejected. Download the error report below.', 'danger')
+        return redirect(url_for('main.upload_units'))
+
+    uploads = FeeUnitUpload.query.order_by(FeeUnitUpload.upload_id.desc()).limit(20).all()
+    return render_template('upload_units.html', form=form, uploads=uploads)
+
+@blueprint.route('/upload-units/<int:upload_id>/errors.csv')
+@login_required
+def units_upload_errors(upload_id):
+    if current_user.role != 'admin':
+        flash('Access denied. You must be an admin to access this page.', 'danger')
+        return redirect(url_for('main.home'))
+
+    upload = db.session.get(FeeUnitUpload, upload_id)
+    if upload is None or not upload.error_report:
+        flash('No error report for this upload.', 'warning')
+        return redirect(url_for('main.upload_units'))
+
+    response = Response(upload.error_report, mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=units_upload_{upload_id}_errors.csv'
+    return response
+
+@blueprint.route('/bulk-import', methods=['GET', 'POST'])
+@login_required
+def bulk_import():
+    if current_user.role != 'admin':
+        flash('Access denied. You must be an admin to access this page.', 'danger')
+        return redirect(url_for('main.home'))
+
+    form = BulkImportForm()
+    result = None
+    if form.validate_on_submit():
+        import_file_data = form.import_file.data
+        try:
+            result = import_file(form.kind.data, io.TextIOWrapper(import_file_data.stream, encoding='utf-8-sig', newline=''),
+                                 import_file_data.filename, dry_run=form.dry_run.data)
+        except (ValueError, UnicodeDecodeError) as e:
+            db.session.rollback()
+            flash(f'Could not read {import_file_data.filename}: {e}', 'danger')
+            return redirect(url_for('main.bulk_import'))
+
+        current_app.logger.info(f"Bulk import of {result['kind']} from {import_file_data.filename}: {result['inserted']} inserted, "
+                                f"{len(result['rejected'])} rejected, {result['rows_per_second']:.0f} rows/s")
+        if result['dry_run']:
+            flash(f"Dry run: {result['valid']} of {result['rows']} rows are valid. Nothing was inserted.",
+                  'warning' if result['rejected'] else 'success')
+        elif result['rejected']:
+            flash(f"{result['inserted']} {result['kind']} inserted, {len(result['rejected'])} rows rejected.", 'warning')
+        else:
+            flash(f"{result['inserted']} {result['kind']} inserted.", 'success')
+
+    return render_template('bulk_import.html', form=form, result=result)
 
 @blueprint.route('/enter-interchange-fee', methods=['GET', 'POST'])
 @login_required
@@ -164,70 +331,46 @@ def generate_invoices(client_id, start_date, end_date, form_data, applicable_fee
         flash('Access denied. You must be an admin to access this page.', 'danger')
         return redirect(url_for('main.home'))
 
-    client = Client.query.get(client_id)
-    interchange_line_item = calculate_interchange_line_item(client_id, start_date, end_date, interchange_percentage)
-
-    line_items = generate_invoice_line_items(client_id, start_date, end_date, applicable_fees, form_data, interchange_line_item)
-
-    current_app.logger.info(f"Generating invoice for client: {client_id}")
-    biller = Biller.query.first()
-
-    invoice = Invoice(
-        invoice_id=generate_invoice_id(),
-        biller_id=biller.biller_id,
-        client_id=client.client_id,
-        issuer_id=client.issuer_id,
-        invoice_number=generate_invoice_number(),
-        invoice_date=datetime.now().date(),
-        invoice_amount=0,
-        tax_rate=18,
-        tax_amount=0,
-        total_amount=0,
-        invoice_type='client',
-        invoice_month=start_date,
-        charge_date=datetime.now().date()
-    )
-
-    invoice.line_items = line_items
-
-    total_tax_amount = Decimal(0)
-    total_amount = Decimal(0)
-
-    for line_item in line_items:
-        total_tax_amount += line_item.gst_amount
-        total_amount += line_item.final_amount
-
-    invoice.invoice_amount = sum(item.total for item in line_items)
-    invoice.tax_amount = total_tax_amount
-    invoice.total_amount = total_amount
-
-    taxable_amount = invoice.total_amount - invoice.tax_amount
-    grand_total = invoice.total_amount
-
-    rounded_grand_total = Decimal(grand_total).quantize(Decimal('0.10'), rounding='ROUND_HALF_UP')
-    round_off = rounded_grand_total - grand_total
-
-    invoice.taxable_amount = taxable_amount
-    invoice.rounding_up = round_off
-    invoice.grand_total = rounded_grand_total
-    invoice.invoice_amount_in_words = num2words(rounded_grand_total, lang='en_IN', to='currency', currency='INR')
-
-    db.session.add(invoice)
+    # The invoice is built and its PDF rendered by `flask worker`; the job page polls for it.
+    job = enqueue('generate_invoice', {
+        'client_id': client_id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'form_data': form_data,
+        'interchange_percentage': interchange_percentage,
+    }, created_by=current_user.user_id)
     db.session.commit()
-    current_app.logger.info(f"Invoice generated: {invoice.invoice_number}")
+    current_app.logger.info(f"Invoice generation for client {client_id} queued as job {job.job_id}")
+    dispatch(job)
 
     if not applicable_fees:
         flash('No applicable fees found for the selected client.', 'warning')
-        return redirect(url_for('main.generate_client_invoices'))
+    return redirect(url_for('main.job_detail', job_id=job.job_id))
 
-    html = render_template('invoice_template.html', invoice=invoice, client=client, line_items=invoice.line_items)
+def _visible_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.parent_job_id is not None:
+        return None
+    if current_user.role != 'admin' and job.created_by != current_user.user_id:
+        return None
+    return job
 
-    pdf_data = generate_pdf_from_html(html)
+@blueprint.route('/jobs/<int:job_id>')
+@login_required
+def job_detail(job_id):
+    job = _visible_job(job_id)
+    if job is None:
+        flash('Job not found.', 'danger')
+        return redirect(url_for('main.home'))
+    return render_template('job_status.html', job=job_status(job))
 
-    response = make_response(pdf_data)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=invoice_{invoice.invoice_number}.pdf'
-    return response
+@blueprint.route('/jobs/<int:job_id>/status')
+@login_required
+def job_detail_status(job_id):
+    job = _visible_job(job_id)
+    if job is None:
+        return {'error': 'Job not found.'}, 404
+    return job_status(job)
 
 @blueprint.route('/edit-invoice/<string:invoice_id>', methods=['GET', 'POST'])
 @login_required
@@ -263,6 +406,7 @@ def edit_invoice(invoice_id):
             invoice_amount_in_words=form.invoice_amount_in_words.data
         )
         db.session.add(edited_invoice)
+        record_edit(invoice, edited_invoice)
 
         edited_invoice_relation = EditedInvoice(
             original_invoice_id=invoice_id,
@@ -270,8 +414,10 @@ def edit_invoice(invoice_id):
             edited_by=current_user.user_id
         )
         db.session.add(edited_invoice_relation)
+        render = enqueue('render_invoice_pdf', {'invoice_id': edited_invoice.invoice_id}, created_by=current_user.user_id)
 
         db.session.commit()
+        dispatch(render)
         flash('Invoice edited successfully.', 'success')
         return redirect(url_for('main.invoice_history'))
 
@@ -281,17 +427,74 @@ def edit_invoice(invoice_id):
 
 @blueprint.route('/invoice-history')
 @login_required
+@read_replica
 def invoice_history():
-    if current_user.role == 'admin':
-        invoices = Invoice.query.all()
-    else:
+    filters = invoice_filters_from_args(request.args)
+    query, archived = Invoice.query, ArchivedInvoice.query
+    if current_user.role != 'admin':
         client = Client.query.filter_by(client_email=current_user.username).first()
         if client:
-            invoices = Invoice.query.filter_by(client_id=client.client_id).all()
+            filters['client_id'] = client.client_id
         else:
-            invoices = []
+            query, archived = query.filter(db.false()), archived.filter(db.false())
+
+    page = keyset_page(filter_invoices(query, filters), after=request.args.get('after'),
+                       before=request.args.get('before'), per_page=request.args.get('per_page', type=int),
+                       archived=filter_invoices(archived, filters, ArchivedInvoice))
+
+    issuers = issuer_choices() if current_user.role == 'admin' else []
+    return render_template('invoice_history.html', invoices=page['invoices'], page=page, filters=request.args, issuers=issuers)
+
+@blueprint.route('/api/search')
+@login_required
+@read_replica
+def search_api():
+    query = request.args.get('q', '')
+    client_id = None
+    if current_user.role != 'admin':
+        client = Client.query.filter_by(client_email=current_user.username).first()
+        if not client:
+            return {'query': query, 'results': []}
+        client_id = client.client_id
+
+    try:
+        results = search(query, limit=request.args.get('limit', type=int), client_id=client_id)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    for result in results:
+        if result['type'] == 'invoice':
+            result['invoice_date'] = result['invoice_date'].isoformat()
+            result['grand_total'] = str(result['grand_total']) if result['grand_total'] is not None else None
+            result['url'] = url_for('main.view_invoice', invoice_id=result['id'])
+    return {'query': query, 'results': results}
+
+@blueprint.route('/export/invoices')
+@login_required
+@read_replica
+def export_invoices():
+    if current_user.role != 'admin':
+        flash('Access denied. You must be an admin to access this page.', 'danger')
+        return redirect(url_for('main.home'))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        flash('Unsupported export format.', 'danger')
+        return redirect(url_for('main.invoice_history'))
 
-    return render_template('invoice_history.html', invoices=invoices)
+    modified_since = None
+    if request.args.get('modified_since'):
+        try:
+            modified_since = datetime.fromisoformat(request.args['modified_since'])
+        except ValueError:
+            flash('Invalid modified_since timestamp.', 'danger')
+            return redirect(url_for('main.invoice_history'))
+
+    filters = invoice_filters_from_args(request.args)
+    lines = export_lines(export_rows(filters, modified_since), fmt)
+
+    response = Response(stream_with_context(lines), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=invoices.{fmt}'
+    return response
 
 @blueprint.route('/manage-clients')
 @login_required
@@ -321,6 +524,7 @@ def add_client():
             client_type=form.client_type.data
         )
         db.session.add(client)
+        bump_reference('clients')
         db.session.commit()
         flash('Client added successfully.', 'success')
         return redirect(url_for('main.manage_clients'))
@@ -336,6 +540,7 @@ def edit_client(client_id):
     form = AddClientForm(obj=client)
     if form.validate_on_submit():
         form.populate_obj(client)
+        bump_reference('clients')
         db.session.commit()
         flash('Client updated successfully.', 'success')
         return redirect(url_for('main.manage_clients'))
@@ -349,6 +554,7 @@ def delete_client(client_id):
         return redirect(url_for('main.home'))
     client = Client.query.get(client_id)
     db.session.delete(client)
+    bump_reference('clients', 'mappings')
     db.session.commit()
     flash('Client deleted successfully.', 'success')
     return redirect(url_for('main.manage_clients'))
@@ -372,6 +578,7 @@ def add_issuer():
     if form.validate_on_submit():
         issuer = Issuer(issuer_id=generate_issuer_id(), issuer_name=form.issuer_name.data)
         db.session.add(issuer)
+        bump_reference('issuers')
         db.session.commit()
         flash('Issuer added successfully.', 'success')
         return redirect(url_for('main.manage_issuers'))
@@ -387,6 +594,7 @@ def edit_issuer(issuer_id):
     form = EditIssuerForm(obj=issuer)
     if form.validate_on_submit():
         form.populate_obj(issuer)
+        bump_reference('issuers')
         db.session.commit()
         flash('Issuer updated successfully.', 'success')
         return redirect(url_for('main.manage_issuers'))
@@ -400,6 +608,7 @@ def delete_issuer(issuer_id):
         return redirect(url_for('main.home'))
     issuer = Issuer.query.get(issuer_id)
     db.session.delete(issuer)
+    bump_reference('issuers')
     db.session.commit()
     flash('Issuer deleted successfully.', 'success')
     return redirect(url_for('main.manage_issuers'))
@@ -430,6 +639,7 @@ def add_fee():
             is_dynamic=form.is_dynamic.data
         )
         db.session.add(fee)
+        bump_reference('fee_master')
         db.session.commit()
         flash('Fee added successfully.', 'success')
         return redirect(url_for('main.manage_fees'))
@@ -445,6 +655,7 @@ def edit_fee(fee_id):
     form = EditFeeForm(obj=fee)
     if form.validate_on_submit():
         form.populate_obj(fee)
+        bump_reference('fee_master')
         db.session.commit()
         flash('Fee updated successfully.', 'success')
         return redirect(url_for('main.manage_fees'))
@@ -458,6 +669,7 @@ def delete_fee(fee_id):
         return redirect(url_for('main.home'))
     fee = FeeMaster.query.get(fee_id)
     db.session.delete(fee)
+    bump_reference('fee_master', 'mappings')
     db.session.commit()
     flash('Fee deleted successfully.', 'success')
     return redirect(url_for('main.manage_fees'))
@@ -481,6 +693,7 @@ def add_product():
     if form.validate_on_submit():
         product = Product(product_id=generate_product_id(), product_name=form.product_name.data, issuer_id=form.issuer_id.data)
         db.session.add(product)
+        bump_reference('products')
         db.session.commit()
         flash('Product added successfully.', 'success')
         return redirect(url_for('main.manage_products'))
@@ -496,6 +709,7 @@ def edit_product(product_id):
     form = EditProductForm(obj=product)
     if form.validate_on_submit():
         form.populate_obj(product)
+        bump_reference('products')
         db.session.commit()
         flash('Product updated successfully.', 'success')
         return redirect(url_for('main.manage_products'))
@@ -509,48 +723,51 @@ def delete_product(product_id):
         return redirect(url_for('main.home'))
     product = Product.query.get(product_id)
     db.session.delete(product)
+    bump_reference('products', 'mappings')
     db.session.commit()
     flash('Product deleted successfully.', 'success')
     return redirect(url_for('main.manage_products'))
 
 @blueprint.route('/view-invoice/<string:invoice_id>')
 @login_required
+@read_replica
 def view_invoice(invoice_id):
-    invoice = Invoice.query.get(invoice_id)
+    invoice = Invoice.query.get(invoice_id) or archived_invoice(invoice_id)
     if not invoice:
         flash('Invoice not found.', 'danger')
         return redirect(url_for('main.invoice_history'))
 
-    client = invoice.client
-    line_items = invoice.line_items
-
-    html = render_template('invoice_template.html', invoice=invoice, client=client, line_items=line_items)
-
-    pdf_data = generate_pdf_from_html(html)
-
-    response = make_response(pdf_data)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'inline; filename=invoice_{invoice.invoice_number}.pdf'
-    return response
+    return send_invoice_pdf(invoice)
 
 @blueprint.route('/download-invoice/<string:invoice_id>')
 @login_required
+@read_replica
 def download_invoice(invoice_id):
-    invoice = Invoice.query.get(invoice_id)
+    invoice = Invoice.query.get(invoice_id) or archived_invoice(invoice_id)
     if not invoice:
         flash('Invoice not found.', 'danger')
         return redirect(url_for('main.invoice_history'))
 
-    client = invoice.client
-    line_items = invoice.line_items
+    return send_invoice_pdf(invoice, as_attachment=True)
+
+@blueprint.route('/download-invoices')
+@login_required
+@read_replica
+def download_invoices():
+    if current_user.role != 'admin':
+        flash('Access denied. You must be an admin to access this page.', 'danger')
+        return redirect(url_for('main.home'))
 
-    html = render_template_string(render_template('invoice_template.html', invoice=invoice, client=client, line_items=line_items))
+    filters = invoice_filters_from_args(request.args)
+    if not filters:
+        flash('Choose at least one filter (issuer, month, client or date range) for a bulk download.', 'warning')
+        return redirect(url_for('main.invoice_history'))
 
-    pdf_data = generate_pdf_from_html(html)
+    workers = current_app.config.get('BULK_PDF_WORKERS', 4)
+    chunks = stream_invoice_zip(bulk_invoice_query(filters), workers=workers)
 
-    response = make_response(pdf_data)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=invoice_{invoice.invoice_number}.pdf'
+    response = Response(stream_with_context(chunks), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=invoices.zip'
     return response
 
 @blueprint.route('/map-client-product-fees', methods=['GET', 'POST'])
@@ -579,16 +796,13 @@ def map_client_product_fees():
             end_date=end_date
         )
         db.session.add(mapping)
+        bump_reference('mappings')
         db.session.commit()
 
         flash('Client-Product-Fee mapping added successfully.', 'success')
         return redirect(url_for('main.map_client_product_fees'))
 
-    clients = Client.query.all()
-    products = Product.query.all()
-    fees = FeeMaster.query.all()
-
-    return render_template('map_client_product_fees.html', form=form, clients=clients, products=products, fees=fees)
+    return render_template('map_client_product_fees.html', form=form)
 
 @blueprint.route('/manage-interchange-fees', methods=['GET', 'POST'])
 @login_required
@@ -615,56 +829,20 @@ def manage_interchange_fees():
     interchange_fees = InterchangeFee.query.all()
     return render_template('manage_interchange_fees.html', form=form, interchange_fees=interchange_fees)
 
-def generate_invoice_id():
-    return f'INV-{datetime.now().strftime("%Y%m%d")}-{Invoice.query.count() + 1}'
-
-def generate_invoice_number():
-    return f'INV-{datetime.now().strftime("%Y%m%d")}-{Invoice.query.count() + 1}'
-
-def generate_fee_history_id():
-    return f'FEEHIST-{datetime.now().strftime("%Y%m%d")}-{FeeHistory.query.count() + 1}'
-
 def generate_user_id():
-    return f'USER-{datetime.now().strftime("%Y%m%d")}-{User.query.count() + 1}'
+    return next_id('users')
 
 def generate_client_id():
-    return f'CLIENT-{datetime.now().strftime("%Y%m%d")}-{Client.query.count() + 1}'
+    return next_id('clients')
 
 def generate_issuer_id():
-    return f'ISSUER-{datetime.now().strftime("%Y%m%d")}-{Issuer.query.count() + 1}'
+    return next_id('issuers')
 
 def generate_fee_id():
-    return f'FEE-{datetime.now().strftime("%Y%m%d")}-{FeeMaster.query.count() + 1}'
+    return next_id('fee_master')
 
 def generate_product_id():
-    return f'PROD-{datetime.now().strftime("%Y%m%d")}-{Product.query.count() + 1}'
-
-def fee_already_charged(client_id, fee_id):
-    fee_history = FeeHistory.query.filter(
-        FeeHistory.client_id == client_id,
-        FeeHistory.fee_id == fee_id
-    ).first()
-
-    return fee_history is not None
-
-def fee_already_charged_yearly(client_id, fee_id, start_date):
-    fee_history = FeeHistory.query.filter(
-        FeeHistory.client_id == client_id,
-        FeeHistory.fee_id == fee_id,
-        db.extract('year', FeeHistory.charge_date) == start_date.year
-    ).first()
-
-    return fee_history is not None
-
-def fee_already_charged_monthly(client_id, fee_id, start_date):
-    fee_history = FeeHistory.query.filter(
-        FeeHistory.client_id == client_id,
-        FeeHistory.fee_id == fee_id,
-        db.extract('year', FeeHistory.charge_date) == start_date.year,
-        db.extract('month', FeeHistory.charge_date) == start_date.month
-    ).first()
-
-    return fee_history is not None
+    return next_id('products')
 
 @blueprint.errorhandler(404)
 def page_not_found(error):
@@ -674,6 +852,16 @@ def page_not_found(error):
 def internal_server_error(error):
     return render_template('500.html'), 500
 
+@blueprint.errorhandler(RendererBusy)
+def renderer_busy(error):
+    flash('The PDF service is busy. Please try again in a moment.', 'warning')
+    return render_template('pdf_unavailable.html'), 503, {'Retry-After': '30'}
+
+@blueprint.errorhandler(RenderTimeout)
+def render_timeout(error):
+    flash('The PDF took too long to generate. Please try again in a moment.', 'warning')
+    return render_template('pdf_unavailable.html'), 504
+
 @blueprint.app_context_processor
 def inject_current_year():
     return dict(current_year=datetime.now().year)
\ No newline at end of file
@@ -0,0 +1,279 @@
+import threading
+import time
+from datetime import timedelta
+from flask import current_app
+from models import db, Client, Invoice
+
+# Search over invoice numbers and client names, GSTINs and emails, by prefix or substring,
+# case-insensitively. Queries are normalized (trimmed, runs of whitespace collapsed); values
+# are matched lower-cased with their whitespace as stored, as lower(column) is in the Postgres
+# queries and indexes, so both backends find the same rows. Results rank exact matches first,
+# then prefixes, then other substrings, and within each shorter values first, then
+# alphabetically.
+#
+# Postgres runs a prefix query per field, served by a btree index on (length, lower-cased
+# value), then an ILIKE one for the remaining substring matches, served by a pg_trgm GIN
+# index (the *_prefix and *_trgm indexes in models.py). Elsewhere (SQLite, tests) each
+# process keeps the values in memory, lower-cased and joined with newlines into one string
+# per value length, so that str.find does the scanning; going through the lengths shortest
+# first stops as soon as enough matches are found. Rows written since the strings were built
+# are kept aside until there are enough of them to rebuild. Before each search the index
+# reads the rows modified since its last load, the way mapping_index does, unless neither
+# the row count nor the latest modified_at moved; a row count that no longer matches (rows
+# deleted or archived) forces a full reload. SEARCH_BACKEND picks one of 'trigram' or
+# 'memory'; by default the database decides.
+
+SEARCH_FIELDS = {
+    # (kind, field): column
+    ('client', 'client_name'): Client.client_name,
+    ('client', 'client_gstin'): Client.client_gstin,
+    ('client', 'client_email'): Client.client_email,
+    ('invoice', 'invoice_number'): Invoice.invoice_number,
+}
+KIND_MODELS = {'client': (Client, Client.client_id), 'invoice': (Invoice, Invoice.invoice_id)}
+BACKENDS = ('trigram', 'memory')
+MIN_QUERY_LENGTH = 3
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# modified_at comes from the app servers' clocks; re-read a little before the last load.
+CLOCK_SKEW = timedelta(minutes=5)
+# While the row count and latest modified_at stay the same, re-read that stretch only this
+# often, for rows committed late with an earlier modified_at.
+RECHECK_SECONDS = 30
+SCAN_BATCH_SIZE = 10000
+# Rebuild a field's strings once this many rows (or this fraction of them) changed since.
+REBUILD_MIN_CHANGES = 1000
+REBUILD_FRACTION = 0.05
+
+def normalize(value):
+    return ' '.join(str(value or '').split()).lower()
+
+def searchable(value):
+    # A value as the queries match it. A newline can't be in a normalized query, and
+    # separates the in-memory strings, so it becomes a carriage return.
+    return str(value or '').lower().replace('\n', '\r')
+
+def _rank(value, query):
+    match_class = 0 if value == query else 1 if value.startswith(query) else 2
+    return (match_class, len(value), value)
+
+class FieldIndex:
+
+    def __init__(self, rows=()):
+        self.values = {}
+        for key, value in rows:
+            value = searchable(value)
+            if value:
+                self.values[key] = value
+        self._build()
+
+    def _build(self):
+        by_length = {}
+        for key, value in self.values.items():
+            by_length.setdefault(len(value), []).append((value, key))
+        # [(length, '\nvalue\nvalue\n', keys)]: entry i starts at i * (length + 1) + 1.
+        self.buckets = []
+        for length in sorted(by_length):
+            entries = sorted(by_length[length])
+            text = '\n' + '\n'.join(value for value, _ in entries) + '\n'
+            self.buckets.append((length, text, [key for _, key in entries]))
+        self.recent = {}
+        self.stale = set()
+
+    def set(self, key, value):
+        value = searchable(value)
+        if value == self.values.get(key, ''):
+            return
+        self.stale.add(key)
+        if value:
+            self.values[key] = self.recent[key] = value
+        else:
+            self.values.pop(key, None)
+            self.recent.pop(key, None)
+        if len(self.stale) > max(REBUILD_MIN_CHANGES, len(self.values) * REBUILD_FRACTION):
+            self._build()
+
+    def _scan(self, needle, offset, limit, found, accept):
+        for length, text, keys in self.buckets:
+            if length < len(needle) - offset:
+                continue
+            position = text.find(needle)
+            while position != -1:
+                index = (position + offset - 1) // (length + 1)
+                key = keys[index]
+                if key not in found and key not in self.stale and (accept is None or accept(key)):
+                    found[key] = self.values[key]
+                    if len(found) >= limit:
+                        return
+                position = text.find(needle, (index + 1) * (length + 1))
+
+    def top(self, query, limit, accept=None):
+        # The best `limit` (rank, key, value) matching `query`, best first.
+        found = {}
+        self._scan('\n' + query, 1, limit, found, accept)
+        if len(found) < limit:
+            self._scan(query, 0, limit, found, accept)
+        for key, value in self.recent.items():
+            if query in value and (accept is None or accept(key)):
+                found[key] = value
+        return sorted((_rank(value, query), key, value) for key, value in found.items())[:limit]
+
+class MemorySearchIndex:
+
+    def __init__(self):
+        self.fields = {}
+        self.owners = {}
+        self.counts = {}
+        self.loaded_until = {}
+        self.read_at = {}
+        self.lock = threading.Lock()
+
+    def _fields(self, kind):
+        return [field for (column_kind, field) in SEARCH_FIELDS if column_kind == kind]
+
+    def _query(self, kind):
+        model, key = KIND_MODELS[kind]
+        columns = [SEARCH_FIELDS[(kind, field)] for field in self._fields(kind)]
+        return db.session.query(key, model.client_id, model.modified_at, *columns)
+
+    def load(self, kind):
+        owners, columns, loaded_until = {}, {field: [] for field in self._fields(kind)}, None
+        for row in self._query(kind).yield_per(SCAN_BATCH_SIZE):
+            owners[row[0]] = row[1]
+            for field, value in zip(columns, row[3:]):
+                columns[field].append((row[0], value))
+            if row.modified_at is not None and (loaded_until is None or row.modified_at > loaded_until):
+                loaded_until = row.modified_at
+        for field, rows in columns.items():
+            self.fields[(kind, field)] = FieldIndex(rows)
+        self.owners[kind] = owners
+        self.counts[kind] = len(owners)
+        self.loaded_until[kind] = loaded_until
+        self.read_at[kind] = time.monotonic()
+
+    def refresh(self):
+        for kind, (model, key) in KIND_MODELS.items():
+            if kind not in self.counts or self.loaded_until.get(kind) is None:
+                self.load(kind)
+                continue
+            loaded_until = self.loaded_until[kind]
+            total, latest = db.session.query(db.func.count(key), db.func.max(model.modified_at)).one()
+            if (total, latest) == (self.counts[kind], loaded_until) and time.monotonic() - self.read_at[kind] < RECHECK_SECONDS:
+                continue
+            changed = self._query(kind).filter(model.modified_at >= loaded_until - CLOCK_SKEW).all()
+            owners = self.owners[kind]
+            if total != self.counts[kind] + sum(1 for row in changed if row[0] not in owners):
+                self.load(kind)
+                continue
+            for row in changed:
+                owners[row[0]] = row[1]
+                for field, value in zip(self._fields(kind), row[3:]):
+                    self.fields[(kind, field)].set(row[0], value)
+                if row.modified_at is not None and row.modified_at > loaded_until:
+                    loaded_until = row.modified_at
+            self.counts[kind] = total
+            self.loaded_until[kind] = loaded_until
+            self.read_at[kind] = time.monotonic()
+
+    def search(self, query, limit, client_id=None):
+        matches = []
+        for (kind, field), index in self.fields.items():
+            owners = self.owners[kind]
+            accept = None if client_id is None else lambda key: owners.get(key) == client_id
+            matches += [(kind, key, field, value) for _, key, value in index.top(query, limit, accept)]
+        return _ranked(matches, query, limit)
+
+_memory_index = MemorySearchIndex()
+
+def _ranked(matches, query, limit):
+    # Best match per row, ranked.
+    best = {}
+    for kind, key, field, value in matches:
+        rank = _rank(normalize(value), query)
+        if (kind, key) not in best or rank < best[(kind, key)][0]:
+            best[(kind, key)] = (rank, field, value)
+    ordered = sorted(best.items(), key=lambda item: (item[1][0], item[0]))
+    return [(kind, key, field, value) for (kind, key), (_, field, value) in ordered[:limit]]
+
+def _escape_like(query):
+    return query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Prefix matches of one field, shortest first: one range scan of its *_prefix index per
+# value length, each stopping at `limit`, so a short prefix shared by most rows stays cheap.
+# ~<~ orders by code point, as Python does, which is also the index's order.
+PREFIX_SQL = """
+SELECT matches.key, matches.value
+FROM generate_series(:length, (SELECT max(length({column})) FROM {table})) AS lengths (length)
+CROSS JOIN LATERAL (
+    SELECT {key} AS key, {column} AS value FROM {table}
+    WHERE length({column}) = lengths.length AND lower({column}) LIKE :prefix{scope}
+    ORDER BY lower({column}) USING ~<~ LIMIT :limit
+) AS matches
+ORDER BY lengths.length, lower(matches.value) USING ~<~ LIMIT :limit
+"""
+# Other substring matches, through the field's *_trgm index.
+SUBSTRING_SQL = """
+SELECT {key} AS key, {column} AS value FROM {table}
+WHERE {column} ILIKE :pattern AND lower({column}) NOT LIKE :prefix{scope}
+ORDER BY length({column}), lower({column}) USING ~<~ LIMIT :limit
+"""
+
+def _trigram_search(query, limit, client_id=None):
+    # Each field's best `limit`, merged and ranked together; the substring query only runs
+    # for what the prefix one leaves.
+    params = {'length': len(query), 'prefix': f'{_escape_like(query)}%', 'pattern': f'%{_escape_like(query)}%',
+              'client_id': client_id}
+    matches = []
+    for (kind, field), column in SEARCH_FIELDS.items():
+        model, key = KIND_MODELS[kind]
+        names = {'table': model.__tablename__, 'key': key.name, 'column': column.name,
+                 'scope': '' if client_id is None else ' AND client_id = :client_id'}
+        rows = db.session.execute(db.text(PREFIX_SQL.format(**names)), dict(params, limit=limit)).all()
+        if len(rows) < limit:
+            rows += db.session.execute(db.text(SUBSTRING_SQL.format(**names)), dict(params, limit=limit - len(rows))).all()
+        matches += [(kind, row_key, field, value) for row_key, value in rows]
+    return _ranked(matches, query, limit)
+
+def search_backend():
+    backend = current_app.config.get('SEARCH_BACKEND')
+    if backend and backend not in BACKENDS:
+        raise RuntimeError(f"SEARCH_BACKEND must be one of {', '.join(BACKENDS)}")
+    if backend:
+        return backend
+    return 'trigram' if db.session.connection().dialect.name == 'postgresql' else 'memory'
+
+def search(query, limit=DEFAULT_LIMIT, client_id=None):
+    # [{'type', 'id', 'matched', ...}] best first. `client_id` keeps to one client's rows.
+    query = normalize(query)
+    if len(query) < MIN_QUERY_LENGTH:
+        raise ValueError(f'Search for at least {MIN_QUERY_LENGTH} characters.')
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    if search_backend() == 'trigram':
+        matches = _trigram_search(query, limit, client_id)
+    else:
+        with _memory_index.lock:
+            _memory_index.refresh()
+            matches = _memory_index.search(query, limit, client_id)
+    return _results(matches)
+
+def _results(matches):
+    client_ids = [key for kind, key, _, _ in matches if kind == 'client']
+    invoice_ids = [key for kind, key, _, _ in matches if kind == 'invoice']
+    clients = {client.client_id: client for client in Client.query.filter(Client.client_id.in_(client_ids))} if client_ids else {}
+    invoices = {row.invoice_id: row for row in db.session.query(
+        Invoice.invoice_id, Invoice.invoice_number, Invoice.invoice_date, Invoice.client_id, Invoice.grand_total, Client.client_name
+    ).outerjoin(Client, Client.client_id == Invoice.client_id).filter(Invoice.invoice_id.in_(invoice_ids))} if invoice_ids else {}
+
+    results = []
+    for kind, key, field, value in matches:
+        if kind == 'client' and key in clients:
+            client = clients[key]
+            results.append({'type': 'client', 'id': key, 'matched': field, 'client_name': client.client_name,
+                            'client_gstin': client.client_gstin, 'client_email': client.client_email})
+        elif kind == 'invoice' and key in invoices:
+            invoice = invoices[key]
+            results.append({'type': 'invoice', 'id': key, 'matched': field, 'invoice_number': invoice.invoice_number,
+                            'invoice_date': invoice.invoice_date, 'client_id': invoice.client_id,
+                            'client_name': invoice.client_name, 'grand_total': invoice.grand_total})
+    return results
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+import time
+from flask import current_app, session
+from flask_login import UserMixin
+from models import db, User
+
+# flask_login loads the user on every authenticated request, and routes only read its
+# user_id, username and role. Each worker keeps those for USER_CACHE_TTL seconds instead of
+# querying users every time. The session carries a stamp of the user's password hash and
+# role, taken at login: a session whose stamp no longer matches the user (password or role
+# changed since) stops authenticating. Other workers notice within the TTL; a mismatch is
+# checked against the database before the session is refused, so a fresh login elsewhere
+# isn't turned away by a stale entry here.
+
+SESSION_KEY = '_user_stamp'
+MAX_ENTRIES = 10000
+
+class Identity(UserMixin):
+    __slots__ = ('user_id', 'username', 'role', 'stamp')
+
+    def __init__(self, user_id, username, role, stamp):
+        self.user_id = user_id
+        self.username = username
+        self.role = role
+        self.stamp = stamp
+
+    def __repr__(self):
+        return f'<User {self.username}>'
+
+    def get_id(self):
+        return str(self.user_id)
+
+_entries = {}  # user_id: (loaded at, Identity or None)
+_lock = threading.Lock()
+
+def user_stamp(user):
+    return hashlib.sha256(f'{user.password}\0{user.role}'.encode()).hexdigest()[:16]
+
+def _load(user_id):
+    row = db.session.query(User.user_id, User.username, User.role, User.password).filter(User.user_id == user_id).first()
+    return Identity(row.user_id, row.username, row.role, user_stamp(row)) if row else None
+
+def cached_identity(user_id):
+    ttl = current_app.config.get('USER_CACHE_TTL', 30)
+    now = time.monotonic()
+    entry = _entries.get(user_id)
+    if entry is not None and now - entry[0] < ttl:
+        return entry[1]
+
+    identity = _load(user_id)
+    if ttl > 0:
+        with _lock:
+            if len(_entries) >= MAX_ENTRIES:
+                for key in [key for key, (loaded, _) in _entries.items() if now - loaded >= ttl]:
+                    del _entries[key]
+                if len(_entries) >= MAX_ENTRIES:
+                    _entries.clear()
+            _entries[user_id] = (now, identity)
+    return identity
+
+def forget_user(user_id):
+    # After changing a user, so this worker sees it at once.
+    with _lock:
+        _entries.pop(str(user_id), None)
+
+def stamp_session(user):
+    session[SESSION_KEY] = user_stamp(user)
+
+def load_user(user_id):
+    identity = cached_identity(user_id)
+    if identity is None:
+        return None
+    stamp = session.get(SESSION_KEY)
+    if stamp is None:
+        # Logged in before sessions carried stamps.
+        session[SESSION_KEY] = identity.stamp
+    elif stamp != identity.stamp:
+        forget_user(user_id)
+        identity = cached_identity(user_id)
+        if identity is None or stamp != identity.stamp:
+            return None
+    return identity
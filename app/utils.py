@@ -1,10 +1,8 @@
 from flask import render_template
-import pdfrw
+from html_to_pdf import render_pdf
 
 def generate_pdf(template_name, **kwargs):
     # Render the HTML template with the provided arguments
     html = render_template(template_name, **kwargs)
-    # Convert the rendered HTML to PDF
-    pdf_file = pdfrw.PdfWriter()
-    pdf_file.write(html)
-    return pdf_file.stream.getvalue()
\ No newline at end of file
+    # Convert the rendered HTML to PDF with the configured renderer backend
+    return render_pdf(html)
@@ -0,0 +1,22 @@
+import os
+import shutil
+import tempfile
+
+# gunicorn reads this file from the working directory: `gunicorn wsgi:app`.
+# Workers share their Prometheus metrics through PROMETHEUS_MULTIPROC_DIR. It has to be
+# in the environment before the app (and prometheus_client) is imported, hence here.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'invoices-metrics'))
+
+def on_starting(server):
+    # Files left by a previous master would be added to the new totals.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
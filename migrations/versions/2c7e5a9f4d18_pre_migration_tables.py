@@ -0,0 +1,63 @@
+"""tables added before migrations existed
+
+Revision ID: 2c7e5a9f4d18
+Revises: 3f9a1c2d7b10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c7e5a9f4d18'
+down_revision = '3f9a1c2d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() already creates the tables on fresh databases.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('id_counters'):
+        op.create_table(
+            'id_counters',
+            sa.Column('name', sa.String(length=50), nullable=False),
+            sa.Column('value', sa.BigInteger(), nullable=False),
+            sa.Column('modified_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('name')
+        )
+    if not inspector.has_table('billing_runs'):
+        op.create_table(
+            'billing_runs',
+            sa.Column('run_id', sa.Integer(), nullable=False),
+            sa.Column('period', sa.String(length=7), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.CheckConstraint("status IN ('running', 'completed', 'failed')"),
+            sa.PrimaryKeyConstraint('run_id'),
+            sa.UniqueConstraint('period')
+        )
+    if not inspector.has_table('billing_run_clients'):
+        op.create_table(
+            'billing_run_clients',
+            sa.Column('run_id', sa.Integer(), nullable=False),
+            sa.Column('client_id', sa.String(length=30), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('invoice_id', sa.String(length=30), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('modified_at', sa.DateTime(), nullable=True),
+            sa.CheckConstraint("status IN ('done', 'skipped', 'failed')"),
+            sa.ForeignKeyConstraint(['client_id'], ['clients.client_id']),
+            sa.ForeignKeyConstraint(['invoice_id'], ['invoices.invoice_id']),
+            sa.ForeignKeyConstraint(['run_id'], ['billing_runs.run_id']),
+            sa.PrimaryKeyConstraint('run_id', 'client_id')
+        )
+
+
+def downgrade():
+    op.drop_table('billing_run_clients')
+    op.drop_table('billing_runs')
+    op.drop_table('id_counters')
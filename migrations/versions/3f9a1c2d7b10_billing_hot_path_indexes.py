@@ -0,0 +1,52 @@
+"""billing hot path indexes
+
+Revision ID: 3f9a1c2d7b10
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# The schema predates migrations and was created with db.create_all(), which now also
+# creates these indexes on fresh databases, so skip any that already exist.
+INDEXES = [
+    ('ix_client_product_fee_mapping_client_dates', 'client_product_fee_mapping', ['client_id', 'start_date', 'end_date'], None),
+    ('ix_fee_history_client_fee_charge_date', 'fee_history', ['client_id', 'fee_id', 'charge_date'], None),
+    ('ix_interchange_fees_client_period', 'interchange_fees', ['client_id', 'start_date', 'end_date', 'charge_date'], None),
+    ('ix_invoices_date_id', 'invoices', ['invoice_date', 'invoice_id'], None),
+    ('ix_invoices_client_date_id', 'invoices', ['client_id', 'invoice_date', 'invoice_id'], None),
+    ('ix_invoices_issuer_month', 'invoices', ['issuer_id', 'invoice_month'], None),
+    ('ix_invoices_modified_at', 'invoices', ['modified_at'], None),
+    ('ix_invoice_line_items_invoice_id', 'invoice_line_items', ['invoice_id'], None),
+    ('ix_invoice_line_items_modified_at', 'invoice_line_items', ['modified_at'], None),
+    ('ix_clients_client_email', 'clients', ['client_email'], 'client_email IS NOT NULL'),
+    ('ix_clients_issuer_id', 'clients', ['issuer_id'], None),
+]
+
+
+def _existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    for name, table, columns, where in INDEXES:
+        if name in _existing_indexes(table):
+            continue
+        kwargs = {}
+        if where:
+            kwargs = {'postgresql_where': sa.text(where), 'sqlite_where': sa.text(where)}
+        op.create_index(name, table, columns, unique=False, **kwargs)
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        if name in _existing_indexes(table):
+            op.drop_index(name, table_name=table)
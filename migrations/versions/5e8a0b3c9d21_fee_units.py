@@ -0,0 +1,61 @@
+"""fee units uploads
+
+Revision ID: 5e8a0b3c9d21
+Revises: c41d7e9b2a58
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a0b3c9d21'
+down_revision = 'c41d7e9b2a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() already creates the tables on fresh databases.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('fee_unit_uploads'):
+        op.create_table(
+            'fee_unit_uploads',
+            sa.Column('upload_id', sa.Integer(), nullable=False),
+            sa.Column('filename', sa.String(length=255), nullable=True),
+            sa.Column('period', sa.Date(), nullable=True),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('rows_total', sa.Integer(), nullable=False),
+            sa.Column('rows_staged', sa.Integer(), nullable=False),
+            sa.Column('rows_rejected', sa.Integer(), nullable=False),
+            sa.Column('error_report', sa.Text(), nullable=True),
+            sa.Column('uploaded_by', sa.String(length=30), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.CheckConstraint("status IN ('processing', 'staged', 'partial', 'rejected')"),
+            sa.ForeignKeyConstraint(['uploaded_by'], ['users.user_id']),
+            sa.PrimaryKeyConstraint('upload_id')
+        )
+    if not inspector.has_table('fee_units'):
+        op.create_table(
+            'fee_units',
+            sa.Column('client_id', sa.String(length=30), nullable=False),
+            sa.Column('fee_id', sa.String(length=30), nullable=False),
+            sa.Column('period', sa.Date(), nullable=False),
+            sa.Column('units', sa.Integer(), nullable=False),
+            sa.Column('upload_id', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('modified_at', sa.DateTime(), nullable=True),
+            sa.CheckConstraint('units >= 0'),
+            sa.ForeignKeyConstraint(['client_id'], ['clients.client_id']),
+            sa.ForeignKeyConstraint(['fee_id'], ['fee_master.fee_id']),
+            sa.ForeignKeyConstraint(['upload_id'], ['fee_unit_uploads.upload_id']),
+            sa.PrimaryKeyConstraint('client_id', 'fee_id', 'period')
+        )
+        op.create_index('ix_fee_units_period_client', 'fee_units', ['period', 'client_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_fee_units_period_client', table_name='fee_units')
+    op.drop_table('fee_units')
+    op.drop_table('fee_unit_uploads')
@@ -0,0 +1,57 @@
+"""revenue summary tables
+
+Revision ID: a7d3f1c9e642
+Revises: 5e8a0b3c9d21
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3f1c9e642'
+down_revision = '5e8a0b3c9d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() already creates the tables on fresh databases. Fill them with
+    # `flask revenue rebuild` after upgrading.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('revenue_monthly'):
+        op.create_table(
+            'revenue_monthly',
+            sa.Column('issuer_id', sa.String(length=30), nullable=False),
+            sa.Column('client_id', sa.String(length=30), nullable=False),
+            sa.Column('month', sa.Date(), nullable=False),
+            sa.Column('invoices', sa.Integer(), nullable=False),
+            sa.Column('taxable_amount', sa.Numeric(precision=16, scale=2), nullable=False),
+            sa.Column('tax_amount', sa.Numeric(precision=16, scale=2), nullable=False),
+            sa.Column('grand_total', sa.Numeric(precision=16, scale=2), nullable=False),
+            sa.PrimaryKeyConstraint('issuer_id', 'client_id', 'month')
+        )
+        op.create_index('ix_revenue_monthly_month', 'revenue_monthly', ['month'], unique=False)
+    if not inspector.has_table('revenue_by_fee'):
+        op.create_table(
+            'revenue_by_fee',
+            sa.Column('issuer_id', sa.String(length=30), nullable=False),
+            sa.Column('client_id', sa.String(length=30), nullable=False),
+            sa.Column('fee_id', sa.String(length=30), nullable=False),
+            sa.Column('month', sa.Date(), nullable=False),
+            sa.Column('line_items', sa.Integer(), nullable=False),
+            sa.Column('units', sa.BigInteger(), nullable=False),
+            sa.Column('total', sa.Numeric(precision=16, scale=2), nullable=False),
+            sa.Column('gst_amount', sa.Numeric(precision=16, scale=2), nullable=False),
+            sa.Column('final_amount', sa.Numeric(precision=16, scale=2), nullable=False),
+            sa.PrimaryKeyConstraint('issuer_id', 'client_id', 'fee_id', 'month')
+        )
+        op.create_index('ix_revenue_by_fee_month_fee', 'revenue_by_fee', ['month', 'fee_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_revenue_by_fee_month_fee', table_name='revenue_by_fee')
+    op.drop_table('revenue_by_fee')
+    op.drop_index('ix_revenue_monthly_month', table_name='revenue_monthly')
+    op.drop_table('revenue_monthly')
@@ -0,0 +1,35 @@
+"""search prefix indexes
+
+Revision ID: b6d1e8f2a4c5
+Revises: f3a9d6c1b287
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1e8f2a4c5'
+down_revision = 'f3a9d6c1b287'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_clients_client_name_prefix', 'clients', 'client_name'),
+    ('ix_clients_client_gstin_prefix', 'clients', 'client_gstin'),
+    ('ix_clients_client_email_prefix', 'clients', 'client_email'),
+    ('ix_invoices_invoice_number_prefix', 'invoices', 'invoice_number'),
+]
+
+
+def upgrade():
+    # (length, lower-cased value) btree indexes for search.py's prefix queries, as in models.py.
+    # The inspector doesn't reflect expression indexes, hence IF NOT EXISTS.
+    ops = ' text_pattern_ops' if op.get_bind().dialect.name == 'postgresql' else ''
+    for name, table, column in INDEXES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} (length({column}), lower({column}){ops})')
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
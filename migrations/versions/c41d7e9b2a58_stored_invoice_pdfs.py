@@ -0,0 +1,43 @@
+"""stored invoice pdfs
+
+Revision ID: c41d7e9b2a58
+Revises: 8b2e4f6a1c33
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9b2a58'
+down_revision = '8b2e4f6a1c33'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    sa.Column('pdf_path', sa.String(length=255), nullable=True),
+    sa.Column('pdf_sha256', sa.String(length=64), nullable=True),
+    sa.Column('pdf_size', sa.Integer(), nullable=True),
+    sa.Column('pdf_rendered_at', sa.DateTime(), nullable=True),
+]
+
+
+def _existing_columns():
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns('invoices')}
+
+
+def upgrade():
+    existing = _existing_columns()
+    with op.batch_alter_table('invoices') as batch_op:
+        for column in COLUMNS:
+            if column.name not in existing:
+                batch_op.add_column(column.copy())
+
+
+def downgrade():
+    existing = _existing_columns()
+    with op.batch_alter_table('invoices') as batch_op:
+        for column in reversed(COLUMNS):
+            if column.name in existing:
+                batch_op.drop_column(column.name)
@@ -0,0 +1,44 @@
+"""invoice_line_items.invoice_date and optional partitioning
+
+Revision ID: d92b6e4a0f17
+Revises: a7d3f1c9e642
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'd92b6e4a0f17'
+down_revision = 'a7d3f1c9e642'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if 'invoice_date' not in {column['name'] for column in inspector.get_columns('invoice_line_items')}:
+        with op.batch_alter_table('invoice_line_items') as batch_op:
+            batch_op.add_column(sa.Column('invoice_date', sa.Date(), nullable=True))
+    op.execute('UPDATE invoice_line_items SET invoice_date = '
+               '(SELECT invoice_date FROM invoices WHERE invoices.invoice_id = invoice_line_items.invoice_id) '
+               'WHERE invoice_date IS NULL')
+
+    # Partitioning moves every row of the three tables; it only happens with PARTITION_INTERVAL
+    # set, and can be done later with `flask partitions convert` instead.
+    interval = current_app.config.get('PARTITION_INTERVAL')
+    if bind.dialect.name == 'postgresql' and interval:
+        from partitions import partition_tables
+        partition_tables(bind, interval, current_app.config.get('PARTITION_AHEAD', 3))
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        from partitions import unpartition_tables
+        unpartition_tables(bind)
+    with op.batch_alter_table('invoice_line_items') as batch_op:
+        batch_op.drop_column('invoice_date')
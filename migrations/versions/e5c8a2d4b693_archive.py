@@ -0,0 +1,78 @@
+"""archived financial years
+
+Revision ID: e5c8a2d4b693
+Revises: d92b6e4a0f17
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c8a2d4b693'
+down_revision = 'd92b6e4a0f17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() already creates the tables on fresh databases.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('archived_years'):
+        op.create_table(
+            'archived_years',
+            sa.Column('financial_year', sa.String(length=7), nullable=False),
+            sa.Column('start_date', sa.Date(), nullable=False),
+            sa.Column('end_date', sa.Date(), nullable=False),
+            sa.Column('invoices', sa.Integer(), nullable=False),
+            sa.Column('line_items', sa.Integer(), nullable=False),
+            sa.Column('fee_history', sa.Integer(), nullable=False),
+            sa.Column('manifest_sha256', sa.String(length=64), nullable=False),
+            sa.Column('archived_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('financial_year')
+        )
+    if not inspector.has_table('archived_invoices'):
+        op.create_table(
+            'archived_invoices',
+            sa.Column('invoice_id', sa.String(length=30), nullable=False),
+            sa.Column('financial_year', sa.String(length=7), nullable=False),
+            sa.Column('archive_file', sa.String(length=255), nullable=False),
+            sa.Column('biller_id', sa.String(length=30), nullable=True),
+            sa.Column('client_id', sa.String(length=30), nullable=True),
+            sa.Column('issuer_id', sa.String(length=30), nullable=True),
+            sa.Column('invoice_number', sa.String(length=50), nullable=False),
+            sa.Column('invoice_date', sa.Date(), nullable=False),
+            sa.Column('invoice_amount', sa.Numeric(precision=10, scale=2), nullable=False),
+            sa.Column('tax_amount', sa.Numeric(precision=10, scale=2), nullable=True),
+            sa.Column('total_amount', sa.Numeric(precision=10, scale=2), nullable=True),
+            sa.Column('invoice_type', sa.String(length=20), nullable=True),
+            sa.Column('invoice_month', sa.Date(), nullable=True),
+            sa.Column('charge_date', sa.Date(), nullable=True),
+            sa.ForeignKeyConstraint(['financial_year'], ['archived_years.financial_year']),
+            sa.ForeignKeyConstraint(['biller_id'], ['biller.biller_id']),
+            sa.ForeignKeyConstraint(['client_id'], ['clients.client_id']),
+            sa.ForeignKeyConstraint(['issuer_id'], ['issuers.issuer_id']),
+            sa.PrimaryKeyConstraint('invoice_id')
+        )
+        op.create_index('ix_archived_invoices_date_id', 'archived_invoices', ['invoice_date', 'invoice_id'], unique=False)
+        op.create_index('ix_archived_invoices_client_date_id', 'archived_invoices', ['client_id', 'invoice_date', 'invoice_id'], unique=False)
+    if not inspector.has_table('archived_fee_charges'):
+        op.create_table(
+            'archived_fee_charges',
+            sa.Column('client_id', sa.String(length=30), nullable=False),
+            sa.Column('fee_id', sa.String(length=30), nullable=False),
+            sa.Column('year', sa.Integer(), nullable=False),
+            sa.Column('charges', sa.Integer(), nullable=False),
+            sa.Column('units', sa.BigInteger(), nullable=False),
+            sa.Column('total', sa.Numeric(precision=16, scale=2), nullable=False),
+            sa.PrimaryKeyConstraint('client_id', 'fee_id', 'year')
+        )
+
+
+def downgrade():
+    op.drop_table('archived_fee_charges')
+    op.drop_index('ix_archived_invoices_client_date_id', table_name='archived_invoices')
+    op.drop_index('ix_archived_invoices_date_id', table_name='archived_invoices')
+    op.drop_table('archived_invoices')
+    op.drop_table('archived_years')
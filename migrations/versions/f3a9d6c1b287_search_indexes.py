@@ -0,0 +1,39 @@
+"""search indexes
+
+Revision ID: f3a9d6c1b287
+Revises: e5c8a2d4b693
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d6c1b287'
+down_revision = 'e5c8a2d4b693'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_clients_client_name_trgm', 'clients', 'client_name'),
+    ('ix_clients_client_gstin_trgm', 'clients', 'client_gstin'),
+    ('ix_clients_client_email_trgm', 'clients', 'client_email'),
+    ('ix_invoices_invoice_number_trgm', 'invoices', 'invoice_number'),
+]
+
+
+def upgrade():
+    # pg_trgm GIN indexes on Postgres (search.py), ordinary ones elsewhere, as in models.py.
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    inspector = sa.inspect(bind)
+    for name, table, column in INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, [column], postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,91 @@
+"""Requests per second on a trivial logged-in page, loading the user every request or cached.
+
+Builds a temporary SQLite database with one admin, logs in through the test client and
+requests the home page `--requests` times with USER_CACHE_TTL=0 (the users table read on
+every request, as before user_cache) and with `--ttl`. Reported per mode: requests per
+second and SQL statements per request. Then checks that changing the user's password
+stops the old session once the cached entry is gone; exit status 1 if it doesn't.
+
+    python scripts/bench_auth.py --requests 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from wsgi import create_app
+from config import engine_options
+from models import db, User
+import user_cache
+
+def measure(app, client, requests):
+    statements = []
+    def count(*_):
+        statements.append(1)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get('/')
+            assert response.status_code == 200 and b'Logout' in response.data
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return requests / elapsed, len(statements) / requests
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--ttl', type=int, default=30, help='USER_CACHE_TTL for the cached run.')
+    args = parser.parse_args()
+
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database.close()
+    url = f'sqlite:///{database.name}'
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    app.config.update(SQLALCHEMY_DATABASE_URI=url, SQLALCHEMY_ENGINE_OPTIONS=engine_options(url), SQLALCHEMY_BINDS={},
+                      WTF_CSRF_ENABLED=False)
+    failures = 0
+    try:
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(user_id='BENCH-1', username='bench', password=generate_password_hash('bench-password'), role='admin'))
+            db.session.commit()
+        client = app.test_client()
+        client.post('/login', data={'username': 'bench', 'password': 'bench-password'})
+
+        results = {}
+        for ttl in (0, args.ttl):
+            app.config['USER_CACHE_TTL'] = ttl
+            user_cache._entries.clear()
+            measure(app, client, min(100, args.requests))
+            results[ttl] = measure(app, client, args.requests)
+            print(f'USER_CACHE_TTL={ttl:<4} {results[ttl][0]:10,.0f} requests/s  {results[ttl][1]:5.2f} statements/request')
+        print(f'speed-up          {results[args.ttl][0] / results[0][0]:10.2f} x')
+
+        with app.app_context():
+            user = db.session.get(User, 'BENCH-1')
+            user.password = generate_password_hash('changed-password')
+            db.session.commit()
+        user_cache.forget_user('BENCH-1')
+        if b'Logout' in client.get('/').data:
+            failures += 1
+            print('FAILED: the session outlived a password change')
+        else:
+            print('password change ends the old session: ok')
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        os.unlink(database.name)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Compare the in-memory mapping index with the SQL overlap query.
+
+Builds a temporary SQLite database with scripts/generate_data.py, then gives every
+client-fee mapping `--history` earlier, back-to-back periods (a repricing each year), so
+lookups have several intervals to choose from. Reported: the time and memory to build the
+index, the cost of refreshing it after one new mapping, and the per-lookup cost of
+"mappings of client X active over [a, b]" through SQL and through the index, for the same
+random lookups. Every lookup's results are compared; any difference is printed and the
+exit status is 1. get_applicable_fees_for_clients is compared the same way in both modes.
+
+    python scripts/bench_mapping_index.py --scale medium --history 4 --lookups 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wsgi import create_app
+from config import engine_options
+from models import db, Client, ClientProductFeeMapping
+from functions import month_range, get_applicable_fees_for_clients
+from mapping_index import MappingIndex, get_mapping_index
+from reference_cache import bump_reference
+import reference_cache
+from generate_data import SCALES, generate
+
+def add_history(history):
+    mappings = db.session.query(ClientProductFeeMapping.client_id, ClientProductFeeMapping.product_id, ClientProductFeeMapping.fee_id,
+                                ClientProductFeeMapping.unit_price, ClientProductFeeMapping.start_date).all()
+    rows = []
+    for client_id, product_id, fee_id, unit_price, start in mappings:
+        for years in range(1, history + 1):
+            rows.append({'client_id': client_id, 'product_id': product_id, 'fee_id': fee_id, 'unit_price': unit_price,
+                         'start_date': start.replace(year=start.year - years),
+                         'end_date': start.replace(year=start.year - years + 1) - timedelta(days=1)})
+    for i in range(0, len(rows), 5000):
+        db.session.execute(ClientProductFeeMapping.__table__.insert(), rows[i:i + 5000])
+    db.session.commit()
+    return len(rows)
+
+def sql_lookup(client_id, start, end):
+    return [mapping_id for mapping_id, in db.session.query(ClientProductFeeMapping.mapping_id).filter(
+        ClientProductFeeMapping.client_id == client_id,
+        ClientProductFeeMapping.start_date <= end,
+        ClientProductFeeMapping.end_date >= start
+    ).order_by(ClientProductFeeMapping.mapping_id)]
+
+def random_windows(client_ids, count, first, last, rng):
+    days = (last - first).days
+    windows = []
+    for _ in range(count):
+        start = first + timedelta(days=rng.randrange(days))
+        windows.append((rng.choice(client_ids), start, start + timedelta(days=rng.choice((0, 30, 90, 365)))))
+    return windows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=list(SCALES), default='medium')
+    parser.add_argument('--history', type=int, default=3, help='Earlier yearly periods per mapping.')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database.close()
+    url = f'sqlite:///{database.name}'
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    app.config.update(SQLALCHEMY_DATABASE_URI=url, SQLALCHEMY_ENGINE_OPTIONS=engine_options(url), SQLALCHEMY_BINDS={})
+    failures = 0
+    try:
+        with app.app_context():
+            db.create_all()
+            reference_cache._entries.clear()
+            period = date.today().replace(day=1)
+            generate(until=period, seed=args.seed, **SCALES[args.scale])
+            add_history(args.history)
+            total = db.session.query(db.func.count(ClientProductFeeMapping.mapping_id)).scalar()
+            client_ids = [client_id for client_id, in db.session.query(Client.client_id)]
+            print(f'{len(client_ids)} clients, {total} mappings')
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            index = MappingIndex()
+            index.load()
+            built = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'build            {built * 1000:10.1f} ms  {peak / 1024 / 1024:8.1f} MiB peak')
+
+            get_mapping_index()
+            client_id = client_ids[0]
+            db.session.add(ClientProductFeeMapping(client_id=client_id, product_id=None, fee_id=None, unit_price=0,
+                                                   start_date=period, end_date=period))
+            bump_reference('mappings')
+            db.session.commit()
+            started = time.perf_counter()
+            refreshed = get_mapping_index()
+            print(f'refresh (1 new)  {(time.perf_counter() - started) * 1000:10.1f} ms')
+            index = refreshed
+
+            first = db.session.query(db.func.min(ClientProductFeeMapping.start_date)).scalar()
+            windows = random_windows(client_ids, args.lookups, first, period.replace(year=period.year + 1), rng)
+
+            started = time.perf_counter()
+            expected = [sql_lookup(*window) for window in windows]
+            sql_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            actual = [[entry.mapping_id for entry in index.active(*window)] for window in windows]
+            index_seconds = time.perf_counter() - started
+
+            for window, want, got in zip(windows, expected, actual):
+                if want != got:
+                    failures += 1
+                    if failures <= 10:
+                        print(f'MISMATCH {window}: sql {want} index {got}')
+            print(f'sql lookup       {sql_seconds / len(windows) * 1e6:10.1f} us  ({len(windows) / sql_seconds:,.0f}/s)')
+            print(f'index lookup     {index_seconds / len(windows) * 1e6:10.1f} us  ({len(windows) / index_seconds:,.0f}/s)')
+            print(f'speed-up         {sql_seconds / index_seconds:10.1f} x  over {len(windows)} lookups, '
+                  f'{sum(map(len, expected))} matches, {failures} mismatches')
+
+            start, next_month = month_range(period)
+            end = next_month - date.resolution
+            results = {}
+            for enabled in (False, True):
+                app.config['MAPPING_INDEX_ENABLED'] = enabled
+                db.session.expire_all()
+                started = time.perf_counter()
+                fees = get_applicable_fees_for_clients(client_ids, start, end)
+                elapsed = time.perf_counter() - started
+                results[enabled] = {client_id: [(fee.fee_id, mapping.mapping_id) for fee, mapping in client_fees] for client_id, client_fees in fees.items()}
+                print(f"applicable fees  {elapsed * 1000:10.1f} ms  ({'index' if enabled else 'sql'}, all clients)")
+                db.session.rollback()
+            if results[False] != results[True]:
+                failures += 1
+                print('MISMATCH in get_applicable_fees_for_clients')
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        os.unlink(database.name)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
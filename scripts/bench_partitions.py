@@ -0,0 +1,133 @@
+"""Compare fee_history lookups on a plain table and on a monthly partitioned one, in Postgres.
+
+Fills two copies of fee_history in a scratch schema with the same `--rows` rows
+(generate_series, spread over `--years` years, `--clients` clients and `--fees` fees) -- one
+plain, one partitioned by month of charge_date as partitions.py does -- each with the model's
+(client_id, fee_id, charge_date) index. Then runs, on both, the billing eligibility lookups
+with EXPLAIN ANALYZE: the single query that OR-ed one-time fees (any date) with periodic fees
+(this year), the split queries functions._charged_fee_keys now sends, and the yearly and
+monthly single-fee checks. Reported per query: median execution time over `--repeat` runs
+and the number of fee_history partitions the plan read.
+
+    python scripts/bench_partitions.py --database-url postgresql://postgres@localhost/bench --rows 20000000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from sqlalchemy import create_engine, text
+from partitions import period_start, next_period, partition_name
+
+SCHEMA = 'bench_partitions'
+COLUMNS = ('fee_history_id varchar(30) NOT NULL, client_id varchar(30), issuer_id varchar(30), fee_id varchar(30), '
+           'charge_date date NOT NULL, units integer, total numeric(10, 2), created_at timestamp, modified_at timestamp')
+
+def build(connection, rows, clients, fees, first, days):
+    connection.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+    connection.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+    connection.execute(text(f'CREATE TABLE {SCHEMA}.fee_history_plain ({COLUMNS}, PRIMARY KEY (fee_history_id))'))
+    connection.execute(text(f'CREATE TABLE {SCHEMA}.fee_history_partitioned ({COLUMNS}, PRIMARY KEY (fee_history_id, charge_date)) '
+                            'PARTITION BY RANGE (charge_date)'))
+    start, last = period_start(first, 'month'), date.fromordinal(first.toordinal() + days)
+    partitions = 0
+    while start <= last:
+        end = next_period(start, 'month')
+        connection.execute(text(f"CREATE TABLE {SCHEMA}.{partition_name('fee_history', start, 'month')} "
+                                f"PARTITION OF {SCHEMA}.fee_history_partitioned FOR VALUES FROM ('{start}') TO ('{end}')"))
+        partitions += 1
+        start = end
+
+    for table in ('fee_history_plain', 'fee_history_partitioned'):
+        connection.execute(text(
+            f"INSERT INTO {SCHEMA}.{table} SELECT 'FEEHIST-' || g, 'CLIENT-' || (g % :clients), 'ISSUER-1', 'FEE-' || (g % :fees), "
+            f"CAST(:first AS date) + (g % :days), 1, 10.00, now(), now() FROM generate_series(1, :rows) g"
+        ), {'clients': clients, 'fees': fees, 'first': first, 'days': days, 'rows': rows})
+        connection.execute(text(f'CREATE INDEX ON {SCHEMA}.{table} (client_id, fee_id, charge_date)'))
+        connection.execute(text(f'ANALYZE {SCHEMA}.{table}'))
+    return partitions
+
+def lookups(table, client_ids, period):
+    year_start, next_year = period_start(period, 'year'), next_period(period_start(period, 'year'), 'year')
+    month_start, next_month = period_start(period, 'month'), next_period(period_start(period, 'month'), 'month')
+    clients = ', '.join(f"'{client_id}'" for client_id in client_ids)
+    source = f'{SCHEMA}.{table}'
+    return {
+        'eligibility, one OR query': (
+            f"SELECT DISTINCT client_id, fee_id FROM {source} WHERE client_id IN ({clients}) AND fee_id IN ('FEE-0', 'FEE-1', 'FEE-2') "
+            f"AND (fee_id = 'FEE-0' OR (charge_date >= '{year_start}' AND charge_date < '{next_year}'))",),
+        'eligibility, split queries': (
+            f"SELECT DISTINCT client_id, fee_id FROM {source} WHERE client_id IN ({clients}) AND fee_id IN ('FEE-0')",
+            f"SELECT DISTINCT client_id, fee_id FROM {source} WHERE client_id IN ({clients}) "
+            f"AND ((fee_id IN ('FEE-1') AND charge_date >= '{year_start}' AND charge_date < '{next_year}') "
+            f"OR (fee_id IN ('FEE-2') AND charge_date >= '{month_start}' AND charge_date < '{next_month}'))"),
+        'yearly check': (
+            f"SELECT 1 FROM {source} WHERE client_id = '{client_ids[0]}' AND fee_id = 'FEE-1' "
+            f"AND charge_date >= '{year_start}' AND charge_date < '{next_year}' LIMIT 1",),
+        'monthly check': (
+            f"SELECT 1 FROM {source} WHERE client_id = '{client_ids[0]}' AND fee_id = 'FEE-2' "
+            f"AND charge_date >= '{month_start}' AND charge_date < '{next_month}' LIMIT 1",),
+    }
+
+def relations(plan):
+    found = {plan['Relation Name']} if 'Relation Name' in plan else set()
+    for child in plan.get('Plans', ()):
+        found |= relations(child)
+    return found
+
+def measure(connection, statements, repeat):
+    times, scanned = [], set()
+    for _ in range(repeat):
+        elapsed = 0.0
+        for statement in statements:
+            result = connection.execute(text('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement)).scalar()
+            result = (json.loads(result) if isinstance(result, str) else result)[0]
+            elapsed += result['Planning Time'] + result['Execution Time']
+            scanned |= relations(result['Plan'])
+        times.append(elapsed)
+    return statistics.median(times), len(scanned)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='A Postgres database to create the scratch schema in.')
+    parser.add_argument('--rows', type=int, default=20000000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--fees', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=50, help='Clients per eligibility lookup.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help=f'Keep the {SCHEMA} schema afterwards.')
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    if engine.dialect.name != 'postgresql':
+        parser.error('--database-url must point at Postgres')
+    today = date.today()
+    first = today.replace(year=today.year - args.years + 1, month=1, day=1)
+    days = (today - first).days + 1
+    try:
+        with engine.begin() as connection:
+            print(f'Loading {args.rows:,} rows twice ...')
+            partitions = build(connection, args.rows, args.clients, args.fees, first, days)
+            print(f'{partitions} monthly partitions')
+        client_ids = [f'CLIENT-{i}' for i in range(args.batch)]
+        with engine.connect() as connection:
+            plain = lookups('fee_history_plain', client_ids, today)
+            partitioned = lookups('fee_history_partitioned', client_ids, today)
+            print(f"{'':28} {'plain ms':>10} {'partitioned ms':>15} {'partitions read':>16}")
+            for name in plain:
+                plain_ms, _ = measure(connection, plain[name], args.repeat)
+                partitioned_ms, read = measure(connection, partitioned[name], args.repeat)
+                print(f'{name:28} {plain_ms:10.2f} {partitioned_ms:15.2f} {read:>9} of {partitions}')
+    finally:
+        if not args.keep:
+            with engine.begin() as connection:
+                connection.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        engine.dispose()
+
+if __name__ == '__main__':
+    main()
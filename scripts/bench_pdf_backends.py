@@ -0,0 +1,114 @@
+"""Compare PDF renderer backends on a 1-line and a 500-line invoice.
+
+Each backend runs in a fresh Python process, so the resident set sizes don't mix. The
+invoices are built in memory; no database is needed. Reported per backend and invoice:
+the first render (cold start), then min and median over `--repeat` renders, the process's
+peak RSS and the peak RSS of any child process (wkhtmltopdf).
+
+    python scripts/bench_pdf_backends.py --backends pdfkit,native --repeat 20
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SIZES = (1, 500)
+
+def sample_invoice(lines):
+    from models import Client, FeeMaster, Invoice, InvoiceLineItem
+    client = Client(client_id='BENCH', client_name='Benchmark Client Pvt Ltd', client_address='12 MG Road, Bangalore 560001',
+                    client_gstin='29ABCDE1234F1Z5')
+    invoice = Invoice(invoice_id='INV-BENCH', invoice_number='INV-BENCH-0001', invoice_date=date(2026, 9, 30), client=client,
+                      tax_amount=Decimal('0.00'), taxable_amount=Decimal('0.00'), rounding_up=Decimal('0.00'),
+                      grand_total=Decimal('0.00'), invoice_amount_in_words='zero rupees')
+    for i in range(lines):
+        fee = FeeMaster(fee_id=f'FEE-{i}', fee_name=f'Card issuance fee, tier {i % 7 + 1}', hsn_code='998599')
+        total = Decimal(100 + i) * 3
+        invoice.line_items.append(InvoiceLineItem(fee=fee, units=3, unit_price=Decimal(100 + i), total=total,
+                                                  gst_amount=total * Decimal('0.18'), final_amount=total * Decimal('1.18')))
+    return invoice
+
+def run_backend(backend, repeat):
+    os.environ['PDF_RENDERER_BACKEND'] = backend
+    from wsgi import create_app
+    from html_to_pdf import render_invoice_html, get_renderer
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    results = {}
+    with app.test_request_context():
+        renderer = get_renderer()
+        for lines in SIZES:
+            html = render_invoice_html(sample_invoice(lines))
+            try:
+                started = time.perf_counter()
+                pdf = renderer.render(html)
+                first = time.perf_counter() - started
+                times = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    renderer.render(html)
+                    times.append(time.perf_counter() - started)
+            except Exception as e:
+                results[lines] = {'error': f'{type(e).__name__}: {str(e).splitlines()[0]}'}
+                continue
+            results[lines] = {
+                'first_ms': first * 1000,
+                'min_ms': min(times) * 1000,
+                'median_ms': statistics.median(times) * 1000,
+                'bytes': len(pdf),
+            }
+    # ru_maxrss is in KiB on Linux.
+    rss = {
+        'rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'child_rss_mib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+    return {str(lines): dict(result, **rss) for lines, result in results.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', default='pdfkit,native')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(run_backend(args.worker, args.repeat), sys.stdout)
+        return 0
+
+    results = {}
+    for backend in args.backends.split(','):
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', backend, '--repeat', str(args.repeat)],
+                                   capture_output=True, text=True)
+        if completed.returncode != 0:
+            results[backend] = {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+            continue
+        results[backend] = json.loads(completed.stdout)
+
+    print(f"{'backend':8} {'lines':>5} {'first ms':>9} {'min ms':>8} {'median ms':>9} {'KiB':>6} {'RSS MiB':>8} {'child MiB':>9}")
+    for backend, by_size in results.items():
+        if 'error' in by_size:
+            print(f'{backend:8} error: {by_size["error"]}')
+            continue
+        for lines, r in by_size.items():
+            if 'error' in r:
+                print(f'{backend:8} {lines:>5} error: {r["error"]}')
+                continue
+            print(f"{backend:8} {lines:>5} {r['first_ms']:9.1f} {r['min_ms']:8.1f} {r['median_ms']:9.1f} "
+                  f"{r['bytes'] / 1024:6.0f} {r['rss_mib']:8.1f} {r['child_rss_mib']:9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Compare the fixed-point pricing engine with the Decimal arithmetic it replaced.
+
+Generates random invoices, prices each one both ways, checks that every stored (2 dp)
+amount matches and times the two paths. No database needed:
+
+    python scripts/bench_pricing.py --invoices 20000 --seed 7
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from pricing import to_paise, from_paise, price_invoices
+
+CENT = Decimal('0.01')
+
+def legacy_price(lines):
+    # The per-object Decimal arithmetic from functions.py before the fixed-point engine.
+    line_values = []
+    invoice_amount = Decimal(0)
+    total_tax_amount = Decimal(0)
+    total_amount = Decimal(0)
+    for line in lines:
+        if line[0] == 'fee':
+            fee_amount = line[1] * line[2]
+            gst_amount = fee_amount * Decimal('0.18')
+            final_amount = fee_amount + gst_amount
+            unit_price = line[1]
+        else:
+            interchange_amt, minimum_interchange, share = line[1], line[2], line[3]
+            if interchange_amt == 0 and minimum_interchange == 0:
+                line_values.append(None)
+                continue
+            if max(interchange_amt, minimum_interchange) == interchange_amt:
+                client_share = interchange_amt / Decimal('1.18') * (Decimal(share) / 100)
+            else:
+                client_share = minimum_interchange
+            gst_amount = client_share * Decimal('0.18')
+            final_amount = client_share + gst_amount
+            fee_amount = unit_price = final_amount
+        line_values.append((unit_price, fee_amount, gst_amount, final_amount))
+        invoice_amount += fee_amount
+        total_tax_amount += gst_amount
+        total_amount += final_amount
+
+    rounded_grand_total = total_amount.quantize(Decimal('0.10'), rounding=ROUND_HALF_UP)
+    invoice_values = (invoice_amount, total_tax_amount, total_amount, total_amount - total_tax_amount,
+                      rounded_grand_total - total_amount, rounded_grand_total)
+    return line_values, invoice_values
+
+def stored(values):
+    # What a numeric(10, 2) column ends up holding.
+    if values is None:
+        return None
+    return tuple(Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP) for value in values)
+
+def best_time(func, repeat):
+    # Like timeit: best of several runs with the cyclic GC paused, so allocation-triggered
+    # collections don't decide the result.
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def random_invoices(count, rng):
+    invoices = []
+    for _ in range(count):
+        lines = []
+        for _ in range(rng.randint(1, 8)):
+            lines.append(('fee', Decimal(rng.randint(1, 500000)).scaleb(-2), rng.choice([1, 1, 1, rng.randint(1, 5000)])))
+        if rng.random() < 0.6:
+            lines.append(('interchange', Decimal(rng.randint(0, 50000000)).scaleb(-2),
+                          Decimal(rng.randint(0, 500000)).scaleb(-2), rng.choice([10, 25, 33.5, 50, 62.25, 75])))
+        invoices.append(lines)
+    return invoices
+
+def to_engine(lines):
+    specs = []
+    for line in lines:
+        if line[0] == 'fee':
+            specs.append(('fee', to_paise(line[1]), line[2]))
+        else:
+            specs.append(('interchange', to_paise(line[1]), to_paise(line[2]), line[3]))
+    return specs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per path; the best is reported.')
+    parser.add_argument('--show', type=int, default=5, help='Mismatches to print.')
+    args = parser.parse_args()
+
+    invoices = random_invoices(args.invoices, random.Random(args.seed))
+    specs = [to_engine(lines) for lines in invoices]
+
+    legacy, legacy_seconds = best_time(lambda: [legacy_price(lines) for lines in invoices], args.repeat)
+    engine, engine_seconds = best_time(lambda: price_invoices(specs), args.repeat)
+
+    mismatches = []
+    for lines, (legacy_lines, legacy_invoice), (engine_lines, engine_invoice) in zip(invoices, legacy, engine):
+        expected = ([stored(values) for values in legacy_lines], stored(legacy_invoice))
+        actual = ([None if price is None else tuple(from_paise(p) for p in price) for price in engine_lines],
+                  tuple(from_paise(p) for p in engine_invoice))
+        if expected != actual:
+            mismatches.append((lines, expected, actual))
+
+    line_count = sum(len(lines) for lines in invoices)
+    print(f'{len(invoices)} invoices, {line_count} lines')
+    print(f'decimal:     {legacy_seconds:.3f}s ({len(invoices) / legacy_seconds:,.0f} invoices/s)')
+    print(f'fixed-point: {engine_seconds:.3f}s ({len(invoices) / engine_seconds:,.0f} invoices/s)')
+    print(f'speed-up:    {legacy_seconds / engine_seconds:.2f}x')
+    print(f'mismatches:  {len(mismatches)}')
+    for lines, expected, actual in mismatches[:args.show]:
+        print(f'  {lines}\n    decimal:     {expected}\n    fixed-point: {actual}')
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Time search.search() on each backend over a large invoice table.
+
+Creates the schema in `--database-url` (which must be empty, or a previous run's with
+`--keep`), fills `--clients` clients and `--invoices` invoices with numbers like the app's
+(INV-YYYYMMDD-N), then runs a fixed set of queries -- short and long prefixes, substrings,
+client names, GSTINs, emails, no match -- through every backend that can run there:
+'trigram' needs Postgres with pg_trgm, 'memory' runs anywhere. Reported per query and
+backend: median milliseconds over `--repeat` runs. Results of the two backends are compared
+where both ran; any difference is printed and the exit status is 1.
+
+    python scripts/bench_search.py --database-url postgresql://postgres@localhost/search --invoices 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wsgi import create_app
+from config import engine_options
+from models import db, Client, Issuer, Invoice
+import search
+
+CHUNK_SIZE = 10000
+WORDS = ['Acme', 'Apex', 'Bharat', 'Cloud', 'Delta', 'Fin', 'Global', 'Infra', 'Kiran', 'Metro', 'Nova', 'Orbit',
+         'Pay', 'Prime', 'Quantum', 'Sapphire', 'Tech', 'Unity', 'Vertex', 'Zenith']
+SUFFIXES = ['Payments', 'Solutions', 'Fintech', 'Services', 'Networks', 'Pvt Ltd', 'Ltd']
+
+def fill(clients, invoices, seed):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    db.session.execute(Issuer.__table__.insert(), [{'issuer_id': 'ISSUER-BENCH-1', 'issuer_name': 'Bench Issuer'}])
+    rows = []
+    for n in range(1, clients + 1):
+        name = f'{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(SUFFIXES)} {n}'
+        rows.append({'client_id': f'CLIENT-BENCH-{n}', 'client_name': name, 'issuer_id': 'ISSUER-BENCH-1', 'client_type': 'TSP Model',
+                     'client_gstin': f'{rng.randint(1, 37):02d}{"".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ") for _ in range(5))}'
+                                     f'{rng.randint(0, 9999):04d}{rng.choice("ABCDEFGHJK")}1Z{rng.randint(0, 9)}',
+                     'client_email': f'billing{n}@{name.split()[0].lower()}{n}.example.com', 'created_at': now, 'modified_at': now})
+    db.session.execute(Client.__table__.insert(), rows)
+    first = date.today().replace(day=1) - timedelta(days=3 * 365)
+    rows = []
+    for n in range(1, invoices + 1):
+        day = first + timedelta(days=n * 3 * 365 // invoices)
+        rows.append({'invoice_id': f'INV-{day:%Y%m%d}-{n}', 'invoice_number': f'INV-{day:%Y%m%d}-{n}', 'invoice_date': day,
+                     'client_id': f'CLIENT-BENCH-{rng.randint(1, clients)}', 'invoice_amount': 1000, 'grand_total': 1180,
+                     'created_at': now, 'modified_at': now})
+        if len(rows) >= CHUNK_SIZE:
+            db.session.execute(Invoice.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Invoice.__table__.insert(), rows)
+    db.session.commit()
+
+def queries(clients, invoices):
+    sample = db.session.query(Invoice.invoice_number).order_by(Invoice.invoice_id).offset(invoices // 2).limit(1).scalar()
+    client = db.session.get(Client, f'CLIENT-BENCH-{clients // 2}')
+    return {
+        'short prefix': 'inv',
+        'year prefix': sample[:8],
+        'day prefix': sample[:13],
+        'exact number': sample,
+        'number suffix': sample.split('-')[-1],
+        'client word': 'sapphire',
+        'client name': client.client_name,
+        'gstin': client.client_gstin,
+        'email domain': client.client_email.split('@')[1][:10],
+        'no match': 'zzqqxx',
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--invoices', type=int, default=1000000)
+    parser.add_argument('--limit', type=int, default=search.DEFAULT_LIMIT)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='Leave the tables and rows in place for another run.')
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    app.config.update(SQLALCHEMY_DATABASE_URI=args.database_url, SQLALCHEMY_ENGINE_OPTIONS=engine_options(args.database_url),
+                      SQLALCHEMY_BINDS={})
+    failures = 0
+    with app.app_context():
+        db.create_all()
+        if not db.session.query(Invoice.invoice_id).first():
+            started = time.perf_counter()
+            fill(args.clients, args.invoices, args.seed)
+            if db.engine.dialect.name == 'postgresql':
+                db.session.execute(db.text('ANALYZE clients'))
+                db.session.execute(db.text('ANALYZE invoices'))
+                db.session.commit()
+            print(f'Filled {args.clients:,} clients and {args.invoices:,} invoices in {time.perf_counter() - started:.0f}s')
+        backends = ['trigram', 'memory'] if db.engine.dialect.name == 'postgresql' else ['memory']
+        try:
+            checks = queries(args.clients, args.invoices)
+            results = {}
+            print(f"{'':16} {'query':28}" + ''.join(f' {backend + " ms":>12}' for backend in backends))
+            for backend in backends:
+                app.config['SEARCH_BACKEND'] = backend
+                started = time.perf_counter()
+                search.search('warm up', args.limit)
+                if backend == 'memory':
+                    print(f'memory index loaded in {time.perf_counter() - started:.1f}s')
+            timings = {}
+            for name, query in checks.items():
+                for backend in backends:
+                    app.config['SEARCH_BACKEND'] = backend
+                    times = []
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        found = search.search(query, args.limit)
+                        times.append((time.perf_counter() - started) * 1000)
+                    timings[(name, backend)] = statistics.median(times)
+                    results[(name, backend)] = [(result['type'], result['id']) for result in found]
+                print(f'{name:16} {query[:28]:28}' + ''.join(f' {timings[(name, backend)]:12.1f}' for backend in backends))
+                if len(backends) == 2 and results[(name, 'trigram')] != results[(name, 'memory')]:
+                    failures += 1
+                    print(f'  MISMATCH trigram {results[(name, "trigram")][:5]} memory {results[(name, "memory")][:5]}')
+        finally:
+            if not args.keep:
+                db.session.rollback()
+                db.drop_all()
+            db.session.remove()
+            db.engine.dispose()
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Time the billing and rendering hot paths at several data sizes.
+
+For each scale the database is rebuilt with scripts/generate_data.py, then every hot path
+is run `--repeat` times. Wall time, SQL statement count and peak Python memory are
+recorded and written to JSON. Pass `--compare` with an earlier result file to flag
+regressions; the exit status is 1 if there are any.
+
+    python scripts/bench_suite.py --scales small,medium --output bench.json
+    python scripts/bench_suite.py --scales small,medium --compare bench.json
+
+By default each scale uses a temporary SQLite file. `--database-url` points the suite at
+another database, e.g. a scratch Postgres. Every table in it is dropped and recreated.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from wsgi import create_app
+from config import engine_options
+from models import db, Client, Invoice
+from functions import month_range, get_applicable_fees, get_applicable_fees_for_clients, calculate_interchange_line_item, generate_invoice_line_items, build_client_invoice
+from html_to_pdf import render_invoice_html, generate_pdf_from_html
+import reference_cache
+from reference_cache import current_biller
+from generate_data import SCALES, PASSWORD, generate
+
+class QueryCounter:
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def measure(func, repeat, queries):
+    # Timed runs first, then one more under tracemalloc (which slows everything down).
+    times = []
+    statements = None
+    for _ in range(repeat):
+        before = queries.count
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+        statements = queries.count - before
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds_min': min(times),
+        'seconds_median': statistics.median(times),
+        'queries': statements,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+def hot_paths(app, period):
+    start, next_month = month_range(period)
+    end = next_month - date.resolution
+    client_id = db.session.query(Client.client_id).order_by(Client.client_id).first()[0]
+    client_ids = [row[0] for row in db.session.query(Client.client_id)]
+    largest = db.session.query(Invoice.invoice_id).order_by(Invoice.grand_total.desc()).first()[0]
+    smallest = db.session.query(Invoice.invoice_id).order_by(Invoice.grand_total).first()[0]
+    web = app.test_client()
+    web.post('/login', data={'username': 'admin', 'password': PASSWORD})
+
+    def applicable_fees():
+        db.session.expire_all()
+        get_applicable_fees(client_id, start, end)
+
+    def applicable_fees_all_clients():
+        db.session.expire_all()
+        get_applicable_fees_for_clients(client_ids, start, end)
+
+    def generate_invoice():
+        # What the generate_invoices route does, minus the PDF, rolled back so every run sees the same data.
+        db.session.expire_all()
+        try:
+            client = Client.query.get(client_id)
+            fees = get_applicable_fees(client_id, start, end)
+            interchange = calculate_interchange_line_item(client_id, start, end, 50)
+            line_items = generate_invoice_line_items(client_id, start, end, fees, {}, interchange)
+            db.session.add(build_client_invoice(client, current_biller(), start, line_items))
+            db.session.flush()
+        finally:
+            db.session.rollback()
+
+    def invoice_history(query_string=''):
+        def run():
+            response = web.get(f'/invoice-history{query_string}')
+            if response.status_code != 200:
+                raise RuntimeError(f'/invoice-history{query_string} returned {response.status_code}')
+        return run
+
+    def pdf(invoice_id):
+        def run():
+            db.session.expire_all()
+            generate_pdf_from_html(render_invoice_html(Invoice.query.get(invoice_id)))
+        return run
+
+    def revenue_dashboard():
+        response = web.get('/revenue')
+        if response.status_code != 200:
+            raise RuntimeError(f'/revenue returned {response.status_code}')
+
+    return {
+        'get_applicable_fees': applicable_fees,
+        'get_applicable_fees_for_clients': applicable_fees_all_clients,
+        'generate_invoices': generate_invoice,
+        'invoice_history': invoice_history(),
+        'invoice_history_client_filter': invoice_history(f'?client_id={client_id}'),
+        'revenue_dashboard': revenue_dashboard,
+        'generate_pdf_from_html_small': pdf(smallest),
+        'generate_pdf_from_html_large': pdf(largest),
+    }
+
+def run_scale(name, sizes, database_url, repeat, seed, period, only):
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    app.config.update(SQLALCHEMY_DATABASE_URI=database_url, SQLALCHEMY_ENGINE_OPTIONS=engine_options(database_url),
+                      SQLALCHEMY_BINDS={}, WTF_CSRF_ENABLED=False)
+    results = []
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # Every scale starts its cache versions at 0 again, so drop what the last one loaded.
+        reference_cache._entries.clear()
+        started = time.perf_counter()
+        rows = generate(until=period, seed=seed, **sizes)
+        print(f'[{name}] generated {sum(rows.values())} rows in {time.perf_counter() - started:.1f}s')
+
+        queries = QueryCounter(db.engine)
+        for path, func in hot_paths(app, period).items():
+            if only and path not in only:
+                continue
+            result = {'scale': name, 'path': path}
+            try:
+                result.update(measure(func, repeat, queries))
+            except Exception as e:
+                db.session.rollback()
+                result['error'] = f'{type(e).__name__}: {e}'.splitlines()[0]
+                print(f'[{name}] {path:34} skipped: {result["error"]}')
+            else:
+                print(f'[{name}] {path:34} {result["seconds_median"] * 1000:9.1f} ms  '
+                      f'{result["queries"]:5} queries  {result["peak_kib"]:9.1f} KiB')
+            results.append(result)
+        db.session.remove()
+        db.engine.dispose()
+    return rows, results
+
+def compare(previous, results, threshold):
+    # A path regresses if it now issues more queries, or its best time grew by more than `threshold`.
+    baseline = {(r['scale'], r['path']): r for r in previous['results'] if 'error' not in r}
+    regressions = []
+    for result in results:
+        before = baseline.get((result['scale'], result['path']))
+        if before is None or 'error' in result:
+            continue
+        change = result['seconds_min'] / before['seconds_min'] - 1 if before['seconds_min'] else 0
+        flag = ''
+        if result['queries'] > before['queries'] or change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(result)
+        print(f"{result['scale']:8} {result['path']:34} {change * 100:+7.1f}% time  "
+              f"{before['queries']:>5} -> {result['queries']:<5} queries{flag}")
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='small,medium', help=f'Comma-separated, from: {", ".join(SCALES)}.')
+    parser.add_argument('--database-url', help='Database to rebuild for every scale (default: a temporary SQLite file).')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--period', type=date.fromisoformat, default=date.today().replace(day=1),
+                        help='Month being billed; history ends the month before.')
+    parser.add_argument('--only', help='Comma-separated hot paths to run.')
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before flagging, as a fraction.')
+    args = parser.parse_args()
+
+    scales = [name.strip() for name in args.scales.split(',') if name.strip()]
+    unknown = [name for name in scales if name not in SCALES]
+    if unknown:
+        parser.error(f'unknown scale(s): {", ".join(unknown)}')
+    only = set(args.only.split(',')) if args.only else None
+    period = args.period.replace(day=1)
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'period': period.isoformat(),
+        'repeat': args.repeat,
+        'scales': {},
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in scales:
+            database_url = args.database_url or f'sqlite:///{os.path.join(tmp, name + ".db")}'
+            report['database'] = database_url.split(':', 1)[0]
+            rows, results = run_scale(name, SCALES[name], database_url, args.repeat, args.seed, period, only)
+            report['scales'][name] = {'sizes': SCALES[name], 'rows': rows}
+            report['results'].extend(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(previous, report['results'], args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""EXPLAIN the billing hot-path queries and fail if any of them falls back to a full table scan.
+
+Run against a seeded database, e.g.:
+
+    FLASK_CONFIG=testing python scripts/check_query_plans.py
+"""
+import os
+import re
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wsgi import app
+from models import db, Client, ClientProductFeeMapping, FeeMaster, FeeHistory, InterchangeFee, Invoice, InvoiceLineItem
+from sqlalchemy import and_, or_
+
+def hot_queries(client_id, client_email, invoice_id, period_start, period_end):
+    return {
+        'mappings by client and period': db.session.query(ClientProductFeeMapping.client_id, FeeMaster).join(
+            FeeMaster, FeeMaster.fee_id == ClientProductFeeMapping.fee_id
+        ).filter(
+            ClientProductFeeMapping.client_id.in_([client_id]),
+            ClientProductFeeMapping.start_date <= period_end,
+            ClientProductFeeMapping.end_date >= period_start
+        ),
+        'fee history by client, fee and charge date': db.session.query(FeeHistory.client_id, FeeHistory.fee_id, FeeHistory.charge_date).filter(
+            FeeHistory.client_id.in_([client_id]),
+            FeeHistory.fee_id.in_(['FEE-1']),
+            FeeHistory.charge_date >= period_start.replace(month=1),
+            FeeHistory.charge_date < period_start.replace(year=period_start.year + 1, month=1)
+        ),
+        'interchange fee by client and period': InterchangeFee.query.filter_by(
+            client_id=client_id, start_date=period_start, end_date=period_end
+        ).order_by(InterchangeFee.charge_date.desc()).limit(1),
+        'invoice history page': Invoice.query.order_by(Invoice.invoice_date.desc(), Invoice.invoice_id.desc()).limit(50),
+        'invoice history page by client': Invoice.query.filter(
+            Invoice.client_id == client_id,
+            or_(Invoice.invoice_date < period_end, and_(Invoice.invoice_date == period_end, Invoice.invoice_id < 'INV-'))
+        ).order_by(Invoice.invoice_date.desc(), Invoice.invoice_id.desc()).limit(50),
+        'line items by invoice': InvoiceLineItem.query.filter(InvoiceLineItem.invoice_id == invoice_id),
+        'client by email': Client.query.filter(Client.client_email == client_email).limit(1),
+    }
+
+def explain(query):
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(db.text(prefix + sql)).fetchall()
+    return [' '.join(str(column) for column in row) for row in rows]
+
+def is_full_scan(plan_line, dialect_name):
+    if dialect_name == 'sqlite':
+        # "SCAN invoices" is a full scan; "SCAN invoices USING INDEX ..." walks an index.
+        match = re.search(r'\bSCAN (\S+)(.*)', plan_line)
+        return bool(match) and match.group(1) != 'CONSTANT' and 'USING' not in match.group(2)
+    return 'Seq Scan' in plan_line
+
+def main():
+    failures = []
+    with app.app_context():
+        dialect_name = db.engine.dialect.name
+        if dialect_name == 'postgresql':
+            # Small seeded tables make a seq scan the cheapest plan; force the planner to
+            # show whether a usable index exists at all.
+            db.session.execute(db.text('SET enable_seqscan = off'))
+
+        client = Client.query.first()
+        invoice = Invoice.query.first()
+        queries = hot_queries(
+            client.client_id if client else 'CLIENT-1',
+            client.client_email if client else 'client@example.com',
+            invoice.invoice_id if invoice else 'INV-1',
+            date.today().replace(day=1),
+            date.today()
+        )
+
+        for name, query in queries.items():
+            plan = explain(query)
+            scans = [line for line in plan if is_full_scan(line, dialect_name)]
+            print(f"{'FAIL' if scans else 'ok  '} {name}")
+            for line in plan:
+                print(f'       {line}')
+            if scans:
+                failures.append(name)
+
+    if failures:
+        print(f'\n{len(failures)} hot queries use a full table scan: {", ".join(failures)}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Check that read-only routes use the replica and fall back to the primary when it's down.
+
+Needs a primary and a replica, e.g. two local Postgres instances or a primary plus a
+streaming standby, with an admin user on both:
+
+    DEV_DATABASE_URL=postgresql://localhost:5432/invoices \\
+    DEV_REPLICA_DATABASE_URL=postgresql://localhost:5433/invoices \\
+    python scripts/check_replica_routing.py --username admin --password ...
+"""
+import argparse
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from wsgi import create_app
+from models import db
+import replica
+
+READ_ONLY_PATHS = ['/invoice-history', '/invoice-history?per_page=5', '/export/invoices?format=csv']
+UNREACHABLE = 'postgresql://127.0.0.1:1/unreachable'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--unreachable-url', default=UNREACHABLE, help='Replica URL that refuses connections.')
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    app.config['WTF_CSRF_ENABLED'] = False
+    if not app.config.get('SQLALCHEMY_BINDS', {}).get('replica'):
+        sys.exit('No replica configured (SQLALCHEMY_BINDS["replica"]).')
+
+    statements = Counter()
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count(conn, *_):
+        statements[str(conn.engine.url)] += 1
+
+    failures = []
+    with app.app_context():
+        primary_url = str(db.get_engine(app).url)
+        replica_url = str(db.get_engine(app, bind='replica').url)
+
+    web = app.test_client()
+    web.post('/login', data={'username': args.username, 'password': args.password})
+    for path in READ_ONLY_PATHS:
+        statements.clear()
+        status = web.get(path).status_code
+        print(f'{path:35} {status}  primary={statements[primary_url]} replica={statements[replica_url]}')
+        if status != 200 or not statements[replica_url]:
+            failures.append(f'{path} did not read from the replica')
+
+    # Point the replica at a dead address: the request must still succeed, on the primary.
+    app.config['SQLALCHEMY_BINDS'] = dict(app.config['SQLALCHEMY_BINDS'], replica=args.unreachable_url)
+    replica._replica_down_until = 0.0
+    for attempt in ('first request after outage', 'while marked down'):
+        statements.clear()
+        status = web.get('/invoice-history').status_code
+        print(f'{attempt:35} {status}  primary={statements[primary_url]} replica marked down={replica._replica_down_until > 0}')
+        if status != 200 or not statements[primary_url]:
+            failures.append(f'/invoice-history did not fall back to the primary ({attempt})')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Fill a database with seeded, synthetic billing data.
+
+Creates issuers, products, a fee catalogue, clients with fee mappings and `--months`
+of fee history, interchange fees and invoices ending the month before `--until`, and
+the revenue summaries of those invoices.
+The same seed and options always produce the same rows. Works on SQLite and Postgres:
+
+    python scripts/generate_data.py --database-url sqlite:////tmp/bench.db --reset --scale medium
+    python scripts/generate_data.py --database-url postgresql://.../bench --reset --clients 20000 --months 36
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from wsgi import create_app
+from config import engine_options
+from models import db, User, Biller, Issuer, Client, Product, FeeMaster, ClientProductFeeMapping, InterchangeFee, Invoice, InvoiceLineItem, FeeHistory
+from functions import month_range
+from ids import financial_year
+from pricing import to_paise, from_paise, fee_line_units, interchange_line_units, line_price, invoice_price
+from num2words import num2words
+from revenue import rebuild_revenue
+
+SCALES = {
+    'small': {'issuers': 2, 'clients': 50, 'products': 2, 'months': 12},
+    'medium': {'issuers': 5, 'clients': 500, 'products': 3, 'months': 24},
+    'large': {'issuers': 10, 'clients': 5000, 'products': 4, 'months': 36},
+}
+
+# fee_id, name, type, frequency, price range in rupees, units range for Dynamic fees
+FEE_CATALOGUE = [
+    ('FEE-SYN-1', 'Platform Fee', 'Static', 'Monthly', (500, 5000), None),
+    ('FEE-SYN-2', 'Card Issuance', 'Dynamic', 'Monthly', (1, 25), (10, 5000)),
+    ('FEE-SYN-3', 'Transaction Processing', 'Dynamic', 'Monthly', (0.1, 2), (1000, 200000)),
+    ('FEE-SYN-4', 'Setup Fee', 'Static', 'One-time', (10000, 100000), None),
+    ('FEE-SYN-5', 'Annual Maintenance', 'Static', 'Yearly', (5000, 50000), None),
+    ('FEE-SYN-6', 'KYC Checks', 'Dynamic', 'Monthly', (5, 40), (10, 2000)),
+    ('FEE-SYN-7', 'Support Retainer', 'Static', 'Monthly', (1000, 10000), None),
+    ('FEE-SYN-8', 'Compliance Audit', 'Static', 'Yearly', (20000, 80000), None),
+]
+SHARE_PERCENTAGE = 50
+CHUNK_SIZE = 5000
+PASSWORD = 'password1'
+
+class _Writer:
+    # Buffers rows per table and writes them with executemany in CHUNK_SIZE batches. Once any
+    # buffer fills, every table is flushed, parents first, so foreign keys hold on Postgres.
+
+    def __init__(self):
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, model, row):
+        table = model.__table__
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= CHUNK_SIZE:
+            self.flush()
+
+    def _flush(self, table):
+        rows = self.buffers.get(table)
+        if rows:
+            db.session.execute(table.insert(), rows)
+            self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+            self.buffers[table] = []
+
+    def flush(self):
+        for table in db.metadata.sorted_tables:
+            self._flush(table)
+
+def _months(until, count):
+    first = until
+    for _ in range(count):
+        first = (first.replace(day=1) - date.resolution).replace(day=1)
+    months = []
+    day = first
+    while day < until:
+        months.append(day)
+        day = month_range(day)[1]
+    return months
+
+def _price(rng, low, high):
+    return from_paise(rng.randint(int(low * 100), int(high * 100)))
+
+def generate(issuers=2, clients=50, products=2, months=12, until=None, seed=1, progress=None):
+    """Insert the synthetic data set into the current app's database and return row counts."""
+    rng = random.Random(seed)
+    until = (until or date.today()).replace(day=1)
+    history = _months(until, months)
+    first_month = history[0] if history else until
+    stamp = first_month.strftime('%Y%m%d')
+    writer = _Writer()
+    invoice_numbers = {}
+    invoice_seq = fee_history_seq = 0
+
+    writer.add(Biller, {'biller_id': 'BILLER-SYN-1', 'biller_name': 'Synthetic Biller Pvt Ltd', 'biller_address': '1 Bench Street, Bengaluru',
+                        'biller_gstin': '29AAAAA0000A1Z5', 'biller_email': 'billing@example.com', 'biller_contact': '+91 80 0000 0000'})
+    writer.add(User, {'user_id': f'USER-{stamp}-1', 'username': 'admin', 'password': generate_password_hash(PASSWORD), 'role': 'admin'})
+    for fee_id, name, fee_type, frequency, _, _ in FEE_CATALOGUE:
+        writer.add(FeeMaster, {'fee_id': fee_id, 'fee_name': name, 'fee_type': fee_type, 'fee_frequency': frequency, 'hsn_code': '998314'})
+
+    issuer_ids = [f'ISSUER-{stamp}-{n}' for n in range(1, issuers + 1)]
+    product_ids = {}
+    for n, issuer_id in enumerate(issuer_ids, start=1):
+        writer.add(Issuer, {'issuer_id': issuer_id, 'issuer_name': f'Issuer Bank {n}'})
+        product_ids[issuer_id] = []
+        for p in range(products):
+            product_id = f'PROD-{stamp}-{(n - 1) * products + p + 1}'
+            product_ids[issuer_id].append(product_id)
+            writer.add(Product, {'product_id': product_id, 'product_name': f'Card Program {n}.{p + 1}', 'issuer_id': issuer_id})
+
+    mapping_end = until.replace(year=until.year + 1)
+    for n in range(1, clients + 1):
+        client_id = f'CLIENT-{stamp}-{n}'
+        issuer_id = issuer_ids[(n - 1) % len(issuer_ids)]
+        writer.add(Client, {'client_id': client_id, 'client_name': f'Client {n}', 'issuer_id': issuer_id,
+                            'client_address': f'{n} Market Road', 'client_gstin': f'29CLNT{n:05d}Z5'[:15],
+                            'client_email': f'client{n}@example.com', 'client_contact': f'+91 90000 {n:05d}'[:20],
+                            'client_type': rng.choice(['TSP Model', 'Program Manager Model'])})
+        if n <= 10:
+            writer.add(User, {'user_id': f'USER-{stamp}-{n + 1}', 'username': f'client{n}@example.com',
+                              'password': generate_password_hash(PASSWORD), 'role': 'user'})
+
+        # Clients join at different points of the history window.
+        joined = rng.randrange(len(history)) if history and rng.random() < 0.5 else 0
+        start = history[joined] if history else until
+        fees = [fee for fee in FEE_CATALOGUE if fee[2] == 'Static' and fee[3] == 'Monthly'][:1]
+        fees += rng.sample([fee for fee in FEE_CATALOGUE if fee not in fees], rng.randint(2, 5))
+        client_fees = []
+        for fee_id, _, fee_type, frequency, price_range, units_range in fees:
+            unit_price = _price(rng, *price_range)
+            client_fees.append((fee_id, frequency, unit_price, units_range))
+            writer.add(ClientProductFeeMapping, {'client_id': client_id, 'product_id': rng.choice(product_ids[issuer_id]), 'fee_id': fee_id,
+                                                 'unit_price': unit_price, 'start_date': start, 'end_date': mapping_end})
+
+        for month in history[joined:]:
+            month_end = month_range(month)[1] - date.resolution
+            invoice_date = month_range(month)[1]
+            interchange_amt = _price(rng, 0, 200000)
+            minimum_interchange = _price(rng, 0, 5000)
+            writer.add(InterchangeFee, {'fee_name': 'Interchange', 'client_id': client_id, 'start_date': month, 'end_date': month_end,
+                                        'interchange_amt': interchange_amt, 'minimum_interchange': minimum_interchange, 'charge_date': month})
+
+            invoice_seq += 1
+            invoice_id = f'INV-{invoice_date.strftime("%Y%m%d")}-{invoice_seq}'
+            fy = financial_year(invoice_date)
+            invoice_numbers[fy] = invoice_numbers.get(fy, 0) + 1
+            lines, units = [], []
+            for fee_id, frequency, unit_price, units_range in client_fees:
+                if frequency == 'One-time' and month != history[joined]:
+                    continue
+                if frequency == 'Yearly' and month.month != 4 and month != history[joined]:
+                    continue
+                fee_units = rng.randint(*units_range) if units_range else 1
+                line_units = fee_line_units(to_paise(unit_price), fee_units)
+                price = line_price(line_units, to_paise(unit_price))
+                units.append(line_units)
+                lines.append({'invoice_id': invoice_id, 'invoice_date': invoice_date, 'fee_id': fee_id, 'units': fee_units, 'unit_price': unit_price,
+                              'total': from_paise(price.total), 'gst_amount': from_paise(price.gst_amount),
+                              'final_amount': from_paise(price.final_amount), 'description': None})
+                fee_history_seq += 1
+                writer.add(FeeHistory, {'fee_history_id': f'FEEHIST-{stamp}-{fee_history_seq}', 'client_id': client_id, 'issuer_id': issuer_id,
+                                        'fee_id': fee_id, 'charge_date': month, 'units': fee_units, 'total': from_paise(price.total)})
+
+            line_units = interchange_line_units(to_paise(interchange_amt), to_paise(minimum_interchange), SHARE_PERCENTAGE)
+            if line_units is not None:
+                price = line_price(line_units)
+                units.append(line_units)
+                lines.append({'invoice_id': invoice_id, 'invoice_date': invoice_date, 'fee_id': None, 'units': 1, 'unit_price': from_paise(price.unit_price),
+                              'total': from_paise(price.total), 'gst_amount': from_paise(price.gst_amount),
+                              'final_amount': from_paise(price.final_amount), 'description': f"Interchange Fee ({month.strftime('%B %Y')})"})
+
+            totals = invoice_price(units)
+            writer.add(Invoice, {'invoice_id': invoice_id, 'biller_id': 'BILLER-SYN-1', 'client_id': client_id, 'issuer_id': issuer_id,
+                                 'invoice_number': f'INV-{invoice_date.strftime("%Y%m%d")}-{invoice_numbers[fy]}', 'invoice_date': invoice_date,
+                                 'invoice_amount': from_paise(totals.invoice_amount), 'tax_rate': 18, 'tax_amount': from_paise(totals.tax_amount),
+                                 'total_amount': from_paise(totals.total_amount), 'invoice_type': 'client', 'invoice_month': month,
+                                 'charge_date': invoice_date, 'taxable_amount': from_paise(totals.taxable_amount),
+                                 'rounding_up': from_paise(totals.rounding_up), 'grand_total': from_paise(totals.grand_total),
+                                 'invoice_amount_in_words': num2words(from_paise(totals.grand_total), lang='en_IN', to='currency', currency='INR')})
+            for line in lines:
+                writer.add(InvoiceLineItem, line)
+
+        if progress and n % 1000 == 0:
+            progress(f'{n}/{clients} clients')
+
+    writer.flush()
+    db.session.commit()
+    # Invoices were written directly, so the revenue summaries are computed in one pass.
+    writer.counts.update(rebuild_revenue())
+    return writer.counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='Target database (default: the FLASK_CONFIG database).')
+    parser.add_argument('--reset', action='store_true', help='Drop and recreate all tables first.')
+    parser.add_argument('--scale', choices=list(SCALES), default='small', help='Preset sizes; the options below override it.')
+    parser.add_argument('--issuers', type=int)
+    parser.add_argument('--clients', type=int)
+    parser.add_argument('--products', type=int, help='Products per issuer.')
+    parser.add_argument('--months', type=int, help='Months of invoice and fee history.')
+    parser.add_argument('--until', type=date.fromisoformat, help='History ends the month before this date (default: today).')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    if args.database_url:
+        app.config.update(SQLALCHEMY_DATABASE_URI=args.database_url, SQLALCHEMY_ENGINE_OPTIONS=engine_options(args.database_url))
+    sizes = dict(SCALES[args.scale])
+    sizes.update({name: getattr(args, name) for name in sizes if getattr(args, name) is not None})
+
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            db.create_all()
+        started = time.perf_counter()
+        counts = generate(until=args.until, seed=args.seed, progress=print, **sizes)
+        elapsed = time.perf_counter() - started
+
+    for table, count in sorted(counts.items()):
+        print(f'{table:28} {count:>10}')
+    print(f'{sum(counts.values())} rows in {elapsed:.1f}s. Log in as admin / {PASSWORD}.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wsgi import create_app
+from config import engine_options
+from models import db, Biller, Issuer, Product, FeeMaster, Client, ClientProductFeeMapping, User
+from werkzeug.security import generate_password_hash
+import mapping_index
+import reference_cache
+import search
+import user_cache
+
+PASSWORD = 'test-password'
+
+def settings(path):
+    url = f'sqlite:///{path / "test.db"}'
+    return {
+        'SQLALCHEMY_DATABASE_URI': url,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options(url),
+        'SQLALCHEMY_BINDS': {},
+        'WTF_CSRF_ENABLED': False,
+        'PDF_RENDERER_BACKEND': 'native',
+        'PDF_CACHE_DIR': str(path / 'pdf_cache'),
+        'INVOICE_PDF_DIR': str(path / 'invoices'),
+        'ARCHIVE_DIR': str(path / 'archive'),
+        'JOBS_RUN_INLINE': True,
+    }
+
+@pytest.fixture(scope='session')
+def schema(tmp_path_factory):
+    # Creating the tables takes seconds on SQLite (one commit per DDL statement); do it
+    # once and copy the file for each test.
+    path = tmp_path_factory.mktemp('schema')
+    app = create_app('testing', settings(path))
+    with app.app_context():
+        db.create_all()
+        db.engine.dispose()
+    return path / 'test.db'
+
+@pytest.fixture
+def app(tmp_path, schema):
+    # A fresh SQLite database per test; per-process caches start empty.
+    shutil.copy(schema, tmp_path / 'test.db')
+    app = create_app('testing', settings(tmp_path))
+    reference_cache._entries.clear()
+    user_cache._entries.clear()
+    mapping_index._index = mapping_index.MappingIndex()
+    search._memory_index = search.MemorySearchIndex()
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def billing_data(app):
+    # One biller and issuer, fees of every frequency, and clients C0..C4 mapped to all of
+    # them for 2026.
+    db.session.add(Biller(biller_id='B1', biller_name='Biller'))
+    db.session.add(Issuer(issuer_id='I1', issuer_name='Issuer'))
+    db.session.add(Product(product_id='P1', product_name='Product', issuer_id='I1'))
+    fees = [
+        FeeMaster(fee_id='F1', fee_name='Platform', fee_type='Static', fee_frequency='Monthly'),
+        FeeMaster(fee_id='F2', fee_name='Cards', fee_type='Dynamic', fee_frequency='Monthly'),
+        FeeMaster(fee_id='F3', fee_name='Setup', fee_type='Static', fee_frequency='One-time'),
+        FeeMaster(fee_id='F4', fee_name='AMC', fee_type='Static', fee_frequency='Yearly'),
+    ]
+    db.session.add_all(fees)
+    prices = {'F1': 1000, 'F2': 2.5, 'F3': 5000, 'F4': 1200}
+    clients = []
+    for n in range(5):
+        client = Client(client_id=f'C{n}', client_name=f'Client {n}', issuer_id='I1', client_type='TSP Model',
+                        client_gstin=f'29ABCDE{n:04d}F1Z5', client_email=f'billing{n}@client{n}.example.com')
+        clients.append(client)
+        db.session.add(client)
+        for fee_id, price in prices.items():
+            db.session.add(ClientProductFeeMapping(client_id=client.client_id, product_id='P1', fee_id=fee_id, unit_price=price,
+                                                   start_date=date(2026, 1, 1), end_date=date(2026, 12, 31)))
+    db.session.add(User(user_id='U1', username='admin', password=generate_password_hash(PASSWORD), role='admin'))
+    db.session.add(User(user_id='U2', username='user', password=generate_password_hash(PASSWORD), role='user'))
+    db.session.commit()
+    return clients
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def login(client, username):
+    return client.post('/login', data={'username': username, 'password': PASSWORD})
@@ -0,0 +1,84 @@
+import os
+from datetime import date
+
+import pytest
+
+from conftest import login
+from archive import archive_year, archived_invoice, invoice_archive
+from billing import run_billing
+from functions import get_applicable_fees_for_clients, fee_already_charged, fee_already_charged_yearly
+from jobs import Worker
+from models import db, Invoice, InvoiceLineItem, FeeHistory, ArchivedInvoice, ArchivedFeeCharge
+
+YEAR = '2026-27'
+AFTER_YEAR = date(2027, 4, 1)
+
+CLIENT_IDS = [f'C{n}' for n in range(5)]
+
+def applicable(start_date, end_date):
+    fees = get_applicable_fees_for_clients(CLIENT_IDS, start_date, end_date)
+    return {client_id: sorted(fee.fee_id for fee, _ in pairs) for client_id, pairs in fees.items()}
+
+@pytest.fixture
+def invoices(app, billing_data):
+    # October 2026 billed for every client, dated inside YEAR whatever today is, with stored PDFs.
+    run_billing(app, '2026-10')
+    for model in (Invoice, InvoiceLineItem):
+        model.query.update({model.invoice_date: date(2026, 10, 20)}, synchronize_session=False)
+    db.session.commit()
+    Worker(app, concurrency=1, poll_interval=0).run(once=True)
+    return Invoice.query.order_by(Invoice.client_id).all()
+
+def test_archived_invoices_can_be_viewed_and_downloaded(app, client, invoices):
+    invoice = invoices[0]
+    invoice_id, pdf = invoice.invoice_id, open(os.path.join(app.config['INVOICE_PDF_DIR'], invoice.pdf_path), 'rb').read()
+    lines = sorted((line.fee_id or '', line.units, line.final_amount) for line in invoice.line_items)
+
+    assert archive_year(YEAR, today=AFTER_YEAR)['invoices'] == len(invoices)
+    db.session.expire_all()
+    assert Invoice.query.count() == 0 and InvoiceLineItem.query.count() == 0
+    assert ArchivedInvoice.query.get(invoice_id).archive_file == f'{YEAR}/invoices-2026-10.jsonl.gz'
+
+    copy = archived_invoice(invoice_id)
+    assert sorted((line.fee_id or '', line.units, line.final_amount) for line in copy.line_items) == lines
+    assert copy.client.client_id == 'C0' and copy not in db.session
+
+    login(client, 'admin')
+    response = client.get(f'/view-invoice/{invoice_id}')
+    assert (response.status_code, response.mimetype, response.data) == (200, 'application/pdf', pdf)
+    response = client.get(f'/download-invoice/{invoice_id}')
+    assert response.status_code == 200 and response.data == pdf
+    assert response.headers['Content-Disposition'].startswith('attachment')
+
+def test_verify_finds_tampered_and_missing_files(app, invoices):
+    invoice_id = invoices[0].invoice_id
+    archive_year(YEAR, today=AFTER_YEAR)
+    assert invoice_archive.verify(YEAR) == []
+
+    month_file = invoice_archive.path(f'{YEAR}/invoices-2026-10.jsonl.gz')
+    with open(month_file, 'r+b') as f:
+        f.seek(30)
+        byte = f.read(1)
+        f.seek(30)
+        f.write(bytes([byte[0] ^ 0xff]))
+    os.remove(invoice_archive.path(f'{YEAR}/fee_history.jsonl.gz'))
+
+    problems = dict(invoice_archive.verify(YEAR))
+    assert problems.keys() == {f'{YEAR}/invoices-2026-10.jsonl.gz', f'{YEAR}/fee_history.jsonl.gz'}
+    assert 'does not match its checksum' in problems[f'{YEAR}/invoices-2026-10.jsonl.gz']
+    with pytest.raises(ValueError):
+        archived_invoice(invoice_id)
+
+def test_one_time_and_yearly_fees_stay_charged_after_archiving(app, invoices):
+    before = applicable('2026-11-01', '2026-11-30')
+    assert all('F3' not in fees and 'F4' not in fees for fees in before.values())
+
+    archive_year(YEAR, today=AFTER_YEAR)
+    assert FeeHistory.query.count() == 0
+    assert ArchivedFeeCharge.query.filter_by(client_id='C0', fee_id='F3', year=2026).one().charges == 1
+
+    # The charges now come from archived_fee_charges alone.
+    assert applicable('2026-11-01', '2026-11-30') == before
+    assert fee_already_charged('C0', 'F3')
+    assert fee_already_charged_yearly('C0', 'F4', '2026-11-01')
+    assert not fee_already_charged_yearly('C0', 'F4', '2027-01-01')
@@ -0,0 +1,80 @@
+import threading
+from datetime import date
+
+import ids
+from models import db, IdCounter, Invoice
+
+def add_invoice(number, invoice_date):
+    db.session.add(Invoice(invoice_id=number, invoice_number=number, invoice_date=invoice_date, invoice_amount=0))
+
+def test_invoice_numbers_restart_each_financial_year(app):
+    assert ids.next_invoice_number(date(2026, 3, 31)) == 'INV-20260331-1'
+    assert ids.next_invoice_number(date(2026, 3, 31)) == 'INV-20260331-2'
+    assert ids.next_invoice_number(date(2026, 4, 1)) == 'INV-20260401-1'
+    assert ids.next_invoice_number(date(2026, 1, 15)) == 'INV-20260115-3'
+    assert ids.next_invoice_number(date(2027, 3, 31)) == 'INV-20270331-2'
+    db.session.commit()
+    assert {name for name, in db.session.query(IdCounter.name)} >= {'invoice_number:2025-26', 'invoice_number:2026-27'}
+
+def test_counters_start_after_existing_rows(app):
+    add_invoice('INV-20250510-7', date(2025, 5, 10))
+    add_invoice('INV-20260102-12', date(2026, 1, 2))
+    add_invoice('INV-20250301-40', date(2025, 3, 1))
+    add_invoice('LEGACY-NUMBER', date(2025, 6, 1))
+    db.session.commit()
+
+    assert ids.next_invoice_number(date(2025, 12, 1)) == 'INV-20251201-13'
+    assert ids.next_invoice_number(date(2025, 1, 1)) == 'INV-20250101-41'
+    assert ids.next_invoice_number(date(2026, 4, 1)) == 'INV-20260401-1'
+    assert ids.next_id('invoices').endswith('-41')
+
+def test_rolled_back_numbers_are_handed_out_again(app):
+    day = date(2026, 5, 1)
+    assert ids.next_invoice_number(day) == 'INV-20260501-1'
+    db.session.commit()
+    assert ids.next_invoice_number(day) == 'INV-20260501-2'
+    assert list(ids.allocate('fee_history', 3)) == [1, 2, 3]
+    db.session.rollback()
+    assert ids.next_invoice_number(day) == 'INV-20260501-2'
+    assert list(ids.allocate('fee_history', 3)) == [1, 2, 3]
+
+def test_counter_created_by_another_process_first(app, monkeypatch):
+    # Our UPDATE finds no counter, then another process creates it before our INSERT: the
+    # IntegrityError is absorbed and we increment theirs.
+    increment = ids._increment
+    calls = []
+
+    def racing_increment(name, count):
+        if not calls:
+            calls.append(name)
+            with db.engine.begin() as connection:
+                connection.execute(IdCounter.__table__.insert().values(name=name, value=5))
+            return None
+        return increment(name, count)
+
+    monkeypatch.setattr(ids, '_increment', racing_increment)
+    assert list(ids.allocate('products', 2, seed=lambda: 100)) == [6, 7]
+    db.session.commit()
+    assert db.session.get(IdCounter, 'products').value == 7
+
+def test_concurrent_allocations_are_unique_and_gap_free(app):
+    found, errors = [], []
+
+    def allocate_some():
+        with app.app_context():
+            try:
+                for _ in range(10):
+                    found.extend(ids.allocate('clients'))
+                    db.session.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=allocate_some) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(found) == list(range(1, 41))
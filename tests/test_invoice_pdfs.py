@@ -0,0 +1,20 @@
+import os
+
+from billing import run_billing
+from jobs import Worker
+from invoice_pdfs import invoice_pdfs
+from pdf_cache import pdf_cache
+from models import Invoice
+
+def files_under(directory):
+    return [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+
+def test_stored_pdfs_are_not_cached_too(app, billing_data):
+    result = run_billing(app, '2026-10', workers=1)
+    assert result['done'] == len(billing_data)
+    Worker(app, concurrency=1, poll_interval=0).run(once=True)
+
+    invoices = Invoice.query.all()
+    assert invoices and all(invoice_pdfs.has(invoice) and invoice_pdfs.verify(invoice) for invoice in invoices)
+    assert len(files_under(invoice_pdfs.directory)) == len(invoices)
+    assert [path for path in files_under(pdf_cache.directory) if path.endswith('.pdf')] == []
@@ -0,0 +1,53 @@
+import random
+from datetime import date, timedelta
+
+from invoice_queries import keyset_page
+from models import db, Invoice, ArchivedInvoice, ArchivedYear
+
+def mixed_invoices():
+    # 60 invoices over 6 days, up to 12 on a day so that ids like -10 and -9 tie on the
+    # date, each one live or archived at random.
+    rng = random.Random(6)
+    db.session.add(ArchivedYear(financial_year='2025-26', start_date=date(2025, 4, 1), end_date=date(2026, 4, 1),
+                                manifest_sha256='0' * 64))
+    keys = []
+    for n in range(60):
+        day = date(2026, 3, 1) + timedelta(days=n % 6)
+        invoice_id = f'INV-{day:%Y%m%d}-{n // 6 + 1}'
+        values = dict(invoice_id=invoice_id, invoice_number=invoice_id, invoice_date=day, invoice_amount=100)
+        if rng.random() < 0.5:
+            db.session.add(ArchivedInvoice(financial_year='2025-26', archive_file='2025-26/invoices-2026-03.jsonl.gz', **values))
+        else:
+            db.session.add(Invoice(**values))
+        keys.append((day, invoice_id))
+    db.session.commit()
+    return sorted(keys, reverse=True)
+
+def page(per_page, after=None, before=None):
+    return keyset_page(Invoice.query, after=after, before=before, per_page=per_page, archived=ArchivedInvoice.query)
+
+def keys(result):
+    return [(invoice.invoice_date, invoice.invoice_id) for invoice in result['invoices']]
+
+def test_text_order_within_a_day(app):
+    expected = mixed_invoices()
+    first_day = [invoice_id for day, invoice_id in expected if day == date(2026, 3, 1)]
+    assert first_day.index('INV-20260301-9') < first_day.index('INV-20260301-10')
+
+def test_paging_both_ways_over_live_and_archived(app):
+    expected = mixed_invoices()
+    for per_page in (1, 7, 10, 59, 60, 100):
+        pages = [page(per_page)]
+        assert pages[0]['prev_cursor'] is None
+        while pages[-1]['next_cursor']:
+            pages.append(page(per_page, after=pages[-1]['next_cursor']))
+        assert [key for result in pages for key in keys(result)] == expected
+        assert all(len(result['invoices']) == per_page for result in pages[:-1])
+        assert pages[-1]['total'] == 60
+
+        # And back from the last page with `before`, page by page.
+        back = [pages[-1]]
+        while back[-1]['prev_cursor']:
+            back.append(page(per_page, before=back[-1]['prev_cursor']))
+        assert [keys(result) for result in back] == [keys(result) for result in reversed(pages)]
+        assert back[-1]['prev_cursor'] is None
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from jobs import enqueue, claim_jobs, run_job, dispatch, job_status, Worker
+from models import db, Job, Biller
+
+@pytest.fixture
+def handlers(monkeypatch):
+    # Test job kinds; `calls` records every run as (kind, payload).
+    calls = []
+
+    def ok(job, payload):
+        calls.append(('ok', payload))
+        return {'echo': payload}
+
+    def fails(job, payload):
+        calls.append(('fails', payload))
+        # Written before the failure, so it has to be rolled back with it.
+        db.session.add(Biller(biller_id=f'B-{job.attempts}', biller_name='Half done'))
+        raise RuntimeError('boom')
+
+    def parent(job, payload):
+        calls.append(('parent', payload))
+        child = enqueue('test_ok', {'n': payload['n'] + 1}, parent_job_id=job.job_id)
+        return {'child_job_id': child.job_id}
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'test_ok', ok)
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'test_fails', fails)
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'test_parent', parent)
+    return calls
+
+def queued(kind, payload=None, **kwargs):
+    job = enqueue(kind, payload or {}, **kwargs)
+    db.session.commit()
+    return job.job_id
+
+def expire(job_id, **values):
+    Job.query.filter_by(job_id=job_id).update(values)
+    db.session.commit()
+
+def test_running_job_is_reclaimed_when_its_lease_expires(app, handlers):
+    job_id = queued('test_ok', {'n': 1})
+    assert claim_jobs('w1', 5) == [job_id]
+    assert claim_jobs('w2', 5) == []
+
+    # w1 died: once the lease has run out, w2 gets the job and w1 can no longer run it.
+    expire(job_id, locked_until=datetime.utcnow() - timedelta(seconds=1))
+    assert claim_jobs('w2', 5) == [job_id]
+    assert run_job(job_id, 'w1') is None
+    assert run_job(job_id, 'w2') == 'done'
+
+    job = db.session.get(Job, job_id)
+    assert (job.attempts, job.locked_by, job.locked_until) == (2, 'w2', None)
+    assert job_status(job)['result'] == {'echo': {'n': 1}}
+    assert handlers == [('ok', {'n': 1})]
+
+def test_result_is_discarded_when_the_lease_is_lost_mid_job(app, monkeypatch):
+    job_id = queued('test_lost')
+
+    def lost(job, payload):
+        # Another worker reclaims the job while this one is still running it.
+        with db.engine.begin() as connection:
+            connection.execute(Job.__table__.update().where(Job.job_id == job.job_id).values(attempts=job.attempts + 1, locked_by='w2'))
+        db.session.add(Biller(biller_id='B-LOST', biller_name='Lost'))
+        return {'ok': True}
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'test_lost', lost)
+    assert claim_jobs('w1', 1) == [job_id]
+    assert run_job(job_id, 'w1') is None
+    job = db.session.get(Job, job_id)
+    assert (job.status, job.locked_by, job.result) == ('running', 'w2', None)
+    assert db.session.get(Biller, 'B-LOST') is None
+
+def test_failures_back_off_then_fail(app, handlers):
+    app.config.update(JOB_MAX_ATTEMPTS=3, JOB_RETRY_BACKOFF=10)
+    job_id = queued('test_fails')
+
+    for attempt, backoff in ((1, 10), (2, 20)):
+        started = datetime.utcnow()
+        assert claim_jobs('w1', 1) == [job_id]
+        assert run_job(job_id, 'w1') == 'queued'
+        job = db.session.get(Job, job_id)
+        assert (job.attempts, job.error, job.locked_until) == (attempt, 'RuntimeError: boom', None)
+        assert started + timedelta(seconds=backoff) <= job.run_after <= datetime.utcnow() + timedelta(seconds=backoff)
+
+        # Not due yet; then pretend the backoff has passed.
+        assert claim_jobs('w1', 1) == []
+        expire(job_id, run_after=datetime.utcnow() - timedelta(seconds=1))
+
+    assert claim_jobs('w1', 1) == [job_id]
+    assert run_job(job_id, 'w1') == 'failed'
+    job = db.session.get(Job, job_id)
+    assert job.attempts == 3 and job.finished_at is not None
+    assert claim_jobs('w1', 1) == []
+    assert len(handlers) == 3
+    assert Biller.query.count() == 0
+
+def test_unknown_kind_counts_as_a_failure(app):
+    job_id = queued('no_such_kind', max_attempts=1)
+    assert claim_jobs('w1', 1) == [job_id]
+    assert run_job(job_id, 'w1') == 'failed'
+    assert "No handler for job kind 'no_such_kind'" in db.session.get(Job, job_id).error
+
+def test_dispatch_runs_inline_with_children(app, handlers):
+    job_id = queued('test_parent', {'n': 1})
+    dispatch(db.session.get(Job, job_id))
+
+    status = job_status(db.session.get(Job, job_id))
+    assert status['status'] == 'done'
+    assert [(child['status'], child['result']) for child in status['children']] == [('done', {'echo': {'n': 2}})]
+    assert handlers == [('parent', {'n': 1}), ('ok', {'n': 2})]
+    assert all(job.locked_by.startswith('inline-') for job in Job.query.all())
+
+def test_dispatch_leaves_jobs_to_the_worker_when_not_inline(app, handlers):
+    app.config['JOBS_RUN_INLINE'] = False
+    job_id = queued('test_parent', {'n': 1})
+    dispatch(db.session.get(Job, job_id))
+    assert db.session.get(Job, job_id).status == 'queued'
+    assert handlers == []
+
+    # The worker picks up the parent, then the child it enqueued, then stops.
+    assert Worker(app, concurrency=2, poll_interval=0).run(once=True) == 2
+    db.session.expire_all()
+    assert [job.status for job in Job.query.order_by(Job.job_id)] == ['done', 'done']
+    assert handlers == [('parent', {'n': 1}), ('ok', {'n': 2})]
@@ -0,0 +1,81 @@
+import random
+from datetime import date, timedelta
+
+from mapping_index import IntervalList, MappingEntry, get_mapping_index
+from models import db, ClientProductFeeMapping
+from reference_cache import bump_reference
+
+FIRST_DAY = date(2024, 1, 1)
+CLIENTS = ['C1', 'C2', 'C3']
+FEES = ['F1', 'F2', 'F3', 'F4']
+
+def random_interval(rng):
+    # Single days, months, years and long stretches, so intervals nest, touch and overlap.
+    start = FIRST_DAY + timedelta(days=rng.randrange(3 * 365))
+    return start, start + timedelta(days=rng.choice((0, 0, 1, 30, 90, 364, 365, 1000)))
+
+def add_mappings(rng, count):
+    for _ in range(count):
+        start, end = random_interval(rng)
+        db.session.add(ClientProductFeeMapping(client_id=rng.choice(CLIENTS), product_id='P1', fee_id=rng.choice(FEES),
+                                               unit_price=rng.randint(1, 5000), start_date=start, end_date=end))
+
+def sql_overlap(client_id, start, end, fee_id=None):
+    query = db.session.query(ClientProductFeeMapping.mapping_id).filter(
+        ClientProductFeeMapping.client_id == client_id,
+        ClientProductFeeMapping.start_date <= end,
+        ClientProductFeeMapping.end_date >= start)
+    if fee_id is not None:
+        query = query.filter(ClientProductFeeMapping.fee_id == fee_id)
+    return [mapping_id for mapping_id, in query.order_by(ClientProductFeeMapping.mapping_id)]
+
+def assert_same_as_sql(rng, lookups=300):
+    index = get_mapping_index()
+    for _ in range(lookups):
+        client_id, fee_id = rng.choice(CLIENTS + ['C9']), rng.choice(FEES + [None])
+        start, end = random_interval(rng)
+        start -= timedelta(days=rng.choice((0, 400)))
+        assert [entry.mapping_id for entry in index.active(client_id, start, end, fee_id)] == \
+            sql_overlap(client_id, start, end, fee_id), (client_id, fee_id, start, end)
+    start, end = random_interval(rng)
+    assert [entry.mapping_id for entry in index.active_for_clients(CLIENTS, start, end)] == \
+        sorted(mapping_id for client_id in CLIENTS for mapping_id in sql_overlap(client_id, start, end))
+
+def test_interval_list_matches_a_scan():
+    rng = random.Random(20)
+    for size in (0, 1, 2, 3, 7, 8, 9, 50):
+        entries = [MappingEntry(n, 'C1', 'P1', 'F1', 1, *random_interval(rng)) for n in range(size)]
+        intervals = IntervalList(entries)
+        for _ in range(200):
+            start, end = random_interval(rng)
+            found = sorted(entry.mapping_id for entry in intervals.overlapping(start, end))
+            assert found == [entry.mapping_id for entry in entries if entry.start_date <= end and entry.end_date >= start]
+
+def test_lookups_match_the_sql_overlap_query(app):
+    rng = random.Random(2020)
+    add_mappings(rng, 200)
+    db.session.commit()
+    assert_same_as_sql(rng)
+
+def test_lookups_match_after_changes_and_deletes(app):
+    rng = random.Random(7)
+    add_mappings(rng, 150)
+    db.session.commit()
+    assert_same_as_sql(rng, lookups=50)
+
+    # Refreshed in place: new rows, new dates, and rows moved to another client or fee.
+    add_mappings(rng, 20)
+    for mapping in rng.sample(ClientProductFeeMapping.query.all(), 30):
+        mapping.start_date, mapping.end_date = random_interval(rng)
+        if rng.random() < 0.3:
+            mapping.client_id, mapping.fee_id = rng.choice(CLIENTS), rng.choice(FEES)
+    bump_reference('mappings')
+    db.session.commit()
+    assert_same_as_sql(rng)
+
+    # Deletes change the row count, which forces a full reload.
+    for mapping in rng.sample(ClientProductFeeMapping.query.all(), 25):
+        db.session.delete(mapping)
+    bump_reference('mappings')
+    db.session.commit()
+    assert_same_as_sql(rng)
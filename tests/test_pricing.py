@@ -0,0 +1,112 @@
+import random
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+
+from pricing import (to_paise, from_paise, fee_line_units, interchange_line_units, line_price, invoice_price,
+                     price_invoices, UNITS_PER_PAISA, HALF_PAISA)
+
+def stored(value):
+    # What a numeric(10, 2) column ends up holding, in paise.
+    return to_paise(Decimal(value).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+def legacy_price(lines):
+    # The Decimal arithmetic functions.py used before pricing.py, on the same line specs.
+    line_values = []
+    invoice_amount = total_tax_amount = total_amount = Decimal(0)
+    for line in lines:
+        if line[0] == 'fee':
+            unit_price = from_paise(line[1])
+            fee_amount = unit_price * line[2]
+            gst_amount = fee_amount * Decimal('0.18')
+            final_amount = fee_amount + gst_amount
+        else:
+            interchange_amt, minimum_interchange = from_paise(line[1]), from_paise(line[2])
+            if interchange_amt == 0 and minimum_interchange == 0:
+                line_values.append(None)
+                continue
+            if max(interchange_amt, minimum_interchange) == interchange_amt:
+                client_share = interchange_amt / Decimal('1.18') * (Decimal(line[3]) / 100)
+            else:
+                client_share = minimum_interchange
+            gst_amount = client_share * Decimal('0.18')
+            final_amount = client_share + gst_amount
+            fee_amount = unit_price = final_amount
+        line_values.append(tuple(stored(value) for value in (unit_price, fee_amount, gst_amount, final_amount)))
+        invoice_amount += fee_amount
+        total_tax_amount += gst_amount
+        total_amount += final_amount
+
+    rounded_grand_total = total_amount.quantize(Decimal('0.10'), rounding=ROUND_HALF_UP)
+    invoice_values = (invoice_amount, total_tax_amount, total_amount, total_amount - total_tax_amount,
+                      rounded_grand_total - total_amount, rounded_grand_total)
+    return line_values, tuple(stored(value) for value in invoice_values)
+
+def engine_price(lines):
+    # The per-line path functions.py takes: line_price for each line, invoice_price over their units.
+    line_values, units = [], []
+    for line in lines:
+        if line[0] == 'fee':
+            line_units = fee_line_units(line[1], line[2])
+            price = line_price(line_units, line[1])
+        else:
+            line_units = interchange_line_units(line[1], line[2], line[3])
+            if line_units is None:
+                line_values.append(None)
+                continue
+            price = line_price(line_units)
+        line_values.append(tuple(price))
+        units.append(line_units)
+    return line_values, tuple(invoice_price(units))
+
+def random_invoices(count, seed):
+    rng = random.Random(seed)
+    invoices = []
+    for _ in range(count):
+        lines = [('fee', rng.randint(1, 500000), rng.choice([1, 1, rng.randint(1, 5000)])) for _ in range(rng.randint(0, 6))]
+        if rng.random() < 0.7:
+            line = ('interchange', rng.randint(0, 50000000), rng.randint(0, 500000), rng.choice([10, 25, '33.5', 50, 62.25, 75, '12.5']))
+            lines.insert(rng.randint(0, len(lines)), line)
+        invoices.append(lines)
+    return invoices
+
+# Interchange amounts whose exact 50% / 25% share lands on a half paisa. The old 28-digit
+# Decimal rounded the first of each pair down and the second up.
+TIES = [
+    ('interchange', 1234505, 0, 50), ('interchange', 1234501, 0, 50),
+    ('interchange', 1234502, 0, 25), ('interchange', 1234506, 0, 25),
+    ('interchange', 9, 0, 50), ('interchange', 14, 0, '25'),
+]
+
+@pytest.mark.parametrize('line', TIES)
+def test_interchange_ties_round_like_decimal(line):
+    units = interchange_line_units(line[1], line[2], line[3])
+    assert units[2] % UNITS_PER_PAISA == HALF_PAISA
+    assert engine_price([line]) == legacy_price([line])
+    assert price_invoices([[line]]) == [tuple(legacy_price([line]))]
+
+@pytest.mark.parametrize('line', TIES)
+def test_invoice_ties_round_like_decimal(line):
+    # Fee lines in whole paise keep the invoice total on the same half paisa, before and after the interchange line.
+    lines = [('fee', 100000, 1), line, ('fee', 250, 37)]
+    assert engine_price(lines) == legacy_price(lines)
+    assert price_invoices([lines]) == [tuple(legacy_price(lines))]
+
+def test_minimum_zero_and_odd_shares():
+    invoices = [
+        [('interchange', 100000, 250000, 50), ('fee', 99, 3)],
+        [('interchange', 0, 0, 50), ('fee', 100, 1)],
+        [('interchange', 1234505, 0, '33.333333')],
+        [('interchange', 1234505, 0, 33.3)],
+        [('fee', 1, 1)],
+        [],
+    ]
+    for lines in invoices:
+        assert engine_price(lines) == legacy_price(lines)
+    assert price_invoices(invoices) == [tuple(legacy_price(lines)) for lines in invoices]
+
+def test_random_invoices_match_decimal():
+    invoices = random_invoices(3000, seed=11)
+    expected = [tuple(legacy_price(lines)) for lines in invoices]
+    assert price_invoices(invoices) == expected
+    assert [engine_price(lines) for lines in invoices] == expected
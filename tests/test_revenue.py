@@ -0,0 +1,64 @@
+from datetime import date
+from decimal import Decimal
+
+from conftest import login
+from billing import run_billing
+from jobs import enqueue, dispatch
+from revenue import revenue_totals, rebuild_revenue, MONTHLY_KEYS, MONTHLY_SUMS, FEE_KEYS, FEE_SUMS
+from models import db, Invoice, EditedInvoice, RevenueMonthly, RevenueByFee
+
+def stored_totals():
+    # What revenue_monthly and revenue_by_fee hold, in the shape revenue_totals() returns.
+    tables = []
+    for model, keys, sums in ((RevenueMonthly, MONTHLY_KEYS, MONTHLY_SUMS), (RevenueByFee, FEE_KEYS, FEE_SUMS)):
+        rows = db.session.query(model).all()
+        tables.append({tuple(getattr(row, key) for key in keys): [getattr(row, column) for column in sums] for row in rows})
+    return tuple(tables)
+
+def generate(client_id, start_date, end_date, units):
+    job = enqueue('generate_invoice', {'client_id': client_id, 'start_date': start_date, 'end_date': end_date,
+                                       'form_data': {f'units_{fee_id}': count for fee_id, count in units.items()}})
+    db.session.commit()
+    dispatch(job)
+    return job.result
+
+def edit(client, invoice, **changes):
+    data = {column: getattr(invoice, column) for column in ('invoice_id', 'invoice_number', 'invoice_date', 'invoice_amount', 'tax_rate',
+                                                            'tax_amount', 'total_amount', 'invoice_type', 'invoice_month', 'charge_date',
+                                                            'taxable_amount', 'rounding_up', 'grand_total')}
+    # DataRequired rejects a zero amount, and billing rounds to the paisa, so rounding_up is 0.00.
+    data.update(invoice_amount_in_words='Edited', rounding_up='0.01')
+    data.update(changes)
+    response = client.post(f'/edit-invoice/{invoice.invoice_id}', data={key: str(value) for key, value in data.items()})
+    assert response.status_code == 302
+    db.session.expire_all()
+    return EditedInvoice.query.order_by(EditedInvoice.id.desc()).first().edited_invoice
+
+def test_incremental_totals_match_a_rebuild(app, client, billing_data):
+    run_billing(app, '2026-10')
+    generate('C1', '2026-11-01', '2026-11-30', {'F1': 1, 'F2': 40})
+    generate('C2', '2026-11-01', '2026-11-30', {'F2': 7})
+    db.session.expire_all()
+    assert stored_totals() == revenue_totals()
+
+    # Edits carry no line items, and can move an invoice to another month: the rows of the
+    # replaced invoices drop to zero and have to go rather than linger as zeros.
+    login(client, 'admin')
+    c2 = Invoice.query.filter_by(client_id='C2', invoice_month=date(2026, 11, 1)).one()
+    c3 = Invoice.query.filter_by(client_id='C3').one()
+    assert ('I1', 'C2', 'F2', date(2026, 11, 1)) in stored_totals()[1]
+    edited = edit(client, c2, invoice_month=date(2026, 12, 1), grand_total='99.50', taxable_amount='84.32', tax_amount='15.18')
+    edit(client, edited, invoice_month=date(2027, 1, 1), grand_total='101.00')
+    edit(client, c3, grand_total='7000.00')
+    generate('C3', '2026-11-01', '2026-11-30', {'F2': 3})
+
+    monthly, by_fee = stored_totals()
+    assert ('I1', 'C2', date(2026, 11, 1)) not in monthly and ('I1', 'C2', date(2026, 12, 1)) not in monthly
+    assert ('I1', 'C2', 'F2', date(2026, 11, 1)) not in by_fee
+    assert all(amounts[0] > 0 for totals in (monthly, by_fee) for amounts in totals.values())
+    assert monthly[('I1', 'C2', date(2027, 1, 1))] == [1, Decimal('84.32'), Decimal('15.18'), Decimal('101.00')]
+    assert (monthly, by_fee) == revenue_totals()
+
+    rebuild_revenue()
+    db.session.expire_all()
+    assert stored_totals() == (monthly, by_fee)
@@ -0,0 +1,124 @@
+import random
+from datetime import date
+
+import pytest
+
+import search
+from search import SEARCH_FIELDS, KIND_MODELS, normalize, _ranked
+from models import db, Client, Invoice
+
+def add_client(client_id, name, gstin=None, email=None):
+    client = Client(client_id=client_id, client_name=name, client_gstin=gstin, client_email=email, client_type='TSP Model')
+    db.session.add(client)
+    return client
+
+def add_invoice(invoice_id, number, client_id):
+    db.session.add(Invoice(invoice_id=invoice_id, invoice_number=number, invoice_date=date(2026, 10, 1), invoice_amount=0, client_id=client_id))
+
+def found(query, **kwargs):
+    return [(result['type'], result['id']) for result in search.search(query, **kwargs)]
+
+def sql_matches(query, limit, client_id=None):
+    # What the trigram backend's queries select: lower(column) containing the query, per field.
+    query = normalize(query)
+    matches = []
+    for (kind, field), column in SEARCH_FIELDS.items():
+        model, key = KIND_MODELS[kind]
+        for row_key, owner, value in db.session.query(key, model.client_id, column):
+            if value is not None and query in value.lower() and (client_id is None or owner == client_id):
+                matches.append((kind, row_key, field, value))
+    return [(kind, key) for kind, key, _, _ in _ranked(matches, query, limit)]
+
+def test_exact_then_prefix_then_substring(app):
+    for client_id, name in (('K1', 'Big Acme'), ('K2', 'Acme Corporation'), ('K3', 'acme'), ('K4', 'Acme Corp'),
+                            ('K5', 'Acme Bank'), ('K6', 'Zeta'), ('K7', 'Bacme')):
+        add_client(client_id, name)
+    add_invoice('INV-1', 'ACME-001', 'K6')
+    db.session.commit()
+    assert found('ACME') == [('client', 'K3'), ('invoice', 'INV-1'), ('client', 'K5'), ('client', 'K4'),
+                             ('client', 'K2'), ('client', 'K7'), ('client', 'K1')]
+    assert found('acme', limit=3) == [('client', 'K3'), ('invoice', 'INV-1'), ('client', 'K5')]
+    with pytest.raises(ValueError):
+        search.search(' a  ')
+
+def test_whitespace_is_matched_like_the_trigram_queries(app):
+    add_client('W1', 'Two  Spaces Ltd', email='two@example.com')
+    add_client('W2', '  Leading Blank')
+    add_client('W3', 'Line\nBreak Traders')
+    add_client('W4', 'Two Spaces Ltd')
+    db.session.commit()
+    assert found('two spaces') == sql_matches('two spaces', 20) == [('client', 'W4')]
+    assert found('two  spaces') == [('client', 'W4')]
+    assert found('spaces') == sql_matches('spaces', 20)
+    assert found('leading') == [('client', 'W2')]
+    assert found('break tr') == [('client', 'W3')] and found('line break') == []
+
+def test_random_values_match_the_trigram_queries(app):
+    rng = random.Random(24)
+    words = ['acme', 'bank', 'Corp', 'LTD', 'pay', 'cards', 'north', 'x']
+    gaps = [' ', ' ', ' ', '  ', '\t', '\n', '']
+    values = []
+    for n in range(60):
+        value = rng.choice(['', ' ']) + ''.join(rng.choice(words) + rng.choice(gaps) for _ in range(rng.randint(1, 4)))
+        values.append(value)
+        add_client(f'R{n}', value, email=f'{value.strip()[:10]}@mail.example' if n % 3 == 0 else None)
+        add_invoice(f'INV-R{n}', f'INV-{value.upper()[:8]}-{n}', f'R{n % 7}')
+    db.session.commit()
+
+    queries = {'acme', 'bank corp', 'corp', 'rds', 'north x', 'inv-acme', 'ltd', 'pay  cards', 'x@mail'}
+    queries |= {normalize(value)[start:start + 6] for value in values for start in (0, 3)}
+    for query in sorted(query for query in queries if len(query) >= search.MIN_QUERY_LENGTH):
+        assert found(query, limit=100) == sql_matches(query, 100), query
+        assert found(query, limit=100, client_id='R2') == sql_matches(query, 100, client_id='R2'), query
+
+def test_changed_rows_are_kept_aside_until_a_rebuild(app, monkeypatch):
+    monkeypatch.setattr(search, 'REBUILD_MIN_CHANGES', 2)
+    for n in range(10):
+        add_client(f'S{n}', f'Stale Name {n}')
+    db.session.commit()
+    assert len(found('stale name')) == 10
+    names = search._memory_index.fields[('client', 'client_name')]
+
+    db.session.get(Client, 'S1').client_name = 'Fresh Name 1'
+    db.session.get(Client, 'S2').client_name = 'Stale Name 2 Renamed'
+    db.session.commit()
+    assert ('client', 'S1') not in found('stale name')
+    assert found('fresh') == [('client', 'S1')]
+    assert found('renamed') == [('client', 'S2')]
+    assert names.stale == {'S1', 'S2'} and set(names.recent) == {'S1', 'S2'}
+
+    # A third change goes over REBUILD_MIN_CHANGES: the strings are rebuilt with all three.
+    db.session.get(Client, 'S3').client_name = 'Fresh Name 3'
+    db.session.commit()
+    assert found('fresh') == [('client', 'S1'), ('client', 'S3')]
+    assert names.stale == set() and names.recent == {}
+    assert len(found('stale name')) == 8
+
+def test_deletes_reload_the_index(app, monkeypatch):
+    for n in range(3):
+        add_client(f'D{n}', f'Deleted Maybe {n}')
+    add_invoice('INV-D0', 'DELETED-0', 'D0')
+    db.session.commit()
+    assert len(found('deleted maybe')) == 3
+
+    loads = []
+    load = search.MemorySearchIndex.load
+    monkeypatch.setattr(search.MemorySearchIndex, 'load', lambda self, kind: loads.append(kind) or load(self, kind))
+    assert len(found('deleted maybe')) == 3
+    assert loads == []
+
+    db.session.delete(db.session.get(Client, 'D1'))
+    db.session.commit()
+    assert found('deleted maybe') == [('client', 'D0'), ('client', 'D2')]
+    assert loads == ['client']
+
+def test_client_id_keeps_to_one_clients_rows(app):
+    add_client('C1', 'Scoped One', email='scope@one.example')
+    add_client('C2', 'Scoped Two')
+    add_invoice('INV-S1', 'SCOPE-1', 'C1')
+    add_invoice('INV-S2', 'SCOPE-2', 'C2')
+    db.session.commit()
+    assert found('scope', client_id='C1') == [('invoice', 'INV-S1'), ('client', 'C1')]
+    assert found('scope', client_id='C2') == [('invoice', 'INV-S2'), ('client', 'C2')]
+    assert found('scope', client_id='C3') == []
+    assert len(found('scope')) == 4
@@ -0,0 +1,71 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+import user_cache
+from conftest import login
+from user_cache import SESSION_KEY, user_stamp, forget_user
+from models import db, User
+
+PASSWORD_ELSEWHERE = 'changed-elsewhere'
+
+def admin_page(client):
+    # 200 while the session authenticates; 401 from flask_login once it doesn't.
+    return client.get('/admin').status_code
+
+def change_admin(**values):
+    User.query.filter_by(user_id='U1').update(values)
+    db.session.commit()
+
+@pytest.mark.parametrize('change', [{'password': generate_password_hash('new-password')}, {'role': 'user'}])
+def test_password_or_role_change_ends_the_session(app, client, billing_data, change):
+    login(client, 'admin')
+    assert admin_page(client) == 200
+    assert user_cache._entries['U1'][1].stamp == user_stamp(db.session.get(User, 'U1'))
+
+    # Changed here: this worker forgets the user and refuses the old session at once.
+    change_admin(**change)
+    forget_user('U1')
+    assert admin_page(client) == 401
+    assert admin_page(client) == 401
+
+def test_change_elsewhere_is_seen_when_the_entry_expires(app, client, billing_data):
+    login(client, 'admin')
+    assert admin_page(client) == 200
+
+    # Changed by another worker: the cached identity holds until USER_CACHE_TTL runs out.
+    change_admin(role='user')
+    assert admin_page(client) == 200
+    loaded, identity = user_cache._entries['U1']
+    user_cache._entries['U1'] = (loaded - app.config['USER_CACHE_TTL'], identity)
+    assert admin_page(client) == 401
+
+def test_stale_entry_is_checked_against_the_database(app, client, billing_data):
+    login(client, 'admin')
+    assert admin_page(client) == 200
+    old_stamp = user_cache._entries['U1'][1].stamp
+
+    # A new password set by another worker, and a login with it there: this worker's entry
+    # still has the old stamp, so the new session's stamp is checked against the database.
+    change_admin(password=generate_password_hash(PASSWORD_ELSEWHERE))
+    fresh = app.test_client()
+    assert fresh.post('/login', data={'username': 'admin', 'password': PASSWORD_ELSEWHERE}).status_code == 302
+    assert user_cache._entries['U1'][1].stamp == old_stamp
+    assert admin_page(fresh) == 200
+    assert user_cache._entries['U1'][1].stamp == user_stamp(db.session.get(User, 'U1')) != old_stamp
+
+    # The entry now has the new stamp, and the session from before the change is refused.
+    assert admin_page(client) == 401
+    assert admin_page(fresh) == 200
+
+def test_session_without_a_stamp_gets_stamped(app, client, billing_data):
+    login(client, 'admin')
+    with client.session_transaction() as session:
+        del session[SESSION_KEY]
+    assert admin_page(client) == 200
+    with client.session_transaction() as session:
+        assert session[SESSION_KEY] == user_stamp(db.session.get(User, 'U1'))
+
+    # Stamped with the user as it is now, so a later change ends it like any other session.
+    change_admin(password=generate_password_hash('new-password'))
+    forget_user('U1')
+    assert admin_page(client) == 401
@@ -0,0 +1,12 @@
+import importlib.util
+import os
+import sys
+
+# app.py can't be imported as `app` because the app/ package shadows it. Load it under
+# another name, registered so that Flask finds its root and instance paths from the file.
+spec = importlib.util.spec_from_file_location('invoice_app', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'))
+module = sys.modules[spec.name] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+create_app = module.create_app
+
+app = create_app(os.getenv('FLASK_CONFIG') or 'default')